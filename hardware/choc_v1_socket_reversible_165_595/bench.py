@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# Benchmark kbd_place_n_route stage by stage on every board in hardware/ that it generates
+# usage: python3 bench.py [board directory ...] [-q]
+# boards with their own placement script or without the footprints of the routing stages are left out,
+# naming one of them is an error
+# results are appended to autogen_bench_history.json, the last run is compared with the one before
+import sys, re, json, gc, time, resource, subprocess, traceback
+from os import listdir, path, chdir, getcwd, remove
+from concurrent.futures import ProcessPoolExecutor
+import switch_placement
+from switch_placement import kbd_place_n_route, PLACE_STAGES, ROUTE_STAGES
+
+SRC_DIR = path.dirname(path.abspath(__file__))
+HISTORY = path.join(SRC_DIR, 'autogen_bench_history.json')
+# Run() methods that are timed, in call order, SaveBoard is timed through the module global
+STAGES = ['load_board', 'remove_old_tracks'] + PLACE_STAGES + ['update_pad_pos'] + list(ROUTE_STAGES) + \
+	['commit_tracks', 'place_edge_cut', 'place_copper_pour', 'place_copper_pour_incremental']
+REFERENCE = re.compile(r'\((?:property "Reference"|fp_text reference) "([^"]+)"')
+
+def board_dirs(paths):
+	# directories with a board file, default is every board next to this one
+	if not paths:
+		root = path.dirname(SRC_DIR)
+		paths = [path.join(root, d) for d in sorted(listdir(root))]
+	return [path.abspath(p) for p in paths if path.isdir(p) and
+		any(f.endswith('.kicad_pcb') and 'auto' not in f for f in listdir(p))]
+
+def board_file(board_dir):
+	return path.join(board_dir, [f for f in sorted(listdir(board_dir)) if f.endswith('.kicad_pcb') and 'auto' not in f][0])
+
+def incompatible(board_dir):
+	# Why kbd_place_n_route can't run the board in board_dir, None if it can
+	# the board file is only scanned as text so the benchmark processes don't inherit a loaded board
+	own = path.join(board_dir, 'switch_placement.py')
+	if path.exists(own) and not path.samefile(own, path.join(SRC_DIR, 'switch_placement.py')):
+		return f"placed by its own {own}"
+	with open(board_file(board_dir), 'r') as f:
+		refs = set(REFERENCE.findall(f.read()))
+	needed = set(p for prefixes in ROUTE_STAGES.values() for p in prefixes)
+	missing = sorted(p for p in needed if not any(ref.startswith(p) for ref in refs))
+	if missing:
+		return f"no {', '.join(missing)} footprints for the routing stages"
+	return None
+
+class StageTimer:
+	# Wraps plugin stages, a stage that raises is recorded as skipped and Run() goes on
+	def __init__(self, plugin):
+		self.plugin = plugin
+		self.stages = []
+
+	def measure(self, name, func, *args):
+		start = time.perf_counter()
+		result = {'stage': name}
+		try:
+			func(*args)
+		except Exception as e:
+			result['skipped'] = f'{type(e).__name__}: {e}'
+		result['time_s'] = round(time.perf_counter() - start, 4)
+		result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		result['objects'] = len(gc.get_objects())
+		board = getattr(self.plugin, 'board', None)
+		if board is not None and 'skipped' not in result:
+			result['tracks'] = len(board.GetTracks()) + self.plugin.track_buf.track_count() + self.plugin.track_buf.via_count()
+		self.stages.append(result)
+
+	def wrap(self, name, func):
+		return lambda *args: self.measure(name, func, *args)
+
+def bench_board(board_dir, is_fast_mode=False):
+	# Runs in its own process so peak RSS belongs to this board only
+	cwd = getcwd()
+	chdir(board_dir)
+	plugin = kbd_place_n_route(is_fast_mode)
+	plugin.output_filename = 'autogen_bench.kicad_pcb'
+	plugin.use_maze_cache = False # time the maze routing, not the replay
+	timer = StageTimer(plugin)
+	for name in STAGES:
+		setattr(plugin, name, timer.wrap(name, getattr(plugin, name)))
+	save_board = switch_placement.SaveBoard
+	switch_placement.SaveBoard = timer.wrap('SaveBoard', save_board)
+	start = time.perf_counter()
+	try:
+		plugin.Run()
+	except Exception:
+		traceback.print_exc() # outside of a stage, ie Refresh()
+	finally:
+		switch_placement.SaveBoard = save_board
+		if path.exists(plugin.output_filename):
+			remove(plugin.output_filename)
+		chdir(cwd)
+	return {
+		'board': path.basename(board_dir),
+		'total_s': round(time.perf_counter() - start, 4),
+		'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		'stages': timer.stages,
+	}
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC_DIR,
+			capture_output=True, text=True).stdout.strip()
+	except OSError:
+		return ''
+
+def load_history():
+	if not path.exists(HISTORY):
+		return []
+	try:
+		with open(HISTORY, 'r') as f:
+			return json.load(f)
+	except ValueError:
+		return [] # corrupted history, start over
+
+def print_report(run, prev):
+	# stage times of this run and the change from the previous run of the same board
+	prev_boards = {b['board']: b for b in prev['boards']} if prev else {}
+	for board in run['boards']:
+		print(f"# {board['board']}: {board['total_s']:.3f} s, peak RSS {board['peak_rss_kb']} kB")
+		print(f"{'stage':<40}{'time s':>9}{'delta':>10}{'rss kB':>10}{'objects':>9}")
+		prev_times = {s['stage']: s['time_s'] for s in prev_boards.get(board['board'], {}).get('stages', [])}
+		for s in board['stages']:
+			delta = ''
+			if s['stage'] in prev_times and 'skipped' not in s:
+				delta = f"{s['time_s'] - prev_times[s['stage']]:+.4f}"
+			note = f"  skipped ({s['skipped']})" if 'skipped' in s else ''
+			print(f"{s['stage']:<40}{s['time_s']:>9.4f}{delta:>10}{s['peak_rss_kb']:>10}{s['objects']:>9}{note}")
+
+def main():
+	is_fast_mode = '-q' in sys.argv # skip copper pour
+	paths = [a for a in sys.argv[1:] if not a.startswith('-')]
+	dirs = []
+	for d in board_dirs(paths):
+		reason = incompatible(d)
+		if reason is None:
+			dirs.append(d)
+		elif paths:
+			print(f"Error: {d}: {reason}, can't benchmark it with this kbd_place_n_route")
+			sys.exit(1)
+		else:
+			print(f"# {path.basename(d)}: left out, {reason}")
+	if not dirs:
+		print("Error: no board to benchmark")
+		sys.exit(1)
+	boards = []
+	for d in dirs:
+		# fresh process per board, max_workers=1 keeps the timings from competing for cores
+		with ProcessPoolExecutor(max_workers=1) as pool:
+			boards.append(pool.submit(bench_board, d, is_fast_mode).result())
+	run = {
+		'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'commit': git_commit(),
+		'backend': switch_placement.BACKEND,
+		'fast_mode': is_fast_mode,
+		'boards': boards,
+	}
+	history = load_history()
+	prev = next((r for r in reversed(history) if r.get('fast_mode') == is_fast_mode), None)
+	print_report(run, prev)
+	history.append(run)
+	with open(HISTORY, 'w') as f:
+		json.dump(history, f, indent=1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+from collections import deque
+from math import sin, cos, radians
+from drc_lite import point_seg, LAYER_BITS, LAYER_TEXT
+from kbd_backend import *
+
+# nets with pads that are not expected to be joined by tracks
+POURED_NETS = ('GND',)
+
+def routed_net(net):
+	return net != '' and not net.startswith('unconnected-')
+
+class NetVerifier:
+	# Connectivity of the generated tracks and vias and the footprint pads (kbd_model.Pad)
+	# endpoints meet through an exact hash of their coordinates, T junctions, vias and pads through
+	# a uniform grid, pieces are joined with union-find, about linear in the number of items
+	def __init__(self, cell=FromMM(1), poured_nets=POURED_NETS):
+		self.cell = cell
+		self.poured_nets = set(poured_nets)
+		self.kind = [] # 'seg', 'via' or 'pad' per node
+		self.geom = [] # seg: (x0, y0, x1, y1, width, layer bits), via: (x, y, radius), pad: (x, y, hw, hh, layer bits, cos, sin)
+		self.desc = []
+		self.net = [] # pad net, None for tracks and vias
+		self.parent = []
+		self.edges = [] # (node, node) of every contact found
+
+	def node(self, kind, geom, desc, net=None):
+		self.kind.append(kind)
+		self.geom.append(geom)
+		self.desc.append(desc)
+		self.net.append(net)
+		self.parent.append(len(self.parent))
+		return len(self.parent) - 1
+
+	def add_segment(self, x0, y0, x1, y1, width, layer):
+		bits = LAYER_BITS[layer]
+		return self.node('seg', (x0, y0, x1, y1, width, bits),
+			f'track {LAYER_TEXT[bits]} ({ToMM(x0):.3f}, {ToMM(y0):.3f})-({ToMM(x1):.3f}, {ToMM(y1):.3f})')
+
+	def add_via(self, x, y, width):
+		return self.node('via', (x, y, width/2), f'via ({ToMM(x):.3f}, {ToMM(y):.3f})')
+
+	def add_pad(self, ref, pad, layer):
+		# the rotated rectangle stands in for the pad shape, the corners of round pads are a little too generous
+		bits = 3 if pad.both else LAYER_BITS[layer]
+		c, s = cos(radians(pad.angle)), sin(radians(pad.angle))
+		return self.node('pad', (pad.x, pad.y, pad.hw, pad.hh, bits, c, s), f'pad {ref}.{pad.num} ({pad.net})', pad.net)
+
+	def find(self, i):
+		parent = self.parent
+		while parent[i] != i:
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+
+	def union(self, i, j):
+		self.edges.append((i, j))
+		a, b = self.find(i), self.find(j)
+		if a != b:
+			self.parent[b] = a
+
+	def points(self):
+		# (node, x, y, layer bits) of the points that make contacts: segment ends, vias and pad centers
+		for i, kind in enumerate(self.kind):
+			g = self.geom[i]
+			if kind == 'seg':
+				yield i, g[0], g[1], g[5]
+				yield i, g[2], g[3], g[5]
+			elif kind == 'via':
+				yield i, g[0], g[1], 3
+			else:
+				yield i, g[0], g[1], g[4]
+
+	def build_grid(self):
+		grid = {}
+		cell = self.cell
+		for i, kind in enumerate(self.kind):
+			g = self.geom[i]
+			if kind == 'seg':
+				r = g[4]/2
+				x0, x1, y0, y1 = min(g[0], g[2]) - r, max(g[0], g[2]) + r, min(g[1], g[3]) - r, max(g[1], g[3]) + r
+			elif kind == 'via':
+				x0, x1, y0, y1 = g[0] - g[2], g[0] + g[2], g[1] - g[2], g[1] + g[2]
+			else:
+				rx = abs(g[2]*g[5]) + abs(g[3]*g[6])
+				ry = abs(g[2]*g[6]) + abs(g[3]*g[5])
+				x0, x1, y0, y1 = g[0] - rx, g[0] + rx, g[1] - ry, g[1] + ry
+			for gx in range(int(x0 // cell), int(x1 // cell) + 1):
+				for gy in range(int(y0 // cell), int(y1 // cell) + 1):
+					grid.setdefault((gx, gy), []).append(i)
+		return grid
+
+	def touches(self, j, x, y, bits):
+		# point (x, y) on layers bits lies on the copper of node j
+		g = self.geom[j]
+		kind = self.kind[j]
+		if kind == 'seg':
+			return bits & g[5] and point_seg((x, y), (g[0], g[1]), (g[2], g[3]))[0] <= g[4]/2
+		if kind == 'via':
+			return (x - g[0])**2 + (y - g[1])**2 <= g[2]**2
+		# into the pad frame, KiCad angles are counterclockwise with y down
+		dx, dy = x - g[0], y - g[1]
+		u, v = dx*g[5] - dy*g[6], dx*g[6] + dy*g[5]
+		return bits & g[4] and abs(u) <= g[2] and abs(v) <= g[3]
+
+	def connect(self):
+		# points with the same coordinates, then points landing on other copper
+		# returns the number of contacts of each segment end, keyed by (node, x, y)
+		points = list(self.points())
+		hits = {}
+		same = {}
+		for i, x, y, bits in points:
+			if self.kind[i] == 'seg':
+				hits[(i, x, y)] = 0
+			for b in (1, 2):
+				if bits & b:
+					same.setdefault((x, y, b), []).append(i)
+		for (x, y, b), members in same.items():
+			for j in members[1:]:
+				self.union(members[0], j)
+			for i in members:
+				if self.kind[i] == 'seg':
+					hits[(i, x, y)] += len(members) - 1
+		grid = self.build_grid()
+		cell = self.cell
+		for i, x, y, bits in points:
+			is_pad = self.kind[i] == 'pad'
+			for j in grid.get((int(x // cell), int(y // cell)), ()):
+				# pads only meet pads through tracks
+				if j == i or (is_pad and self.kind[j] == 'pad') or not self.touches(j, x, y, bits):
+					continue
+				self.union(i, j)
+				if not is_pad and self.kind[i] == 'seg':
+					hits[(i, x, y)] += 1
+		return hits
+
+	def verify(self):
+		# Returns (unrouted, dangling, shorts)
+		#   unrouted: [(net, [pad descriptions not joined to the largest piece of the net, one per pad number])]
+		#   dangling: [(description, x, y)] segment ends touching nothing
+		#   shorts: [(net a, net b, description of the copper where they meet)]
+		hits = self.connect()
+		pieces = {} # net -> root -> pad nodes
+		for i, net in enumerate(self.net):
+			if net is not None and routed_net(net) and net not in self.poured_nets:
+				pieces.setdefault(net, {}).setdefault(self.find(i), []).append(i)
+		unrouted = []
+		for net, roots in sorted(pieces.items()):
+			if len(roots) > 1:
+				groups = sorted(roots.values(), key=len, reverse=True)
+				# the front and back copy of a reversible footprint's pad are listed once
+				unrouted.append((net, list(dict.fromkeys(self.desc[i] for g in groups[1:] for i in g))))
+		dangling = []
+		for (i, x, y), n in hits.items():
+			if n == 0 and self.kind[i] == 'seg':
+				dangling.append((self.desc[i], x, y))
+		return unrouted, sorted(dangling), self.shorts()
+
+	def labels(self):
+		# Net of every node, breadth first from every pad at once so copper joining two nets is split
+		# between them, None for copper that reaches no pad, call after connect()
+		adj = [[] for _ in self.parent]
+		for i, j in self.edges:
+			adj[i].append(j)
+			adj[j].append(i)
+		label = [None] * len(self.parent)
+		queue = deque()
+		for i, net in enumerate(self.net):
+			if net is not None and routed_net(net):
+				label[i] = net
+				queue.append(i)
+		while queue:
+			i = queue.popleft()
+			for j in adj[i]:
+				if label[j] is None:
+					label[j] = label[i]
+					queue.append(j)
+		return label
+
+	def shorts(self):
+		# a contact between copper reached from two nets is where they meet
+		label = self.labels()
+		found = {}
+		for i, j in self.edges:
+			a, b = label[i], label[j]
+			if a is not None and b is not None and a != b:
+				key = (a, b) if a < b else (b, a)
+				# the track or via between the two nets, not the pad
+				found.setdefault(key, self.desc[j] if self.kind[i] == 'pad' else self.desc[i])
+		return [(a, b, desc) for (a, b), desc in sorted(found.items())]
+
+	def report(self, result):
+		unrouted, dangling, shorts = result
+		for net, pads in unrouted:
+			print(f'unrouted {net}: {", ".join(pads)}')
+		for desc, x, y in dangling:
+			print(f'dangling end at ({ToMM(x):.3f}, {ToMM(y):.3f}) mm: {desc}')
+		for a, b, desc in shorts:
+			print(f'short {a} <-> {b}: {desc}')
+		print(f'{len(unrouted)} unrouted nets, {len(dangling)} dangling ends, {len(shorts)} shorts')
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+from math import sin, cos, radians, hypot
+from kbd_backend import *
+
+LAYER_BITS = {F_Cu: 1, B_Cu: 2}
+LAYER_TEXT = {1: 'F.Cu', 2: 'B.Cu', 3: 'F.Cu/B.Cu'}
+
+class ClearanceError(ValueError):
+	def __init__(self, violations):
+		ValueError.__init__(self, f'{len(violations)} clearance violations')
+		self.violations = violations
+
+def point_seg(p, a, b):
+	# distance from p to segment ab and the closest point on ab
+	dx, dy = b[0]-a[0], b[1]-a[1]
+	l2 = dx*dx + dy*dy
+	t = 0 if l2 == 0 else max(0, min(1, ((p[0]-a[0])*dx + (p[1]-a[1])*dy) / l2))
+	c = (a[0] + t*dx, a[1] + t*dy)
+	return hypot(p[0]-c[0], p[1]-c[1]), c
+
+def cross(o, a, b):
+	return (a[0]-o[0])*(b[1]-o[1]) - (a[1]-o[1])*(b[0]-o[0])
+
+def seg_seg(a, b, c, d):
+	# distance between segments ab and cd and a point between the closest points
+	d1, d2, d3, d4 = cross(c, d, a), cross(c, d, b), cross(a, b, c), cross(a, b, d)
+	if ((d1 > 0) != (d2 > 0)) and ((d3 > 0) != (d4 > 0)) and d1 != d2:
+		t = d1 / (d1 - d2)
+		return 0, (a[0] + t*(b[0]-a[0]), a[1] + t*(b[1]-a[1]))
+	best = None
+	for p, q, r in ((a, c, d), (b, c, d), (c, a, b), (d, a, b)):
+		dist, closest = point_seg(p, q, r)
+		if best is None or dist < best[0]:
+			best = (dist, ((p[0]+closest[0])/2, (p[1]+closest[1])/2))
+	return best
+
+def edges(pts):
+	if len(pts) < 3:
+		return [(pts[0], pts[-1])]
+	return [(pts[i], pts[(i+1) % len(pts)]) for i in range(len(pts))]
+
+def inside(p, poly):
+	# p inside the convex polygon poly (either winding)
+	if len(poly) < 3:
+		return False
+	signs = [cross(poly[i], poly[(i+1) % len(poly)], p) for i in range(len(poly))]
+	return all(s >= 0 for s in signs) or all(s <= 0 for s in signs)
+
+def shape_dist(s, t):
+	# distance between the cores of two shapes (points, segment or convex polygon)
+	for p in s:
+		if inside(p, t):
+			return 0, p
+	for p in t:
+		if inside(p, s):
+			return 0, p
+	best = None
+	for a, b in edges(s):
+		for c, d in edges(t):
+			dist = seg_seg(a, b, c, d)
+			if best is None or dist[0] < best[0]:
+				best = dist
+	return best
+
+class ClearanceChecker:
+	# DRC-lite: every shape is a point, segment or convex polygon grown by a radius
+	# candidate pairs come from a uniform grid, so a check is about linear in the number of items
+	def __init__(self, clearance, cell=FromMM(1)):
+		self.clearance = clearance
+		self.epsilon = FromMM(0.0005) # KiCad's DRC epsilon, 1 nm rounding of a gap at the rule isn't a violation
+		self.cell = cell
+		self.items = [] # (core points, radius, layer bits, net or None, is pad, description)
+		self.owners = [] # (reference, pad number) of pad items, None for tracks and vias
+
+	def add(self, pts, radius, layers, net, is_pad, desc, owner=None):
+		self.items.append((pts, radius, layers, net, is_pad, desc))
+		self.owners.append(owner)
+
+	def add_segment(self, x0, y0, x1, y1, width, layer):
+		self.add([(x0, y0), (x1, y1)], width/2, LAYER_BITS[layer], None, False,
+			f'track {LAYER_TEXT[LAYER_BITS[layer]]} ({ToMM(x0):.3f}, {ToMM(y0):.3f})-({ToMM(x1):.3f}, {ToMM(y1):.3f})')
+
+	def add_via(self, x, y, width):
+		self.add([(x, y)], width/2, 3, None, False, f'via ({ToMM(x):.3f}, {ToMM(y):.3f})')
+
+	def add_pad(self, pad):
+		layers = (1 if pad.IsOnLayer(F_Cu) else 0) | (2 if pad.IsOnLayer(B_Cu) else 0)
+		if not layers:
+			return
+		pos = pad.GetCenter()
+		size = pad.GetSize()
+		shape = pad.GetShapeName()
+		c, s = cos(radians(pad.GetOrientationDegrees())), sin(radians(pad.GetOrientationDegrees()))
+		rot = lambda dx, dy: (pos.x + dx*c + dy*s, pos.y - dx*s + dy*c)
+		if shape == 'circle':
+			pts, r = [(pos.x, pos.y)], size.x/2
+		elif shape == 'oval':
+			# capsule along the long side
+			r = min(size.x, size.y)/2
+			a = (size.x/2 - r, 0) if size.x > size.y else (0, size.y/2 - r)
+			pts = [rot(a[0], a[1]), rot(-a[0], -a[1])]
+		else: # rect, roundrect and custom pads (anchor only)
+			r = pad.GetRoundRectCornerRadius() if shape == 'roundrect' else 0
+			hw, hh = size.x/2 - r, size.y/2 - r
+			pts = [rot(-hw, -hh), rot(hw, -hh), rot(hw, hh), rot(-hw, hh)]
+		net = pad.GetNetname() or None
+		if pad.GetAttribute() == PAD_ATTRIB_NPTH: # no copper, but tracks still keep their distance from the hole
+			self.add(pts, r, layers, None, True, f'hole {pad.GetParentAsString()} ({ToMM(pos.x):.3f}, {ToMM(pos.y):.3f})')
+		else:
+			self.add(pts, r, layers, net, True, f'pad {pad.GetParentAsString()}.{pad.GetNumber()} ({net})',
+				(pad.GetParentAsString(), pad.GetNumber()))
+
+	def candidate_pairs(self):
+		grid = {}
+		for i, (pts, r, *_) in enumerate(self.items):
+			grow = r + self.clearance/2
+			x0 = int((min(p[0] for p in pts) - grow) // self.cell)
+			x1 = int((max(p[0] for p in pts) + grow) // self.cell)
+			y0 = int((min(p[1] for p in pts) - grow) // self.cell)
+			y1 = int((max(p[1] for p in pts) + grow) // self.cell)
+			for gx in range(x0, x1+1):
+				for gy in range(y0, y1+1):
+					grid.setdefault((gx, gy), []).append(i)
+		pairs = set()
+		items = self.items
+		for members in grid.values():
+			for k, i in enumerate(members):
+				for j in members[k+1:]:
+					# footprint pads are not checked against each other
+					if items[i][2] & items[j][2] and not (items[i][4] and items[j][4]):
+						pairs.add((i, j) if i < j else (j, i))
+		return sorted(pairs)
+
+	def connect(self):
+		# Join touching copper, returns the group finder, the nets of each group,
+		# the shorts and the pairs closer than the clearance
+		items = self.items
+		parent = list(range(len(items)))
+		nets = [{item[3]} if item[3] else set() for item in items]
+		def find(i):
+			while parent[i] != i:
+				parent[i] = parent[parent[i]]
+				i = parent[i]
+			return i
+		violations = []
+		close = []
+		for i, j in self.candidate_pairs():
+			dist, at = shape_dist(items[i][0], items[j][0])
+			dist -= items[i][1] + items[j][1]
+			layers = items[i][2] & items[j][2]
+			if dist <= 0: # touching, connected copper
+				a, b = find(i), find(j)
+				if a == b:
+					continue
+				if nets[a] and nets[b] and nets[a] != nets[b]:
+					violations.append(('short', layers, at[0], at[1], dist, items[i][5], items[j][5]))
+				parent[b] = a
+				nets[a] |= nets[b]
+			elif dist < self.clearance - self.epsilon:
+				close.append((i, j, dist, at, layers))
+		return find, nets, violations, close
+
+	def check(self):
+		# Shorts between different nets and clearance violations, as
+		# [(kind, layers, x, y, distance, description a, description b)], distances in IU
+		items = self.items
+		find, nets, violations, close = self.connect()
+		for i, j, dist, at, layers in close:
+			a, b = find(i), find(j)
+			# copper of the same net (ie joined later by the pour) may come close
+			if a != b and not (nets[a] and nets[a] == nets[b]):
+				violations.append(('clearance', layers, at[0], at[1], dist, items[i][5], items[j][5]))
+		return violations
+
+	def report(self, violations):
+		for kind, layers, x, y, dist, a, b in violations:
+			print(f'{kind} on {LAYER_TEXT[layers]} at ({ToMM(x):.3f}, {ToMM(y):.3f}) mm, {ToMM(max(dist, 0)):.3f} mm: {a} <-> {b}')
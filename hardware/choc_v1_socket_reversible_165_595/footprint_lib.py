@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Index of the .kicad_mod footprints of the libraries in fp-lib-table: pads, courtyards and how the
+# footprint looks flipped, each file is parsed once and kept in autogen_fp_lib.pickle until it changes
+# usage: python3 footprint_lib.py [-v]
+#   checks the board footprints against their library, -v: print every library footprint
+import sys, pickle, re
+from os import path, listdir, stat
+from kbd_backend import *
+from kicad_sexpr import parse, unquote, read_mm
+
+LAYER_F, LAYER_B = 1, 2
+
+def swap_sides(bits):
+	return ((bits & LAYER_F) << 1) | ((bits & LAYER_B) >> 1)
+
+def copper_bits(layers):
+	bits = 0
+	for layer in layers:
+		if layer in ('*.Cu', 'F&B.Cu'):
+			bits |= LAYER_F | LAYER_B
+		elif layer == 'F.Cu':
+			bits |= LAYER_F
+		elif layer == 'B.Cu':
+			bits |= LAYER_B
+	return bits
+
+def read_lib_table(filename):
+	# library nickname -> directory, ${KIPRJMOD} is the directory of the table
+	libs = {}
+	if not path.exists(filename):
+		return libs
+	with open(filename, 'r') as f:
+		table = f.read()
+	for name, uri in re.findall(r'\(lib\s+\(name\s+"?([^")]+)"?\).*?\(uri\s+"?([^")]+)"?\)', table):
+		libs[name] = path.normpath(uri.replace('${KIPRJMOD}', path.dirname(path.abspath(filename))))
+	return libs
+
+def flip_pads(pads, left_right=False):
+	# pads of the footprint flipped to the other side around its origin, top to bottom like FOOTPRINT.Flip()
+	# or left to right (top to bottom and turned by 180 degrees)
+	if left_right:
+		return [(num, -x, y, (180 - angle) % 360, w, h, swap_sides(bits)) for num, x, y, angle, w, h, bits in pads]
+	return [(num, x, -y, -angle % 360, w, h, swap_sides(bits)) for num, x, y, angle, w, h, bits in pads]
+
+def same_copper(a, b, tolerance=1000):
+	# same numbered pads on the same layers, positions within tolerance (1 um), pad order doesn't matter
+	# angles are compared modulo 180, a rectangle turned half a turn is the same copper
+	key = lambda p: (p[0], p[6], round(p[1], -4), round(p[2], -4))
+	a = sorted((p for p in a if p[0] != ''), key=key)
+	b = sorted((p for p in b if p[0] != ''), key=key)
+	if len(a) != len(b):
+		return False
+	for p, q in zip(a, b):
+		if p[0] != q[0] or p[6] != q[6] or p[4:6] != q[4:6] or abs(p[1]-q[1]) > tolerance or abs(p[2]-q[2]) > tolerance \
+			or abs((p[3]-q[3] + 90) % 180 - 90) > 1e-6:
+			return False
+	return True
+
+class LibFootprint:
+	# Geometry of one library footprint in footprint coordinates, internal units
+	# pads: [(number, x, y, angle, width, height, layer bits)] of the copper pads, holes have number ''
+	# courtyard: layer bits -> (x0, y0, x1, y1) bounding box of the courtyard on that side
+	# flip: 'top_bottom' or 'left_right' when flipping that way gives back the same copper, else ''
+	__slots__ = ('fpid', 'attr', 'pads', 'courtyard', 'flip')
+
+	def __init__(self, fpid, attr, pads, courtyard, flip=None):
+		self.fpid = fpid
+		self.attr = attr
+		self.pads = pads
+		self.courtyard = courtyard
+		if flip is None:
+			flip = ''
+			if pads and same_copper(flip_pads(pads), pads):
+				flip = 'top_bottom'
+			elif pads and same_copper(flip_pads(pads, True), pads):
+				flip = 'left_right'
+		self.flip = flip
+
+	def state(self):
+		# plain tuple for the cache file
+		return (self.fpid, self.attr, self.pads, self.courtyard, self.flip)
+
+	@classmethod
+	def parse(cls, fpid, buf):
+		root = parse(buf)
+		if root is None or root.name not in ('footprint', 'module'):
+			raise ValueError("not a footprint")
+		attr = root.find('attr')
+		pads = []
+		courtyard = {}
+		for node in root.children():
+			if node.name == 'pad':
+				layers = node.find('layers')
+				bits = copper_bits([unquote(a) for a in layers.items[1:] if type(a) is bytes]) if layers is not None else 0
+				if bits == 0:
+					continue
+				at, size = node.find('at'), node.find('size')
+				angle = float(at.items[3]) if len(at.items) > 3 else 0.0
+				pads.append((node.atom(1), read_mm(at.items[1]), read_mm(at.items[2]), angle,
+					read_mm(size.items[1]), read_mm(size.items[2]), bits))
+			elif node.name.startswith('fp_'):
+				layer = node.find('layer')
+				side = {'F.CrtYd': LAYER_F, 'B.CrtYd': LAYER_B}.get(layer.atom(1)) if layer is not None else None
+				if side is None:
+					continue
+				box = courtyard.get(side)
+				for x0, y0, x1, y1 in shape_boxes(node):
+					box = (x0, y0, x1, y1) if box is None else (min(box[0], x0), min(box[1], y0), max(box[2], x1), max(box[3], y1))
+				if box is not None:
+					courtyard[side] = box
+		return cls(fpid, attr.atom(1) if attr is not None else '', pads, courtyard)
+
+def shape_boxes(node):
+	# bounding boxes of the points of a graphic shape, arcs by their three points
+	pts = []
+	for child in node.children():
+		if child.name in ('start', 'end', 'mid', 'center'):
+			pts.append((child.name, read_mm(child.items[1]), read_mm(child.items[2])))
+		elif child.name == 'pts':
+			pts += [('xy', read_mm(xy.items[1]), read_mm(xy.items[2])) for xy in child.findall('xy')]
+	if node.name == 'fp_circle':
+		c = next((p for p in pts if p[0] == 'center'), None)
+		e = next((p for p in pts if p[0] == 'end'), None)
+		if c and e:
+			r = round(((e[1]-c[1])**2 + (e[2]-c[2])**2) ** 0.5)
+			yield c[1] - r, c[2] - r, c[1] + r, c[2] + r
+		return
+	if pts:
+		xs, ys = [p[1] for p in pts], [p[2] for p in pts]
+		yield min(xs), min(ys), max(xs), max(ys)
+
+class FootprintLibrary:
+	# LibFootprint of a library ID ('nickname:name'), files are checked by mtime and size once per
+	# instance and parsed again only when they changed
+	def __init__(self, lib_table='fp-lib-table', filename='autogen_fp_lib.pickle'):
+		self.filename = filename
+		self.libs = read_lib_table(lib_table)
+		self.files = {} # .kicad_mod path -> ((mtime, size), LibFootprint.state())
+		self.checked = {} # library ID -> LibFootprint or None, what get() found so far
+		self.changed = False
+		if self.filename and path.exists(self.filename):
+			try:
+				with open(self.filename, 'rb') as f:
+					self.files = pickle.load(f)
+			except (pickle.UnpicklingError, EOFError, ValueError):
+				self.files = {} # corrupted cache, parse again
+
+	def file_of(self, fpid):
+		nick, _, name = fpid.partition(':')
+		if nick not in self.libs:
+			return None
+		return path.join(self.libs[nick], name + '.kicad_mod')
+
+	def get(self, fpid):
+		# None when the library of fpid is not in fp-lib-table or not on disk
+		if fpid in self.checked:
+			return self.checked[fpid]
+		lib_fp = None
+		filename = self.file_of(fpid)
+		if filename is not None and path.exists(filename):
+			st = stat(filename)
+			stamp = (st.st_mtime_ns, st.st_size)
+			cached = self.files.get(filename)
+			if cached is not None and cached[0] == stamp:
+				lib_fp = LibFootprint(*cached[1])
+			else:
+				try:
+					with open(filename, 'rb') as f:
+						lib_fp = LibFootprint.parse(fpid, f.read())
+				except (ValueError, AttributeError, IndexError) as e:
+					print(f"Warning: {filename}: can't read footprint ({e})")
+				if lib_fp is not None:
+					self.files[filename] = (stamp, lib_fp.state())
+					self.changed = True
+		self.checked[fpid] = lib_fp
+		return lib_fp
+
+	def index(self):
+		# every footprint of every library on disk
+		found = []
+		for nick, lib_dir in sorted(self.libs.items()):
+			if not path.isdir(lib_dir):
+				print(f"Warning: library {nick} not found at {lib_dir}")
+				continue
+			for file in sorted(listdir(lib_dir)):
+				if file.endswith('.kicad_mod'):
+					lib_fp = self.get(nick + ':' + file[:-len('.kicad_mod')])
+					if lib_fp is not None:
+						found.append(lib_fp)
+		return found
+
+	def save(self):
+		if not self.changed or not self.filename:
+			return
+		# files that are gone are dropped
+		self.files = {f: v for f, v in self.files.items() if path.exists(f)}
+		with open(self.filename, 'wb') as f:
+			pickle.dump(self.files, f)
+		self.changed = False
+
+def describe(lib_fp):
+	sides = ''.join(s for s, bits in (('F', LAYER_F), ('B', LAYER_B)) if any(p[6] & bits for p in lib_fp.pads))
+	court = ', '.join(f"{'F' if side == LAYER_F else 'B'} {ToMM(b[2]-b[0]):.2f}x{ToMM(b[3]-b[1]):.2f} mm"
+		for side, b in sorted(lib_fp.courtyard.items()))
+	return f"{lib_fp.fpid}: {len(lib_fp.pads)} pads on {sides or '-'}, courtyard {court or '-'}, flip {lib_fp.flip or '-'}"
+
+def main():
+	from pad_cache import board_pads
+	library = FootprintLibrary()
+	if '-v' in sys.argv:
+		for lib_fp in library.index():
+			print(describe(lib_fp))
+	filename = [file for file in listdir('.') if file.endswith('.kicad_pcb') and 'auto' not in file][0]
+	board = LoadBoard(filename)
+	pads = board_pads(board)[0]
+	checked, differ = 0, 0
+	for fp in board.GetFootprints():
+		lib_fp = library.get(fp.GetFPIDAsString())
+		if lib_fp is None:
+			continue
+		checked += 1
+		if not same_copper(pads.get(fp.GetReference(), []), lib_fp.pads):
+			differ += 1
+			print(f"Warning: {fp.GetReference()} differs from {lib_fp.fpid}, update it from the library")
+	library.save()
+	print(f"{checked} footprints checked against {len(library.libs)} libraries, {differ} differ")
+
+if __name__ == "__main__":
+	main()
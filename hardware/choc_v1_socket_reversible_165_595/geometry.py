@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import json
+from os import path
+from array import array
+from math import sin, cos, radians
+from kbd_backend import *
+
+class WaypointTemplate:
+	# Waypoints in footprint coordinates shared by every footprint of a kind
+	# points is a list of tuple: [(x_mm, y_mm, layer(F_Cu/B_Cu/-1(via))), (,)..]
+	def __init__(self, points):
+		self.xs = [FromMM(p[0]) for p in points]
+		self.ys = [FromMM(p[1]) for p in points]
+		self.layers = [p[2] for p in points]
+
+	def offsets(self, angle):
+		# Template rotated counterclockwise by angle, same math as kbd_place_n_route.rotate()
+		if angle == 0:
+			return self.xs, self.ys
+		angle_rad = radians(angle)
+		c, s = cos(angle_rad), sin(angle_rad)
+		rx = [x * c + y * s for x, y in zip(self.xs, self.ys)]
+		ry = [-(x * s - y * c) for x, y in zip(self.xs, self.ys)]
+		return rx, ry
+
+	def place(self, fps):
+		# Board coordinates of the template for each footprint in fps, in add_tracks format
+		# footprints are grouped by orientation so the rotation is done once per group
+		groups = {}
+		for i, fp in enumerate(fps):
+			groups.setdefault(fp.ori, []).append(i)
+		placed = [None]*len(fps)
+		for angle, group in groups.items():
+			rx, ry = self.offsets(angle)
+			for i in group:
+				ox, oy = fps[i].x, fps[i].y
+				placed[i] = [(VECTOR2I(int(ox + dx), int(oy + dy)), layer) for dx, dy, layer in zip(rx, ry, self.layers)]
+		return placed
+
+class RouteTemplate:
+	# Tracks and vias relative to an anchor footprint, compiled once and stamped onto every footprint of a kind
+	# seg: flat x0, y0, x1, y1, width, layer like TrackBuffer, via: flat x, y, drill, width, all in IU
+	def __init__(self, seg, via=()):
+		self.seg = array('q', seg)
+		self.via = array('q', via)
+		self.rotated = {} # angle -> (seg, via)
+
+	@classmethod
+	def from_points(cls, points, width=0.2, drill=0.3, via_width=0.6):
+		# Compile an add_tracks() point list in mm: [(x_mm, y_mm, layer(F_Cu/B_Cu/-1(via))), (,)..]
+		# a segment takes the layer of its end point, or of its start point when it ends on a via
+		seg, via = [], []
+		for (x0, y0, l0), (x1, y1, l1) in zip(points, points[1:]):
+			if l1 < 0:
+				via.extend((FromMM(x1), FromMM(y1), FromMM(drill), FromMM(via_width)))
+			seg.extend((FromMM(x0), FromMM(y0), FromMM(x1), FromMM(y1), FromMM(width), l0 if l1 < 0 else l1))
+		return cls(seg, via)
+
+	@classmethod
+	def capture(cls, segments, vias, anchor, angle=0, grid=0.1):
+		# Template from board segments (x0, y0, x1, y1, width, layer) and vias (x, y, drill, width)
+		# around anchor (VECTOR2I) of a footprint at angle, snapped to grid (mm), exact with grid None
+		c, s = cos(radians(-angle)), sin(radians(-angle))
+		snap = (lambda v: int(v)) if grid is None else (lambda v: FromMM(round(ToMM(v) / grid) * grid))
+		def local(x, y):
+			dx, dy = x - anchor.x, y - anchor.y
+			if angle == 0:
+				return snap(dx), snap(dy)
+			return snap(dx * c + dy * s), snap(-(dx * s - dy * c))
+		seg, via = [], []
+		for x0, y0, x1, y1, width, layer in segments:
+			seg.extend((*local(x0, y0), *local(x1, y1), width, layer))
+		for x, y, drill, width in vias:
+			via.extend((*local(x, y), drill, width))
+		return cls(seg, via)
+
+	def transformed(self, angle):
+		# Template rotated counterclockwise by angle, same math as WaypointTemplate.offsets()
+		if angle == 0:
+			return self.seg, self.via
+		if angle not in self.rotated:
+			c, s = cos(radians(angle)), sin(radians(angle))
+			def rotate(a, fields, points):
+				out = list(a)
+				for i in range(0, len(a), fields):
+					for k in points:
+						x, y = a[i+k], a[i+k+1]
+						out[i+k], out[i+k+1] = x * c + y * s, -(x * s - y * c)
+				return out
+			self.rotated[angle] = (rotate(self.seg, 6, (0, 2)), rotate(self.via, 4, (0,)))
+		return self.rotated[angle]
+
+	def stamp(self, track_buf, fps, rotate=True):
+		# Add the template at every footprint of fps to track_buf, one pass over the template per footprint
+		# without rotate the template is already in the footprints' orientation and only moved
+		n_seg, n_via = len(self.seg) // 6, len(self.via) // 4
+		seg, via = array('q'), array('q')
+		for fp in fps:
+			tseg, tvia = self.transformed(fp.ori if rotate else 0)
+			ox, oy = fp.x, fp.y
+			seg.extend([int(v + d) for v, d in zip(tseg, (ox, oy, ox, oy, 0, 0) * n_seg)])
+			via.extend([int(v + d) for v, d in zip(tvia, (ox, oy, 0, 0) * n_via)])
+		track_buf.extend(seg, via)
+
+class TemplateLibrary:
+	# Named route templates saved as JSON int lists, name -> (anchor footprint value, RouteTemplate)
+	# a template is only used for footprints of its anchor value
+	def __init__(self, filename='route_templates.json'):
+		self.filename = filename
+		self.templates = {}
+
+	def add(self, name, anchor_val, template):
+		self.templates[name] = (anchor_val, template)
+
+	def get(self, name, default=None, anchor_val=None):
+		entry = self.templates.get(name)
+		if entry is None:
+			return default
+		if anchor_val is not None and entry[0] != anchor_val:
+			print(f"Warning: {self.filename}: {name} was captured on {entry[0]}, not {anchor_val}, not used")
+			return default
+		return entry[1]
+
+	def load(self):
+		self.templates = {}
+		if path.exists(self.filename):
+			try:
+				with open(self.filename, 'r') as f:
+					entries = json.load(f)
+				for name, entry in entries.items():
+					seg, via = entry['seg'], entry['via']
+					if len(seg) % 6 or len(via) % 4 or not all(type(v) is int for v in seg + via):
+						raise ValueError(f"{name}: bad segment or via list")
+					self.templates[name] = (entry['anchor'], RouteTemplate(seg, via))
+			except (ValueError, KeyError, TypeError, AttributeError) as e: # corrupted file, built in routes are used
+				print(f"Warning: {self.filename}: can't read route templates ({e})")
+				self.templates = {}
+		return self
+
+	def save(self):
+		entries = {name: {'anchor': anchor, 'seg': t.seg.tolist(), 'via': t.via.tolist()}
+			for name, (anchor, t) in sorted(self.templates.items())}
+		with open(self.filename, 'w') as f:
+			json.dump(entries, f, indent=1)
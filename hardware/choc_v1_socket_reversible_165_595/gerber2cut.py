@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# Convert KiCad F/B_Paste.gbr (RS-274X) straight to stroke-only vinyl cut files, no svg export needed
+# usage: python3 gerber2cut.py [file or directory ...] (default: current directory)
+import sys, re
+from os import listdir, path, cpu_count, replace
+from math import sin, cos, radians, hypot
+from concurrent.futures import ProcessPoolExecutor
+from paste2cut import CUT_STYLE, cut_file, unique_files
+
+STATEMENT = re.compile(r'%([^%]*)%|([^%*]+)\*') # extended command block or one word command
+OPERATION = re.compile(r'(?:G0*(\d+))?(?:X([+-]?\d+))?(?:Y([+-]?\d+))?(?:I[+-]?\d+)?(?:J[+-]?\d+)?(?:D0*(\d+))?$')
+APERTURE = re.compile(r'ADD(\d+)([^,]+),?(.*)$', re.S)
+FORMAT = re.compile(r'X\d(\d)Y\d(\d)')
+
+# Outlines are built in gerber coordinates (y up) as a list of (start point, ops)
+# op: ('L', x, y) line to, ('A', r, center x, center y, x, y) counterclockwise arc to, every outline is closed
+
+def rotate_pts(pts, angle):
+	if angle == 0:
+		return pts
+	c, s = cos(radians(angle)), sin(radians(angle))
+	return [(x*c - y*s, x*s + y*c) for x, y in pts]
+
+def circle(cx, cy, d):
+	r = d/2
+	return [((cx+r, cy), [('A', r, cx, cy, cx-r, cy), ('A', r, cx, cy, cx+r, cy)])]
+
+def polygon(pts, radius=0):
+	# closed outline through pts, grown by radius with round corners if radius > 0
+	pts = [p for i, p in enumerate(pts) if p != pts[i-1]] # drop repeated points, including the closing one
+	if sum(x0*y1 - x1*y0 for (x0, y0), (x1, y1) in zip(pts, pts[1:] + pts[:1])) < 0:
+		pts = pts[::-1]
+	if radius == 0:
+		return [(pts[0], [('L', x, y) for x, y in pts[1:]])]
+	n = len(pts)
+	normals = [] # outward, scaled to radius
+	for i in range(n):
+		(x0, y0), (x1, y1) = pts[i], pts[(i+1) % n]
+		l = hypot(x1-x0, y1-y0)
+		normals.append(((y1-y0)/l*radius, -(x1-x0)/l*radius))
+	ops = []
+	for i in range(n):
+		x, y = pts[(i+1) % n]
+		ops.append(('L', x + normals[i][0], y + normals[i][1]))
+		ops.append(('A', radius, x, y, x + normals[(i+1) % n][0], y + normals[(i+1) % n][1]))
+	return [((pts[0][0] + normals[0][0], pts[0][1] + normals[0][1]), ops)]
+
+def rect(w, h, cx=0, cy=0, angle=0):
+	pts = [(cx-w/2, cy-h/2), (cx+w/2, cy-h/2), (cx+w/2, cy+h/2), (cx-w/2, cy+h/2)]
+	return polygon(rotate_pts(pts, angle))
+
+def obround(w, h):
+	if w == h:
+		return circle(0, 0, w)
+	# stadium: the center segment grown by half of the short side
+	a = abs(w-h)/2
+	return polygon([(-a, 0), (a, 0)] if w > h else [(0, -a), (0, a)], min(w, h)/2)
+
+def regular_polygon(n, cx, cy, d, angle=0):
+	# rotation is about the aperture origin, like every macro primitive
+	pts = [(cx + d/2*cos(radians(360*i/n)), cy + d/2*sin(radians(360*i/n))) for i in range(n)]
+	return polygon(rotate_pts(pts, angle))
+
+EXPR_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|\$(\d+)|([-+xX/()]))')
+
+def eval_expr(expr, params):
+	# macro arithmetic: numbers, $n parameters, + - x / and parentheses, anything else is a ValueError
+	tokens = []
+	pos = 0
+	expr = expr.rstrip()
+	while pos < len(expr):
+		m = EXPR_TOKEN.match(expr, pos)
+		if m is None:
+			raise ValueError(f'bad macro expression {expr!r}')
+		number, var, op = m.groups()
+		if number is not None:
+			tokens.append(('n', float(number)))
+		elif var is not None:
+			tokens.append(('n', params.get(int(var), 0.0)))
+		else:
+			tokens.append((op.lower(), None))
+		pos = m.end()
+	value, pos = parse_sum(tokens, 0, expr)
+	if pos != len(tokens):
+		raise ValueError(f'bad macro expression {expr!r}')
+	return value
+
+def parse_sum(tokens, pos, expr):
+	value, pos = parse_product(tokens, pos, expr)
+	while pos < len(tokens) and tokens[pos][0] in '+-':
+		op = tokens[pos][0]
+		rhs, pos = parse_product(tokens, pos + 1, expr)
+		value = value + rhs if op == '+' else value - rhs
+	return value, pos
+
+def parse_product(tokens, pos, expr):
+	value, pos = parse_factor(tokens, pos, expr)
+	while pos < len(tokens) and tokens[pos][0] in 'x/':
+		op = tokens[pos][0]
+		rhs, pos = parse_factor(tokens, pos + 1, expr)
+		if op == '/' and rhs == 0:
+			raise ValueError(f'division by zero in macro expression {expr!r}')
+		value = value * rhs if op == 'x' else value / rhs
+	return value, pos
+
+def parse_factor(tokens, pos, expr):
+	if pos >= len(tokens):
+		raise ValueError(f'bad macro expression {expr!r}')
+	kind, value = tokens[pos]
+	if kind == 'n':
+		return value, pos + 1
+	if kind in '+-': # sign
+		value, pos = parse_factor(tokens, pos + 1, expr)
+		return (value if kind == '+' else -value), pos
+	if kind == '(':
+		value, pos = parse_sum(tokens, pos + 1, expr)
+		if pos >= len(tokens) or tokens[pos][0] != ')':
+			raise ValueError(f'bad macro expression {expr!r}')
+		return value, pos + 1
+	raise ValueError(f'bad macro expression {expr!r}')
+
+def macro_outlines(name, body, args):
+	params = {i+1: v for i, v in enumerate(args)}
+	prims = []
+	for stmt in body:
+		stmt = ''.join(stmt.split())
+		if stmt.startswith('$'): # variable definition
+			var, expr = stmt[1:].split('=', 1)
+			params[int(var)] = eval_expr(expr, params)
+		else:
+			fields = stmt.split(',')
+			prims.append((int(fields[0]), [eval_expr(f, params) for f in fields[1:]]))
+	outlines = []
+	if name == 'RoundRect':
+		# KiCad's rounded pad: polygon body + corner circles + edge lines, cut as one rounded outline
+		body = next(v for code, v in prims if code == 4)
+		r = next((v[1]/2 for code, v in prims if code == 1), 0)
+		n = int(body[1])
+		pts = [(body[2+2*i], body[3+2*i]) for i in range(n+1)]
+		return polygon(rotate_pts(pts, body[-1]), r)
+	for code, v in prims:
+		if v[0] == 0: # exposure off, nothing to cut
+			continue
+		if code == 1: # circle: exposure, diameter, x, y[, rotation]
+			cx, cy = rotate_pts([(v[2], v[3])], v[4] if len(v) > 4 else 0)[0]
+			outlines += circle(cx, cy, v[1])
+		elif code == 4: # outline: exposure, n, x0, y0 .. xn, yn, rotation
+			n = int(v[1])
+			outlines += polygon(rotate_pts([(v[2+2*i], v[3+2*i]) for i in range(n+1)], v[-1]))
+		elif code == 5: # polygon: exposure, n, x, y, diameter, rotation
+			outlines += regular_polygon(int(v[1]), v[2], v[3], v[4], v[5])
+		elif code == 20: # vector line: exposure, width, start x, y, end x, y, rotation
+			w, x0, y0, x1, y1, angle = v[1:7]
+			l = hypot(x1-x0, y1-y0)
+			nx, ny = (-(y1-y0)/l*w/2, (x1-x0)/l*w/2) if l else (0, w/2)
+			outlines += polygon(rotate_pts([(x0+nx, y0+ny), (x0-nx, y0-ny), (x1-nx, y1-ny), (x1+nx, y1+ny)], angle))
+		elif code == 21: # center line: exposure, width, height, x, y, rotation
+			outlines += rect(v[1], v[2], v[3], v[4], v[5])
+		else:
+			raise ValueError(f'unsupported macro primitive {code} in {name}')
+	# overlapping primitives are cut separately, KiCad paste layers only use RoundRect/RotRect
+	return outlines
+
+def to_path(outlines, scale):
+	# svg path of the outlines relative to the flash position, y flipped to svg (y down)
+	# returns (start x, start y, relative path data, bbox) so every flash is a plain string concat
+	cmds = []
+	xs, ys = [], []
+	cur = None
+	for (x, y), ops in outlines:
+		x, y = round(x*scale, 4), round(-y*scale, 4)
+		if cur is None:
+			start = (x, y)
+		else:
+			cmds.append(f'm{x-cur[0]:.4f},{y-cur[1]:.4f}')
+		first = cur = (x, y)
+		for op in ops:
+			px, py = round(op[-2]*scale, 4), round(-op[-1]*scale, 4)
+			if op[0] == 'L':
+				cmds.append(f'l{px-cur[0]:.4f},{py-cur[1]:.4f}')
+			else:
+				r, cx, cy = op[1]*scale, op[2]*scale, -op[3]*scale
+				# counterclockwise in gerber is clockwise once y is flipped: sweep flag 0
+				cmds.append(f'a{r:.4f},{r:.4f} 0 0 0 {px-cur[0]:.4f},{py-cur[1]:.4f}')
+				xs += [cx-r, cx+r]
+				ys += [cy-r, cy+r]
+			xs.append(px)
+			ys.append(py)
+			cur = (px, py)
+		xs.append(x)
+		ys.append(y)
+		cmds.append('z')
+		cur = first
+	return start[0], start[1], ''.join(cmds), (min(xs), min(ys), max(xs), max(ys))
+
+class GerberPaste:
+	# Minimal RS-274X reader for paste layers: apertures, macros and D03 flashes
+	def __init__(self, filename):
+		self.filename = filename
+		self.macros = {}
+		self.apertures = {} # D code: to_path() of its outline, built once and reused by every flash
+		self.flashes = [] # (D code, x, y) in mm, svg coordinates
+		self.scale = 1.0 # file unit to mm
+		self.x_div = self.y_div = 10**6
+		self.skipped = 0 # draws and regions, KiCad only flashes pads on paste layers
+
+	def parse(self):
+		with open(self.filename, 'r') as f:
+			data = f.read()
+		x = y = 0
+		aperture = None
+		for m in STATEMENT.finditer(data):
+			if m.group(1) is not None:
+				self.extended(m.group(1))
+				continue
+			word = m.group(2).strip()
+			op = OPERATION.match(word)
+			if word.startswith('G04') or op is None: # comments, M02
+				continue
+			g, ox, oy, d = op.groups()
+			if ox is not None:
+				x = int(ox) / self.x_div * self.scale
+			if oy is not None:
+				y = int(oy) / self.y_div * self.scale
+			if d is None:
+				continue
+			d = int(d)
+			if d >= 10:
+				aperture = d
+			elif d == 3:
+				self.flashes.append((aperture, x, -y))
+			elif d == 1:
+				self.skipped += 1
+		return self
+
+	def extended(self, block):
+		words = [w.strip() for w in block.split('*')]
+		cmd = words[0]
+		if cmd.startswith('FS'):
+			fmt = FORMAT.search(cmd)
+			self.x_div, self.y_div = 10**int(fmt.group(1)), 10**int(fmt.group(2))
+		elif cmd.startswith('MO'):
+			self.scale = 25.4 if cmd == 'MOIN' else 1.0
+		elif cmd.startswith('AM'):
+			# primitive 0 is a comment
+			self.macros[cmd[2:]] = [w for w in words[1:] if w and not w.startswith('0')]
+		elif cmd.startswith('AD'):
+			m = APERTURE.match(cmd)
+			code, name, args = int(m.group(1)), m.group(2), m.group(3)
+			params = [float(v) for v in args.split('X')] if args else []
+			self.apertures[code] = to_path(self.aperture_outlines(name, params), self.scale)
+
+	def aperture_outlines(self, name, params):
+		if name == 'C':
+			return circle(0, 0, params[0])
+		elif name == 'R':
+			return rect(params[0], params[1])
+		elif name == 'O':
+			return obround(params[0], params[1])
+		elif name == 'P':
+			return regular_polygon(int(params[1]), 0, 0, params[0], params[2] if len(params) > 2 else 0)
+		elif name in self.macros:
+			return macro_outlines(name, self.macros[name], params)
+		raise ValueError(f'unknown aperture {name}')
+
+	def write_svg(self, cut_svg, margin=1.0):
+		paths = []
+		left = top = float('inf')
+		right = bottom = float('-inf')
+		for d, x, y in self.flashes:
+			sx, sy, rel, (l, t, r, b) = self.apertures[d]
+			paths.append(f'<path d="M{x+sx:.4f},{y+sy:.4f}{rel}"/>\n')
+			left, top, right, bottom = min(left, x+l), min(top, y+t), max(right, x+r), max(bottom, y+b)
+		if not paths:
+			left = top = right = bottom = 0
+		left, top = left-margin, top-margin
+		w, h = right-left+margin, bottom-top+margin
+		style = '; '.join(f'{k}:{v}' for k, v in CUT_STYLE.items()) + '; stroke-linecap:round; stroke-linejoin:round;'
+		# written aside and renamed like paste2cut, a failed write leaves no partial cut file
+		tmp = cut_svg + '.tmp'
+		with open(tmp, 'w') as f:
+			f.write('<?xml version="1.0" standalone="no"?>\n')
+			f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{w:.4f}mm" height="{h:.4f}mm" viewBox="{left:.4f} {top:.4f} {w:.4f} {h:.4f}">\n')
+			f.write(f'<title>{path.basename(self.filename)}</title>\n')
+			f.write(f'<g style="{style}">\n')
+			f.writelines(paths)
+			f.write('</g>\n</svg>\n')
+		replace(tmp, cut_svg)
+
+class GenVinylCutGerber:
+	def __init__(self, paste_gbr, cut_svg=None):
+		self.paste_gbr = paste_gbr
+		self.cut_svg = cut_svg or cut_file(paste_gbr)
+
+	def process_gerber(self):
+		# returns None when the gerber could not be converted
+		try:
+			gerber = GerberPaste(self.paste_gbr).parse()
+			gerber.write_svg(self.cut_svg)
+			if gerber.skipped:
+				print(f"Warning: {self.paste_gbr}: {gerber.skipped} draw operations skipped, only flashes are converted")
+			return self.cut_svg
+		except FileNotFoundError as e:
+			print(f"Error: {e}")
+		except (IOError, ValueError, KeyError) as e:
+			print(f"Error: {self.paste_gbr}: {e}")
+		return None
+
+def find_paste_gerbers(paths):
+	# F and B paste gerbers in the given files/directories, also looks into gerber/ subdirectories
+	found = []
+	for p in paths:
+		if path.isdir(p):
+			found += [path.join(p, f) for f in sorted(listdir(p)) if f.endswith(('F_Paste.gbr', 'B_Paste.gbr'))]
+			if path.isdir(path.join(p, 'gerber')):
+				found += find_paste_gerbers([path.join(p, 'gerber')])
+		elif p.endswith('_Paste.gbr'):
+			found.append(p)
+	return found
+
+def convert(paste_gbr):
+	return GenVinylCutGerber(paste_gbr).process_gerber()
+
+def main():
+	paste_gbrs = unique_files(find_paste_gerbers(sys.argv[1:] or ['.']))
+	if not paste_gbrs:
+		raise FileNotFoundError("No F_Paste.gbr or B_Paste.gbr file found.")
+	failed = 0
+	with ProcessPoolExecutor(max_workers=min(len(paste_gbrs), cpu_count())) as pool:
+		for paste_gbr, cut_svg in zip(paste_gbrs, pool.map(convert, paste_gbrs)):
+			if cut_svg is None:
+				failed += 1
+			else:
+				print(f'{paste_gbr} -> {cut_svg}')
+	if failed:
+		print(f"Error: {failed} of {len(paste_gbrs)} files not converted")
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# Board backend used by the placement scripts
+# KBD_BACKEND=sexpr uses the pure-Python kicad_sexpr loader instead of KiCad's pcbnew,
+# which is also the fallback when pcbnew is not installed (CI, batch jobs)
+import os
+if os.environ.get('KBD_BACKEND', 'pcbnew') == 'sexpr':
+	from kicad_sexpr import *
+	BACKEND = 'sexpr'
+else:
+	try:
+		from pcbnew import *
+		BACKEND = 'pcbnew'
+	except ImportError:
+		from kicad_sexpr import *
+		BACKEND = 'sexpr'
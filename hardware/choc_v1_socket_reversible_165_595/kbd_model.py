@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+from sys import intern
+from kbd_backend import *
+
+class Pad:
+	# Pad center in internal units as plain ints, net name interned
+	# hw, hh: half size, angle: orientation in degrees, both: copper on F_Cu and B_Cu (through hole)
+	__slots__ = ('num', 'net', 'x', 'y', 'hw', 'hh', 'angle', 'both')
+
+	def __init__(self, num, net, x, y, w=0, h=0, angle=0, both=False):
+		self.num = num
+		self.net = intern(net)
+		self.x = x
+		self.y = y
+		self.hw = w//2
+		self.hh = h//2
+		self.angle = angle
+		self.both = both
+
+	@property
+	def pos(self):
+		# new vector on every read, callers are free to modify it
+		return VECTOR2I(self.x, self.y)
+
+class Footprint:
+	# Board footprint and where kbd_place_n_route put it, pads by number on each copper layer
+	# angle and flipped follow the board footprint, ori is the orientation it was placed with
+	__slots__ = ('fp', 'ref', 'val', 'fpid', 'x', 'y', 'ori', 'angle', 'flipped', 'ref_inst', 'padF', 'padB')
+
+	def __init__(self, fp):
+		self.fp = fp
+		self.ref = intern(fp.GetReference())
+		self.val = intern(fp.GetValue())
+		self.fpid = fp.GetFPIDAsString()
+		pos = fp.GetPosition()
+		self.x = pos.x
+		self.y = pos.y
+		self.ori = 0 # orientation is not updated after placement
+		self.angle = fp.GetOrientationDegrees()
+		self.flipped = fp.IsFlipped()
+		self.ref_inst = fp.Reference()
+		self.padF = {}
+		self.padB = {}
+
+	@property
+	def pos(self):
+		return VECTOR2I(self.x, self.y)
+
+	@pos.setter
+	def pos(self, pos):
+		self.x = pos.x
+		self.y = pos.y
+
+	def pads(self, layer):
+		return self.padF if layer == F_Cu else self.padB
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# Opt-in tracing of board backend calls (pcbnew/SWIG or kicad_sexpr) per kbd_place_n_route stage
+# enabled with switch_placement.py -t or KBD_TRACE=1, writes a folded stack file for flamegraph.pl/speedscope
+import sys
+from time import perf_counter_ns
+from inspect import isfunction, isbuiltin
+from kbd_backend import BACKEND
+
+# backend classes whose methods are traced, base classes are included through the MRO
+TRACED_CLASSES = ['BOARD', 'FOOTPRINT', 'PAD', 'PCB_TRACK', 'PCB_VIA', 'PCB_SHAPE', 'PCB_TEXT', 'PCB_FIELD',
+	'ZONE', 'ZONE_FILLER', 'PCB_GROUP', 'VECTOR2I', 'BOX2I', 'SHAPE_LINE_CHAIN', 'SHAPE_POLY_SET', 'LSET']
+# plugin methods that only dispatch to stages
+DISPATCHERS = ('Run', 'run_route_stage')
+
+class Tracer:
+	def __init__(self):
+		self.stack = [] # frame names, plugin methods and backend calls
+		self.child_ns = [] # time spent in children of each frame
+		self.self_ns = {} # folded stack -> self time
+		self.calls = {} # (stage, backend call) -> [count, cumulative time]
+		self.api_depth = 0 # backend calls made by the backend itself are not counted again
+		self.stages = set()
+
+	def stage(self):
+		# outermost plugin method below Run()
+		for name in self.stack:
+			if name in self.stages and name not in DISPATCHERS:
+				return name
+		return self.stack[0] if self.stack else '<module>'
+
+	def enter(self, name):
+		self.stack.append(name)
+		self.child_ns.append(0)
+		return perf_counter_ns()
+
+	def leave(self, start):
+		elapsed = perf_counter_ns() - start
+		key = ';'.join(self.stack)
+		self.self_ns[key] = self.self_ns.get(key, 0) + elapsed - self.child_ns.pop()
+		name = self.stack.pop()
+		if self.child_ns:
+			self.child_ns[-1] += elapsed
+		return name, elapsed
+
+	def wrap_stage(self, name, func):
+		tracer = self
+		def traced(*args, **kwargs):
+			start = tracer.enter(name)
+			try:
+				return func(*args, **kwargs)
+			finally:
+				tracer.leave(start)
+		return traced
+
+	def wrap_api(self, name, func):
+		tracer = self
+		def traced(*args, **kwargs):
+			if tracer.api_depth:
+				return func(*args, **kwargs)
+			tracer.api_depth += 1
+			start = tracer.enter(name)
+			try:
+				return func(*args, **kwargs)
+			finally:
+				tracer.api_depth -= 1
+				elapsed = tracer.leave(start)[1]
+				entry = tracer.calls.setdefault((tracer.stage(), name), [0, 0])
+				entry[0] += 1
+				entry[1] += elapsed
+		return traced
+
+	def install(self, plugin_cls, modules):
+		# wrap the plugin methods, the backend functions imported into modules and the backend classes
+		backend = sys.modules['pcbnew' if BACKEND == 'pcbnew' else 'kicad_sexpr']
+		for name, func in list(vars(plugin_cls).items()):
+			if isfunction(func):
+				self.stages.add(name)
+				setattr(plugin_cls, name, self.wrap_stage(name, func))
+		for mod in modules:
+			for name, obj in list(vars(mod).items()):
+				if (isfunction(obj) or isbuiltin(obj)) and getattr(obj, '__module__', None) == backend.__name__:
+					setattr(mod, name, self.wrap_api(name, obj))
+		wrapped = set()
+		for cls_name in TRACED_CLASSES:
+			for cls in getattr(backend, cls_name, type).__mro__:
+				if cls in wrapped or cls.__module__ != backend.__name__:
+					continue
+				wrapped.add(cls)
+				for name, func in list(vars(cls).items()):
+					if isfunction(func) and (name == '__init__' or not name.startswith('_')):
+						setattr(cls, name, self.wrap_api(f'{cls.__name__}.{name}', func))
+
+	def report(self, top=5):
+		# backend calls and time per stage, slowest stage first
+		stages = {}
+		for (stage, name), (count, ns) in self.calls.items():
+			stages.setdefault(stage, []).append((ns, count, name))
+		print(f"{'stage':<40}{'calls':>9}{'backend ms':>12}  top calls")
+		for stage, calls in sorted(stages.items(), key=lambda s: -sum(c[0] for c in s[1])):
+			calls.sort(reverse=True)
+			hot = ', '.join(f'{name} x{count}' for ns, count, name in calls[:top])
+			print(f"{stage:<40}{sum(c[1] for c in calls):>9}{sum(c[0] for c in calls)/1e6:>12.2f}  {hot}")
+
+	def write_folded(self, filename='autogen_trace.folded'):
+		# one "frame;frame;frame self_time_us" line per stack, input of flamegraph.pl
+		with open(filename, 'w') as f:
+			for key, ns in sorted(self.self_ns.items()):
+				if ns >= 1000:
+					f.write(f'{key} {ns // 1000}\n')
@@ -0,0 +1,999 @@
+#!/usr/bin/env python3
+# Pure-Python .kicad_pcb loader/writer exposing the part of the pcbnew API used by switch_placement.py
+# The file is mmapped and tokenized in place, untouched nodes are written back byte for byte
+import mmap, re, os
+from math import sin, cos, radians
+from uuid import uuid4
+
+TOKEN = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+class Node:
+	# One s-expression list, items[0] is the name, the rest are atoms (bytes) or Nodes
+	# start/end are byte offsets of the list in the source buffer (None for new nodes)
+	__slots__ = ('items', 'start', 'end', 'parent', 'dirty')
+	def __init__(self, items, start=None, end=None, parent=None):
+		self.items = items
+		self.start = start
+		self.end = end
+		self.parent = parent
+		self.dirty = start is None
+
+	@property
+	def name(self):
+		return self.items[0].decode()
+
+	def find(self, name):
+		name = name.encode()
+		for item in self.items:
+			if type(item) is Node and item.items[0] == name:
+				return item
+		return None
+
+	def findall(self, name):
+		name = name.encode()
+		return [item for item in self.items if type(item) is Node and item.items[0] == name]
+
+	def children(self):
+		return [item for item in self.items if type(item) is Node]
+
+	def atom(self, i):
+		return unquote(self.items[i])
+
+	def touch(self):
+		# mark this node and all its parents for re-emit
+		node = self
+		while node is not None and not node.dirty:
+			node.dirty = True
+			node = node.parent
+
+	def append(self, node):
+		node.parent = self
+		self.items.append(node)
+		self.touch()
+
+	def remove(self, node):
+		self.items.remove(node)
+		self.touch()
+
+def parse(buf):
+	# Tokenize buf (bytes or mmap) and return the root Node
+	stack = []
+	root = None
+	for m in TOKEN.finditer(buf):
+		tok = m.group()
+		if tok == b'(':
+			node = Node([], m.start(), None, stack[-1] if stack else None)
+			node.dirty = False
+			stack.append(node)
+		elif tok == b')':
+			node = stack.pop()
+			node.end = m.end()
+			if stack:
+				stack[-1].items.append(node)
+			else:
+				root = node
+		else:
+			stack[-1].items.append(tok)
+	return root
+
+def emit(node, buf, out, depth=0):
+	# Append the bytes of node to out, clean nodes are copied from buf as is
+	if not node.dirty:
+		out.append(buf[node.start:node.end])
+		return
+	out.append(b'(')
+	out.append(node.items[0])
+	has_list = False
+	for item in node.items[1:]:
+		if type(item) is Node:
+			has_list = True
+			out.append(b'\n' + b'\t'*(depth+1))
+			emit(item, buf, out, depth+1)
+		else:
+			out.append(b' ')
+			out.append(item)
+	if has_list:
+		out.append(b'\n' + b'\t'*depth)
+	out.append(b')')
+
+def unquote(atom):
+	if atom[:1] == b'"':
+		return atom[1:-1].decode().replace('\\"', '"').replace('\\\\', '\\')
+	return atom.decode()
+
+def quote(s):
+	return ('"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"').encode()
+
+def fmt_mm(iu):
+	# KiCad style number: internal units (nm) to mm, at most 6 decimals
+	s = f'{iu/1e6:.6f}'.rstrip('0').rstrip('.')
+	return b'0' if s == '-0' else s.encode()
+
+def fmt_deg(deg):
+	s = f'{deg:.6f}'.rstrip('0').rstrip('.')
+	return b'0' if s == '-0' else s.encode()
+
+def new_node(name, *items):
+	node = Node([name.encode()])
+	for item in items:
+		if type(item) is Node:
+			item.parent = node
+		node.items.append(item)
+	return node
+
+def xy_node(name, pos):
+	return new_node(name, fmt_mm(pos.x), fmt_mm(pos.y))
+
+def uuid_node():
+	return new_node('uuid', quote(str(uuid4())))
+
+# pcbnew compatible values
+F_Cu = 0
+B_Cu = 31
+Edge_Cuts = 44
+LAYER_NAMES = {F_Cu: 'F.Cu', B_Cu: 'B.Cu', Edge_Cuts: 'Edge.Cuts'}
+LAYER_IDS = {v: k for k, v in LAYER_NAMES.items()}
+SHAPE_T_SEGMENT = 0
+SHAPE_T_RECT = 1
+SHAPE_T_ARC = 2
+SHAPE_T_CIRCLE = 3
+SHAPE_T_POLY = 4
+ADD_MODE_INSERT = 0
+ADD_MODE_APPEND = 1
+ADD_MODE_BULK_APPEND = 2
+PAD_ATTRIB_PTH = 0
+PAD_ATTRIB_SMD = 1
+PAD_ATTRIB_CONN = 2
+PAD_ATTRIB_NPTH = 3
+PAD_ATTRIBS = {'thru_hole': PAD_ATTRIB_PTH, 'smd': PAD_ATTRIB_SMD, 'connect': PAD_ATTRIB_CONN, 'np_thru_hole': PAD_ATTRIB_NPTH}
+
+def flip_layer_name(name):
+	if name.startswith('F.'):
+		return 'B.' + name[2:]
+	if name.startswith('B.'):
+		return 'F.' + name[2:]
+	return name
+
+def FromMM(mm):
+	# truncated like pcbnew.FromMM(), both backends give the same internal units
+	return int(mm*1e6)
+
+def read_mm(atom):
+	# number of the file in internal units, rounded like KiCad's board parser
+	return int(round(float(atom)*1e6))
+
+def ToMM(iu):
+	return iu/1e6
+
+def normalize180(deg):
+	while deg <= -180:
+		deg += 360
+	while deg > 180:
+		deg -= 360
+	return deg
+
+def normalize360(deg):
+	while deg < 0:
+		deg += 360
+	while deg >= 360:
+		deg -= 360
+	return deg
+
+def rotate_iu(x, y, deg):
+	# same direction as kbd_place_n_route.rotate(), ie counterclockwise on screen
+	if deg == 0:
+		return x, y
+	a = radians(deg)
+	c, s = cos(a), sin(a)
+	return x*c + y*s, -x*s + y*c
+
+class VECTOR2I:
+	__slots__ = ('x', 'y')
+	def __init__(self, x=0, y=0):
+		self.x = int(x)
+		self.y = int(y)
+
+	def __add__(self, other):
+		return VECTOR2I(self.x+other.x, self.y+other.y)
+
+	def __sub__(self, other):
+		return VECTOR2I(self.x-other.x, self.y-other.y)
+
+	def __neg__(self):
+		return VECTOR2I(-self.x, -self.y)
+
+	def __mul__(self, k):
+		return VECTOR2I(round(self.x*k), round(self.y*k))
+
+	def __truediv__(self, k):
+		return VECTOR2I(round(self.x/k), round(self.y/k))
+
+	def __eq__(self, other):
+		return isinstance(other, VECTOR2I) and self.x == other.x and self.y == other.y
+
+	def __hash__(self):
+		return hash((self.x, self.y))
+
+	def __repr__(self):
+		return f'VECTOR2I({self.x}, {self.y})'
+
+def VECTOR2I_MM(x, y):
+	return VECTOR2I(FromMM(x), FromMM(y))
+
+class BOX2I:
+	def __init__(self, left, top, right, bottom):
+		self.left, self.top, self.right, self.bottom = int(left), int(top), int(right), int(bottom)
+
+	def GetLeft(self):
+		return self.left
+
+	def GetTop(self):
+		return self.top
+
+	def GetRight(self):
+		return self.right
+
+	def GetBottom(self):
+		return self.bottom
+
+	def GetWidth(self):
+		return self.right - self.left
+
+	def GetHeight(self):
+		return self.bottom - self.top
+
+	def GetCenter(self):
+		return VECTOR2I((self.left+self.right)//2, (self.top+self.bottom)//2)
+
+def box_of(points):
+	xs = [p[0] for p in points]
+	ys = [p[1] for p in points]
+	return BOX2I(min(xs), min(ys), max(xs), max(ys))
+
+class KIID:
+	def __init__(self, uuid):
+		self.uuid = uuid
+
+	def AsString(self):
+		return self.uuid
+
+def read_uuid(node, default):
+	uuid = node.find('uuid')
+	return uuid.atom(1) if uuid is not None else default
+
+def read_xy(node):
+	return VECTOR2I(read_mm(node.items[1]), read_mm(node.items[2]))
+
+class ActionPlugin:
+	def register(self):
+		pass
+
+def GetBoard():
+	return None # only available inside KiCad
+
+def Refresh():
+	pass
+
+def LoadBoard(filename):
+	return BOARD(filename)
+
+def SaveBoard(filename, board):
+	board.Save(filename)
+	return True
+
+class BOARD:
+	def __init__(self, filename=None):
+		self.filename = filename
+		with open(filename, 'rb') as f:
+			self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		self.root = parse(self.buf)
+		self.netcodes = {}
+		self.netnames = {}
+		self.footprints = []
+		self.tracks = []
+		self.drawings = []
+		self.zones = []
+		self.groups = []
+		self.new_items = []
+		for node in self.root.children():
+			name = node.items[0]
+			if name == b'net':
+				code = int(node.items[1])
+				self.netcodes[node.atom(2)] = code
+				self.netnames[code] = node.atom(2)
+			elif name == b'footprint':
+				self.footprints.append(FOOTPRINT(self, node))
+			elif name == b'segment' or name == b'arc':
+				self.tracks.append(PCB_TRACK(self, node))
+			elif name == b'via':
+				self.tracks.append(PCB_VIA(self, node))
+			elif name.startswith(b'gr_'):
+				self.drawings.append(PCB_SHAPE(self, node))
+			elif name == b'zone':
+				self.zones.append(ZONE(self, node))
+			elif name == b'group':
+				self.groups.append(PCB_GROUP(self, node))
+		# group members that are tracks, vias, drawings or zones become items of the group
+		by_uuid = {item.uuid: item for item in self.tracks + self.drawings + self.zones}
+		for group in self.groups:
+			group.items = [by_uuid[u] for u in group.other_members if u in by_uuid]
+			group.other_members = [u for u in group.other_members if u not in by_uuid]
+
+	def GetFileName(self):
+		return self.filename
+
+	def GetFootprints(self):
+		return list(self.footprints)
+
+	def FindFootprintByReference(self, ref):
+		for fp in self.footprints:
+			if fp.GetReference() == ref:
+				return fp
+		return None
+
+	def GetPads(self):
+		return [pad for fp in self.footprints for pad in fp.pads]
+
+	def GetTracks(self):
+		return list(self.tracks)
+
+	def GetDrawings(self):
+		return list(self.drawings)
+
+	def Zones(self):
+		return list(self.zones)
+
+	def Groups(self):
+		return list(self.groups)
+
+	def GetNetcodeFromNetname(self, netname):
+		return self.netcodes.get(netname, -1)
+
+	def GetNetname(self, code):
+		return self.netnames.get(code, '')
+
+	def Add(self, item, mode=ADD_MODE_INSERT, skip_connectivity=False):
+		item.board = self
+		if isinstance(item, (PCB_TRACK, PCB_VIA)):
+			self.tracks.append(item)
+		elif isinstance(item, ZONE):
+			self.zones.append(item)
+		elif isinstance(item, PCB_SHAPE):
+			self.drawings.append(item)
+		elif isinstance(item, PCB_GROUP):
+			self.groups.append(item)
+			return # written by Save()
+		self.new_items.append(item)
+
+	def BuildConnectivity(self):
+		pass # no connectivity data is kept
+
+	def Delete(self, item):
+		for items in (self.tracks, self.zones, self.drawings, self.groups):
+			if item in items:
+				items.remove(item)
+		for group in self.groups:
+			group.RemoveItem(item)
+		if item.node is not None and item.node.parent is self.root:
+			self.root.remove(item.node)
+			item.node = None
+		elif item in self.new_items:
+			self.new_items.remove(item)
+
+	def Save(self, filename):
+		for track in self.tracks:
+			if track.node is not None and track.modified: # loaded track changed by the script
+				self.root.remove(track.node)
+				self.new_items.append(track)
+				track.modified = False
+		for item in self.new_items:
+			item.node = item.to_node()
+			self.root.append(item.node)
+		self.new_items = []
+		# groups are always written again, their members change with every Delete()
+		for group in self.groups:
+			if group.node is not None and group.node.parent is self.root:
+				self.root.remove(group.node)
+			group.node = None
+			if group.items or group.other_members: # KiCad drops empty groups too
+				group.node = group.to_node()
+				self.root.append(group.node)
+		out = []
+		emit(self.root, self.buf, out)
+		out.append(self.buf[self.root.end:] or b'\n')
+		tmp = filename + '.tmp'
+		with open(tmp, 'wb') as f:
+			f.write(b''.join(out))
+		os.replace(tmp, filename)
+
+class FOOTPRINT:
+	def __init__(self, board, node):
+		self.board = board
+		self.node = node
+		self.at = node.find('at')
+		self.pos = read_xy(self.at)
+		self.orient = float(self.at.items[3]) if len(self.at.items) > 3 else 0.0
+		self.layer = node.find('layer').atom(1)
+		self.ref = None
+		self.val = None
+		self.texts = []
+		self.graphics = []
+		self.pads = []
+		for child in node.children():
+			name = child.items[0]
+			if name == b'property':
+				text = PCB_TEXT(self, child)
+				if child.atom(1) == 'Reference':
+					self.ref = text
+				elif child.atom(1) == 'Value':
+					self.val = text
+				self.texts.append(text)
+			elif name == b'fp_text':
+				text = PCB_TEXT(self, child)
+				if child.atom(1) == 'reference':
+					self.ref = text
+				elif child.atom(1) == 'value':
+					self.val = text
+				else:
+					self.graphics.append(text)
+				self.texts.append(text)
+			elif name == b'pad':
+				self.pads.append(PAD(self, child))
+			elif name.startswith(b'fp_'):
+				self.graphics.append(PCB_SHAPE(board, child))
+
+	def GetReference(self):
+		return self.ref.GetText()
+
+	def GetValue(self):
+		return self.val.GetText()
+
+	def Reference(self):
+		return self.ref
+
+	def Value(self):
+		return self.val
+
+	def GetLayer(self):
+		return LAYER_IDS[self.layer]
+
+	def IsFlipped(self):
+		return self.layer == 'B.Cu'
+
+	def GetFPIDAsString(self):
+		return self.node.atom(1)
+
+	def GraphicalItems(self):
+		return list(self.graphics)
+
+	def Pads(self):
+		return list(self.pads)
+
+	def FindPadByNumber(self, number):
+		for pad in self.pads:
+			if pad.number == number:
+				return pad
+		return None
+
+	def GetPosition(self):
+		return VECTOR2I(self.pos.x, self.pos.y)
+
+	def GetOrientationDegrees(self):
+		return self.orient
+
+	def write_at(self):
+		items = [b'at', fmt_mm(self.pos.x), fmt_mm(self.pos.y)]
+		if self.orient != 0:
+			items.append(fmt_deg(self.orient))
+		self.at.items = items
+		self.at.touch()
+
+	def SetPosition(self, pos):
+		self.pos = VECTOR2I(pos.x, pos.y)
+		self.write_at()
+
+	def SetOrientationDegrees(self, deg):
+		deg = normalize180(deg)
+		delta = deg - self.orient
+		self.orient = deg
+		self.write_at()
+		# pad and text angles are stored as absolute angles
+		for pad in self.pads:
+			pad.set_angle(pad.angle + delta)
+		for text in self.texts:
+			text.set_angle(text.angle + delta)
+
+	def local(self, pos):
+		# board coordinates to footprint coordinates
+		x, y = rotate_iu(pos.x - self.pos.x, pos.y - self.pos.y, -self.orient)
+		return round(x), round(y)
+
+	def to_board(self, x, y):
+		x, y = rotate_iu(x, y, self.orient)
+		return VECTOR2I(self.pos.x + round(x), self.pos.y + round(y))
+
+	def Flip(self, centre, flip_left_right=False):
+		# mirror around the horizontal line through centre and move to the other side
+		self.pos = VECTOR2I(self.pos.x, 2*centre.y - self.pos.y)
+		self.orient = normalize180(-self.orient)
+		self.layer = flip_layer_name(self.layer)
+		layer = self.node.find('layer')
+		layer.items[1] = quote(self.layer)
+		layer.touch()
+		self.write_at()
+		flip_node(self.node)
+		for pad in self.pads:
+			pad.read()
+		for text in self.texts:
+			text.read()
+		if flip_left_right:
+			self.SetOrientationDegrees(self.orient + 180)
+
+def flip_node(node):
+	# mirror the pads, texts and graphics of a footprint node to the other side
+	for child in node.children():
+		if child.items[0] in (b'pad', b'property', b'fp_text') or child.items[0].startswith(b'fp_'):
+			flip_item(child, child.items[0])
+
+def flip_item(node, kind):
+	for child in node.children():
+		name = child.items[0]
+		if name in (b'at', b'start', b'end', b'mid', b'center', b'xy'):
+			child.items[2] = fmt_mm(-read_mm(child.items[2]))
+			if name == b'at' and len(child.items) > 3:
+				angle = -float(child.items[3])
+				child.items[3] = fmt_deg(normalize360(angle) if kind == b'pad' else normalize180(angle))
+			child.touch()
+		elif name == b'layer' or name == b'layers':
+			child.items[1:] = [quote(flip_layer_name(unquote(a))) if type(a) is bytes else a for a in child.items[1:]]
+			child.touch()
+		elif name == b'effects' and kind in (b'property', b'fp_text'):
+			justify = child.find('justify')
+			if justify is None:
+				child.append(new_node('justify', b'mirror'))
+			elif b'mirror' in justify.items:
+				justify.items.remove(b'mirror')
+				justify.touch()
+			else:
+				justify.items.append(b'mirror')
+				justify.touch()
+		else:
+			flip_item(child, kind)
+
+class PCB_TEXT:
+	def __init__(self, fp, node):
+		self.fp = fp
+		self.node = node
+		self.read()
+
+	def read(self):
+		at = self.node.find('at')
+		if at is None: # some properties have no position
+			self.x, self.y, self.angle = 0, 0, 0.0
+			return
+		self.x = read_mm(at.items[1])
+		self.y = read_mm(at.items[2])
+		self.angle = float(at.items[3]) if len(at.items) > 3 else 0.0
+
+	def write(self):
+		at = self.node.find('at')
+		if at is None:
+			at = new_node('at')
+			self.node.append(at)
+		at.items = [b'at', fmt_mm(self.x), fmt_mm(self.y), fmt_deg(self.angle)]
+		at.touch()
+
+	def GetText(self):
+		return self.node.atom(2)
+
+	def set_angle(self, deg):
+		self.angle = normalize180(deg)
+		self.write()
+
+	def GetPosition(self):
+		return self.fp.to_board(self.x, self.y)
+
+	def SetTextPos(self, pos):
+		self.x, self.y = self.fp.local(pos)
+		self.write()
+
+	SetPosition = SetTextPos
+
+	def SetTextAngleDegrees(self, deg):
+		self.set_angle(deg)
+
+	def GetLayer(self):
+		return LAYER_IDS.get(self.node.find('layer').atom(1), -1)
+
+class PAD:
+	def __init__(self, fp, node):
+		self.fp = fp
+		self.node = node
+		self.number = node.atom(1)
+		self.type = node.atom(2)
+		self.shape = node.atom(3)
+		net = node.find('net')
+		self.netcode = int(net.items[1]) if net is not None else 0
+		self.netname = net.atom(2) if net is not None else ''
+		size = node.find('size')
+		self.size = VECTOR2I(read_mm(size.items[1]), read_mm(size.items[2]))
+		self.read()
+
+	def read(self):
+		at = self.node.find('at')
+		self.x = read_mm(at.items[1])
+		self.y = read_mm(at.items[2])
+		self.angle = float(at.items[3]) if len(at.items) > 3 else 0.0
+		self.layers = [unquote(a) for a in self.node.find('layers').items[1:] if type(a) is bytes]
+
+	def set_angle(self, deg):
+		self.angle = normalize360(deg)
+		at = self.node.find('at')
+		at.items = [b'at', at.items[1], at.items[2]]
+		if self.angle != 0:
+			at.items.append(fmt_deg(self.angle))
+		at.touch()
+
+	def GetNumber(self):
+		return self.number
+
+	def GetNetname(self):
+		return self.netname
+
+	def GetNetCode(self):
+		return self.netcode
+
+	def GetParentAsString(self):
+		return self.fp.GetReference()
+
+	def GetParentFootprint(self):
+		return self.fp
+
+	def GetPosition(self):
+		return self.fp.to_board(self.x, self.y)
+
+	GetCenter = GetPosition
+
+	def GetFPRelativePosition(self):
+		return VECTOR2I(self.x, self.y)
+
+	def GetSize(self):
+		return VECTOR2I(self.size.x, self.size.y)
+
+	def GetOrientationDegrees(self):
+		return self.angle
+
+	def GetShapeName(self):
+		return self.shape
+
+	def GetAttribute(self):
+		return PAD_ATTRIBS.get(self.type, PAD_ATTRIB_SMD)
+
+	def GetRoundRectCornerRadius(self):
+		rratio = self.node.find('roundrect_rratio')
+		return int(float(rratio.items[1]) * min(self.size.x, self.size.y)) if rratio is not None else 0
+
+	def IsOnLayer(self, layer):
+		name = LAYER_NAMES.get(layer)
+		if name is None:
+			return False
+		if name in self.layers or ('*' + name[1:]) in self.layers:
+			return True
+		return name.endswith('.Cu') and 'F&B.Cu' in self.layers
+
+	def GetBoundingBox(self):
+		pos = self.GetPosition()
+		hw, hh = self.size.x/2, self.size.y/2
+		corners = [rotate_iu(dx, dy, self.angle) for dx, dy in ((-hw, -hh), (hw, -hh), (hw, hh), (-hw, hh))]
+		return box_of([(pos.x + x, pos.y + y) for x, y in corners])
+
+class PCB_TRACK:
+	def __init__(self, board=None, node=None):
+		self.board = board
+		self.node = node
+		self.start = VECTOR2I(0, 0)
+		self.end = VECTOR2I(0, 0)
+		self.width = FromMM(0.2)
+		self.layer = F_Cu
+		self.netcode = 0
+		self.modified = False
+		self.uuid = str(uuid4())
+		if node is not None:
+			self.uuid = read_uuid(node, self.uuid)
+			self.start = read_xy(node.find('start'))
+			self.end = read_xy(node.find('end'))
+			self.width = read_mm(node.find('width').items[1])
+			self.layer = LAYER_IDS.get(node.find('layer').atom(1), F_Cu)
+			self.netcode = int(node.find('net').items[1])
+
+	def GetClass(self):
+		return 'PCB_TRACK'
+
+	@property
+	def m_Uuid(self):
+		return KIID(self.uuid)
+
+	def GetStart(self):
+		return VECTOR2I(self.start.x, self.start.y)
+
+	def SetStart(self, pos):
+		self.start = VECTOR2I(pos.x, pos.y)
+		self.modified = True
+
+	def GetEnd(self):
+		return VECTOR2I(self.end.x, self.end.y)
+
+	def SetEnd(self, pos):
+		self.end = VECTOR2I(pos.x, pos.y)
+		self.modified = True
+
+	def GetWidth(self):
+		return self.width
+
+	def SetWidth(self, width):
+		self.width = width
+		self.modified = True
+
+	def GetLayer(self):
+		return self.layer
+
+	def SetLayer(self, layer):
+		self.layer = layer
+		self.modified = True
+
+	def GetNetCode(self):
+		return self.netcode
+
+	def SetNetCode(self, code):
+		self.netcode = code
+		self.modified = True
+
+	def GetNetname(self):
+		return self.board.GetNetname(self.netcode) if self.board is not None else ''
+
+	def GetLength(self):
+		return ((self.end.x-self.start.x)**2 + (self.end.y-self.start.y)**2)**0.5
+
+	def GetBoundingBox(self):
+		w = self.width//2
+		return BOX2I(min(self.start.x, self.end.x)-w, min(self.start.y, self.end.y)-w,
+			max(self.start.x, self.end.x)+w, max(self.start.y, self.end.y)+w)
+
+	def to_node(self):
+		return new_node('segment',
+			xy_node('start', self.start),
+			xy_node('end', self.end),
+			new_node('width', fmt_mm(self.width)),
+			new_node('layer', quote(LAYER_NAMES[self.layer])),
+			new_node('net', str(self.netcode).encode()),
+			new_node('uuid', quote(self.uuid)))
+
+class PCB_VIA(PCB_TRACK):
+	def __init__(self, board=None, node=None):
+		PCB_TRACK.__init__(self, board)
+		self.node = node
+		self.width = FromMM(0.6)
+		self.drill = FromMM(0.3)
+		if node is not None:
+			self.start = read_xy(node.find('at'))
+			self.width = read_mm(node.find('size').items[1])
+			self.drill = read_mm(node.find('drill').items[1])
+			self.netcode = int(node.find('net').items[1])
+			self.uuid = read_uuid(node, self.uuid)
+		self.end = self.start
+		self.modified = False
+
+	def GetClass(self):
+		return 'PCB_VIA'
+
+	def GetPosition(self):
+		return VECTOR2I(self.start.x, self.start.y)
+
+	def SetPosition(self, pos):
+		self.start = self.end = VECTOR2I(pos.x, pos.y)
+		self.modified = True
+
+	def SetDrill(self, drill):
+		self.drill = drill
+		self.modified = True
+
+	def GetDrillValue(self):
+		return self.drill
+
+	def IsOnLayer(self, layer):
+		return layer == F_Cu or layer == B_Cu
+
+	def to_node(self):
+		return new_node('via',
+			xy_node('at', self.start),
+			new_node('size', fmt_mm(self.width)),
+			new_node('drill', fmt_mm(self.drill)),
+			new_node('layers', b'"F.Cu"', b'"B.Cu"'),
+			new_node('net', str(self.netcode).encode()),
+			new_node('uuid', quote(self.uuid)))
+
+class PCB_GROUP:
+	# Named set of board items, tracks, vias, drawings and zones are resolved, other members are kept by uuid
+	def __init__(self, board=None, node=None):
+		self.board = board
+		self.node = node
+		self.name = ''
+		self.uuid = str(uuid4())
+		self.items = []
+		self.other_members = []
+		if node is not None:
+			self.name = node.atom(1)
+			self.uuid = read_uuid(node, self.uuid)
+			members = node.find('members')
+			self.other_members = [unquote(m) for m in members.items[1:]] if members is not None else []
+
+	def GetClass(self):
+		return 'PCB_GROUP'
+
+	def GetName(self):
+		return self.name
+
+	def SetName(self, name):
+		self.name = name
+
+	def AddItem(self, item):
+		if item not in self.items:
+			self.items.append(item)
+
+	def RemoveItem(self, item):
+		if item in self.items:
+			self.items.remove(item)
+
+	def GetItems(self):
+		return list(self.items)
+
+	def to_node(self):
+		members = [quote(item.uuid) for item in self.items] + [quote(u) for u in self.other_members]
+		return new_node('group', quote(self.name), new_node('uuid', quote(self.uuid)), new_node('members', *members))
+
+class PCB_SHAPE:
+	def __init__(self, board=None, node=None):
+		self.board = board
+		self.node = node
+		self.shape = SHAPE_T_SEGMENT
+		self.filled = False
+		self.layer = F_Cu
+		self.width = FromMM(0.1)
+		self.start = VECTOR2I(0, 0)
+		self.points = []
+		self.uuid = str(uuid4())
+		if node is not None:
+			self.uuid = read_uuid(node, self.uuid)
+			layer = node.find('layer')
+			self.layer = LAYER_IDS.get(layer.atom(1), -1) if layer is not None else -1
+			self.points = [read_xy(n) for n in iter_nodes(node, (b'start', b'end', b'mid', b'center', b'xy'))]
+
+	def GetClass(self):
+		return 'PCB_SHAPE'
+
+	@property
+	def m_Uuid(self):
+		return KIID(self.uuid)
+
+	def SetShape(self, shape):
+		self.shape = shape
+
+	def SetFilled(self, filled):
+		self.filled = filled
+
+	def GetLayer(self):
+		return self.layer
+
+	def SetLayer(self, layer):
+		self.layer = layer
+
+	def SetWidth(self, width):
+		self.width = width
+
+	def SetStart(self, pos):
+		self.start = VECTOR2I(pos.x, pos.y)
+
+	def SetPolyPoints(self, points):
+		self.points = [VECTOR2I(p.x, p.y) for p in points]
+
+	def GetPolyPoints(self):
+		return list(self.points)
+
+	def GetBoundingBox(self):
+		return box_of([(p.x, p.y) for p in self.points])
+
+	def to_node(self):
+		pts = new_node('pts', *[xy_node('xy', p) for p in self.points])
+		return new_node('gr_poly', pts,
+			new_node('stroke', new_node('width', fmt_mm(self.width)), new_node('type', b'solid')),
+			new_node('fill', b'yes' if self.filled else b'none'),
+			new_node('layer', quote(LAYER_NAMES[self.layer])),
+			new_node('uuid', quote(self.uuid)))
+
+def iter_nodes(node, names):
+	for child in node.children():
+		if child.items[0] in names:
+			yield child
+		else:
+			yield from iter_nodes(child, names)
+
+class SHAPE_LINE_CHAIN:
+	def __init__(self):
+		self.points = []
+		self.closed = False
+
+	def Append(self, pos):
+		self.points.append(VECTOR2I(pos.x, pos.y))
+
+	def SetClosed(self, closed):
+		self.closed = closed
+
+	def PointCount(self):
+		return len(self.points)
+
+	def CPoint(self, i):
+		return self.points[i]
+
+class LSET:
+	def __init__(self):
+		self.layers = []
+
+	def AddLayer(self, layer):
+		if layer not in self.layers:
+			self.layers.append(layer)
+
+class ZONES(list):
+	pass
+
+class ZONE_FILLER:
+	# Zones are written with their outline only, KiCad fills them on the next fill (B)
+	def __init__(self, board):
+		self.board = board
+
+	def Fill(self, zones):
+		return True
+
+class ZONE:
+	def __init__(self, board=None, node=None):
+		self.board = board
+		self.node = node
+		self.outline = []
+		self.netcode = 0
+		self.layers = [F_Cu]
+		self.uuid = str(uuid4())
+		if node is not None:
+			self.uuid = read_uuid(node, self.uuid)
+			self.netcode = int(node.find('net').items[1])
+
+	def GetClass(self):
+		return 'ZONE'
+
+	@property
+	def m_Uuid(self):
+		return KIID(self.uuid)
+
+	def AddPolygon(self, chain):
+		self.outline = list(chain.points)
+
+	def SetNetCode(self, code):
+		self.netcode = code
+
+	def GetNetCode(self):
+		return self.netcode
+
+	def SetLayerSet(self, lset):
+		self.layers = list(lset.layers)
+
+	def to_node(self):
+		layers = [quote(LAYER_NAMES[l]) for l in self.layers]
+		return new_node('zone',
+			new_node('net', str(self.netcode).encode()),
+			new_node('net_name', quote(self.board.GetNetname(self.netcode))),
+			new_node('layers', *layers),
+			new_node('uuid', quote(self.uuid)),
+			new_node('hatch', b'edge', b'0.5'),
+			new_node('connect_pads', new_node('clearance', b'0.5')),
+			new_node('min_thickness', b'0.25'),
+			new_node('filled_areas_thickness', b'no'),
+			new_node('fill', new_node('thermal_gap', b'0.5'), new_node('thermal_bridge_width', b'0.5')),
+			new_node('polygon', new_node('pts', *[xy_node('xy', p) for p in self.outline])))
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+import heapq
+from array import array
+from math import hypot
+from concurrent.futures import ProcessPoolExecutor
+from kbd_backend import *
+from drc_lite import ClearanceChecker, point_seg, inside, edges
+
+LAYERS = (F_Cu, B_Cu)
+LAYER_BITS = (1, 2) # drc_lite layer bits of LAYERS
+# 45 degree moves: dx, dy, cost (10 per cell straight, 14 diagonal)
+STEPS = ((1, 0, 10), (1, 1, 14), (0, 1, 10), (-1, 1, 14), (-1, 0, 10), (-1, -1, 14), (0, -1, 10), (1, -1, 14))
+NO_DIR = len(STEPS) # start cells and right after a via
+
+def core_dist(pts, p):
+	# distance from p to the core of a drc_lite shape (point, segment or convex polygon)
+	if len(pts) == 1:
+		return hypot(p[0]-pts[0][0], p[1]-pts[0][1])
+	if len(pts) > 2 and inside(p, pts):
+		return 0
+	return min(point_seg(p, a, b)[0] for a, b in edges(pts))
+
+def core_point(pts, p):
+	# where a route ending near p joins the shape: pad center, via center or closest point of a track
+	if len(pts) == 2:
+		return point_seg(p, pts[0], pts[1])[1]
+	return (sum(q[0] for q in pts) / len(pts), sum(q[1] for q in pts) / len(pts))
+
+class MazeRouter:
+	# Two layer grid router over a box of the board, A* with 45 degree moves, via and turn costs
+	# Each grid cell holds 0 (free), the id of the only net whose copper is closer than the
+	# clearance, or -1 (several nets, holes, floating copper, outside the board)
+	# a track is drawn through cell centers, so copper is grown by most of a cell to keep the
+	# clearance along diagonal moves as well
+	def __init__(self, checker, box, clearance, outline=None, pitch=FromMM(0.2), width=FromMM(0.2),
+			via_drill=FromMM(0.3), via_width=FromMM(0.6), via_cost=100, turn_cost=4, weight=1.2, shift=False):
+		self.pitch = pitch
+		self.width = width
+		self.via_drill = via_drill
+		self.via_width = via_width
+		self.via_cost = via_cost
+		self.turn_cost = turn_cost
+		self.weight = weight
+		# grids of different boxes line up, so routes of one router can be checked in another,
+		# shift moves the cell centers by half a cell for another try between tight obstacles
+		offset = pitch//2 if shift else 0
+		self.x0 = box[0] // pitch * pitch + offset
+		self.y0 = box[1] // pitch * pitch + offset
+		self.w = (box[2] - self.x0) // pitch + 1
+		self.h = (box[3] - self.y0) // pitch + 1
+		n = self.w * self.h
+		self.track_grid = [array('i', bytes(4*n)), array('i', bytes(4*n))] # F_Cu, B_Cu
+		self.via_grid = array('i', bytes(4*n))
+		slack = pitch * 3 // 4
+		self.track_keep = clearance + width//2 + slack
+		self.via_keep = clearance + via_width//2 + slack
+		# copper that is already joined, by the checker's union-find
+		self.items = checker.items
+		self.owners = checker.owners
+		find, nets = checker.connect()[:2]
+		self.group = [find(i) for i in range(len(self.items))]
+		self.net_ids = {}
+		self.path = [] # (layer index, x, y) of the cells of the last route
+		self.nets = [next(iter(nets[g])) if len(nets[g]) == 1 else None for g in self.group]
+		for i, (pts, r, layers, *_) in enumerate(self.items):
+			self.paint(pts, r, layers, self.net_id(self.nets[i]))
+		if outline is not None:
+			self.paint_outline(outline, clearance + width//2)
+
+	def net_id(self, net):
+		if net is None:
+			return -1
+		return self.net_ids.setdefault(net, len(self.net_ids) + 1)
+
+	def cell_pos(self, idx):
+		return (self.x0 + (idx % self.w) * self.pitch, self.y0 + (idx // self.w) * self.pitch)
+
+	def cells(self, pts, grow):
+		# (cell index, cell center) of the cells whose center is within grow of the bounding box of pts
+		gx0 = max(0, -(-(min(p[0] for p in pts) - grow - self.x0) // self.pitch))
+		gx1 = min(self.w - 1, (max(p[0] for p in pts) + grow - self.x0) // self.pitch)
+		gy0 = max(0, -(-(min(p[1] for p in pts) - grow - self.y0) // self.pitch))
+		gy1 = min(self.h - 1, (max(p[1] for p in pts) + grow - self.y0) // self.pitch)
+		for gy in range(int(gy0), int(gy1) + 1):
+			for gx in range(int(gx0), int(gx1) + 1):
+				yield gy*self.w + gx, (self.x0 + gx*self.pitch, self.y0 + gy*self.pitch)
+
+	def mark(self, grid, idx, nid):
+		v = grid[idx]
+		if v == 0:
+			grid[idx] = nid
+		elif v != nid:
+			grid[idx] = -1
+
+	def paint(self, pts, r, layers, nid):
+		# keep tracks of other nets away from a shape grown by r, and vias a bit further
+		for idx, p in self.cells(pts, r + self.via_keep):
+			d = core_dist(pts, p) - r
+			if d > self.via_keep:
+				continue
+			self.mark(self.via_grid, idx, nid)
+			if d <= self.track_keep:
+				for li in range(2):
+					if layers & LAYER_BITS[li]:
+						self.mark(self.track_grid[li], idx, nid)
+
+	def paint_outline(self, outline, keep):
+		# nothing is routed outside the board outline (convex polygon) shrunk by keep,
+		# the inside of each row is where it crosses all the shrunk edge half planes
+		cx = sum(p[0] for p in outline) / len(outline)
+		cy = sum(p[1] for p in outline) / len(outline)
+		planes = [] # a*x + b*y <= c, inside the outline
+		for (x0, y0), (x1, y1) in edges(outline):
+			a, b = y1 - y0, x0 - x1
+			c = a*x0 + b*y0
+			if a*cx + b*cy > c:
+				a, b, c = -a, -b, -c
+			planes.append((a, b, c - keep*hypot(a, b)))
+		for gy in range(self.h):
+			y = self.y0 + gy*self.pitch
+			lo, hi = float('-inf'), float('inf')
+			for a, b, c in planes:
+				if a > 0:
+					hi = min(hi, (c - b*y) / a)
+				elif a < 0:
+					lo = max(lo, (c - b*y) / a)
+				elif b*y > c:
+					lo, hi = 1, 0
+			for gx in range(self.w):
+				x = self.x0 + gx*self.pitch
+				if not lo <= x <= hi:
+					idx = gy*self.w + gx
+					self.via_grid[idx] = self.track_grid[0][idx] = self.track_grid[1][idx] = -1
+
+	def pad_item(self, ref, layer, num):
+		for i, owner in enumerate(self.owners):
+			if owner == (ref, num) and self.items[i][2] & LAYER_BITS[LAYERS.index(layer)]:
+				return i
+		return None
+
+	def route(self, ref, layer, num):
+		# Route pad num of ref on layer to the closest copper of its net that isn't connected to it yet,
+		# returns the waypoints in add_tracks format, [] if it's connected already or None if there is no way
+		self.path = []
+		src = self.pad_item(ref, layer, num)
+		if src is None or self.nets[src] is None:
+			return None
+		net = self.nets[src]
+		nid = self.net_id(net)
+		targets = [i for i, item in enumerate(self.items) if self.nets[i] == net and self.group[i] != self.group[src]
+			and (self.owners[i] is None or self.owners[i][0] != ref)]
+		if not targets:
+			return []
+		n = self.w * self.h
+		goal = {} # layer index * cells + cell -> target item
+		for i in targets:
+			pts, r, layers = self.items[i][:3]
+			for idx, p in self.cells(pts, r + self.width//2):
+				if core_dist(pts, p) <= r + self.width//2:
+					for li in range(2):
+						if layers & LAYER_BITS[li] and self.track_grid[li][idx] in (0, nid):
+							goal.setdefault(li*n + idx, i)
+		if not goal:
+			return None
+		start = []
+		pts, r, layers = self.items[src][:3]
+		for idx, p in self.cells(pts, r):
+			if core_dist(pts, p) <= r:
+				start += [(li, idx) for li in range(2) if layers & LAYER_BITS[li]]
+		# aim at the closest target, any other one reached on the way will do as well
+		c = core_point(pts, pts[0])
+		aim = min(goal, key=lambda k: hypot(*(a - b for a, b in zip(self.cell_pos(k % n), c))))
+		path = self.search(start, goal, nid, aim % n)
+		if path is None:
+			return None
+		end = goal[path[-1][0]*n + path[-1][1]]
+		self.path = [(li,) + self.cell_pos(idx) for li, idx in path]
+		points = self.waypoints(path, core_point(pts, self.cell_pos(path[0][1])),
+			core_point(self.items[end][0], self.cell_pos(path[-1][1])))
+		self.add_path(points, nid)
+		# the pad is connected now, later routes may join anything of this group
+		old = self.group[end]
+		self.group = [self.group[src] if g == old else g for g in self.group]
+		return points
+
+	def search(self, start, goal, nid, aim):
+		# A* over (layer, cell, direction of the last move) states, the heuristic is the
+		# octile distance to the aim cell, weighted to expand fewer cells around obstacles
+		w, n = self.w, self.w * self.h
+		ax, ay = aim % w, aim // w
+		weight = self.weight
+		def h(idx):
+			dx, dy = abs(idx % w - ax), abs(idx // w - ay)
+			return weight * (10*max(dx, dy) + 4*min(dx, dy))
+		grids = self.track_grid
+		via_grid = self.via_grid
+		closed = bytearray(2 * n * (NO_DIR+1))
+		cost = {}
+		parent = {}
+		heap = []
+		for li, idx in start:
+			s = (li*n + idx) * (NO_DIR+1) + NO_DIR
+			cost[s] = 0
+			parent[s] = None
+			heapq.heappush(heap, (h(idx), 0, s))
+		while heap:
+			f, g, s = heapq.heappop(heap)
+			if closed[s]:
+				continue
+			closed[s] = 1
+			cell, d = divmod(s, NO_DIR+1)
+			if cell in goal:
+				path = []
+				while s is not None:
+					cell = s // (NO_DIR+1)
+					if not path or path[-1] != divmod(cell, n):
+						path.append(divmod(cell, n))
+					s = parent[s]
+				return path[::-1]
+			li, idx = divmod(cell, n)
+			x, y = idx % w, idx // w
+			grid = grids[li]
+			moves = []
+			for k, (dx, dy, step) in enumerate(STEPS):
+				nx, ny = x + dx, y + dy
+				if 0 <= nx < w and 0 <= ny < self.h:
+					nidx = ny*w + nx
+					if grid[nidx] in (0, nid):
+						turn = self.turn_cost if d != NO_DIR and d != k else 0
+						moves.append(((li*n + nidx) * (NO_DIR+1) + k, nidx, step + turn))
+			if via_grid[idx] in (0, nid) and grids[1-li][idx] in (0, nid):
+				moves.append((((1-li)*n + idx) * (NO_DIR+1) + NO_DIR, idx, self.via_cost))
+			for ns, nidx, step in moves:
+				ng = g + step
+				if not closed[ns] and ng < cost.get(ns, ng + 1):
+					cost[ns] = ng
+					parent[ns] = s
+					heapq.heappush(heap, (ng + h(nidx), ng, ns))
+		return None
+
+	def waypoints(self, path, start, end):
+		# Corners and layer changes of a cell path, from start to end in add_tracks format
+		pos = lambda p: VECTOR2I(int(p[0]), int(p[1]))
+		points = [(pos(start), LAYERS[path[0][0]])]
+		for k, (li, idx) in enumerate(path):
+			if k + 1 < len(path) and path[k+1][0] != li: # via
+				if points[-1][1] < 0: # the track between two vias needs its own layer
+					points.append((pos(self.cell_pos(idx)), LAYERS[li]))
+				points.append((pos(self.cell_pos(idx)), -1))
+			elif 0 < k < len(path) - 1 and path[k-1][0] == li:
+				px, py = path[k-1][1] % self.w, path[k-1][1] // self.w
+				x, y = idx % self.w, idx // self.w
+				nx, ny = path[k+1][1] % self.w, path[k+1][1] // self.w
+				if (x-px, y-py) != (nx-x, ny-y): # corner
+					points.append((pos(self.cell_pos(idx)), LAYERS[li]))
+			elif k == 0 or k == len(path) - 1:
+				points.append((pos(self.cell_pos(idx)), LAYERS[li]))
+		points.append((pos(end), LAYERS[path[-1][0]]))
+		return points
+
+	def add_path(self, points, nid):
+		# routed copper keeps the next routes away
+		for i in range(len(points) - 1):
+			a, b = points[i], points[i+1]
+			a_pt, b_pt = (a[0].x, a[0].y), (b[0].x, b[0].y)
+			if b[1] < 0:
+				self.paint([b_pt], self.via_width//2, 3, nid)
+				layer = a[1]
+			else:
+				layer = b[1]
+			if layer >= 0:
+				self.paint([a_pt, b_pt], self.width//2, LAYER_BITS[LAYERS.index(layer)], nid)
+
+	def net_of(self, ref, layer, num):
+		src = self.pad_item(ref, layer, num)
+		return None if src is None else self.nets[src]
+
+	def fits(self, path, nid):
+		# path (cells of another router) doesn't come closer than the clearance to copper of other nets
+		for k, (li, x, y) in enumerate(path):
+			idx = (y - self.y0) // self.pitch * self.w + (x - self.x0) // self.pitch
+			if not 0 <= idx < self.w * self.h:
+				continue # outside of this grid, nothing painted there
+			if self.track_grid[li][idx] not in (0, nid):
+				return False
+			if k > 0 and path[k-1][0] != li and self.via_grid[idx] not in (0, nid):
+				return False
+		return True
+
+def route_group(checker, box, clearance, outline, pads):
+	# Route pads one after the other in one router, runs in a worker process so
+	# the result is plain data: [(pad, net, [((x, y), layer)] or None, path cells)]
+	router = MazeRouter(checker, box, clearance, outline)
+	routed = []
+	for pad in pads:
+		points = router.route(*pad)
+		if points is not None:
+			points = [((p.x, p.y), layer) for p, layer in points]
+		routed.append((pad, router.net_of(*pad), points, router.path))
+	return routed
+
+class RouteScheduler:
+	# Maze routes jobs [((ref, layer, pad number), box)] in groups that can't get in each other's way:
+	# jobs whose boxes overlap share a router and are routed in order, the groups are routed in
+	# worker processes and merged in job order, a route that comes too close to copper merged from
+	# another group or that found no way is left to be ripped up and routed again by the caller
+	def __init__(self, clearance, outline=None, workers=1, pitch=FromMM(0.2)):
+		self.clearance = clearance
+		self.outline = outline
+		self.workers = workers
+		self.pitch = pitch
+		self.gap = clearance + FromMM(0.6) + pitch # boxes closer than this share a group
+
+	def groups(self, jobs):
+		# [(box, [job index])], group boxes are at least gap apart
+		groups = [(box, [i]) for i, (pad, box) in enumerate(jobs)]
+		merged = True
+		while merged:
+			merged = False
+			for a in range(len(groups)):
+				for b in range(a+1, len(groups)):
+					p, q = groups[a][0], groups[b][0]
+					if p[0] - self.gap < q[2] and q[0] - self.gap < p[2] and p[1] - self.gap < q[3] and q[1] - self.gap < p[3]:
+						box = (min(p[0], q[0]), min(p[1], q[1]), max(p[2], q[2]), max(p[3], q[3]))
+						groups[a] = (box, sorted(groups[a][1] + groups[b][1]))
+						del groups[b]
+						merged = True
+						break
+				if merged:
+					break
+		return groups
+
+	def run(self, checker, jobs):
+		# Returns the waypoints of each job in add_tracks format, None for the jobs to route again
+		groups = self.groups(jobs)
+		args = [(checker, box, self.clearance, self.outline, [jobs[i][0] for i in members]) for box, members in groups]
+		if self.workers > 1 and len(groups) > 1:
+			with ProcessPoolExecutor(max_workers=min(self.workers, len(groups))) as pool:
+				results = list(pool.map(route_group, *zip(*args)))
+		else:
+			results = [route_group(*a) for a in args]
+		# routes are checked against the groups merged before, a group is consistent in itself
+		box = (min(j[1][0] for j in jobs), min(j[1][1] for j in jobs), max(j[1][2] for j in jobs), max(j[1][3] for j in jobs))
+		merge = MazeRouter(ClearanceChecker(self.clearance), box, self.clearance, pitch=self.pitch)
+		routed = [None]*len(jobs)
+		for (box, members), result in zip(groups, results):
+			fit = [points is not None and merge.fits(path, merge.net_id(net)) for pad, net, points, path in result]
+			for i, ok, (pad, net, points, path) in zip(members, fit, result):
+				if ok:
+					points = [(VECTOR2I(int(x), int(y)), layer) for (x, y), layer in points]
+					merge.add_path(points, merge.net_id(net))
+					routed[i] = points
+		return routed
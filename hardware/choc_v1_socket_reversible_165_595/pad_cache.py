@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import pickle, hashlib
+from os import path
+from math import sin, cos, radians
+from kbd_backend import *
+from footprint_lib import LAYER_F, LAYER_B, swap_sides, read_lib_table
+
+def rotate(x, y, deg):
+	# counterclockwise on screen, same as kbd_place_n_route.rotate()
+	if deg == 0:
+		return x, y
+	a = radians(deg)
+	c, s = cos(a), sin(a)
+	return x*c + y*s, -x*s + y*c
+
+def file_hash(filename):
+	with open(filename, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def board_pads(board):
+	# One walk over the board pads: ({reference: [(number, x, y, angle, width, height, layer bits)]},
+	# {reference: {pad number: net}}), offsets in footprint coordinates on the front side at orientation 0
+	fps = {fp.GetReference(): fp for fp in board.GetFootprints()}
+	pads = {}
+	nets = {}
+	for pad in board.GetPads():
+		num = pad.GetNumber()
+		if num == '': # mounting pads and holes
+			continue
+		ref = pad.GetParentAsString()
+		pos, size = pad.GetCenter(), pad.GetSize()
+		bits = (LAYER_F if pad.IsOnLayer(F_Cu) else 0) | (LAYER_B if pad.IsOnLayer(B_Cu) else 0)
+		pads.setdefault(ref, []).append((num, pos.x, pos.y, pad.GetOrientationDegrees(), size.x, size.y, bits))
+		nets.setdefault(ref, {})[num] = pad.GetNetname()
+	offsets = {}
+	for ref, fp in fps.items():
+		pos, angle, flipped = fp.GetPosition(), fp.GetOrientationDegrees(), fp.IsFlipped()
+		local = []
+		for num, x, y, pad_angle, w, h, bits in pads.get(ref, []):
+			lx, ly = rotate(x - pos.x, y - pos.y, -angle)
+			if flipped: # back to the front side
+				local.append((num, round(lx), -round(ly), angle - pad_angle, w, h, swap_sides(bits)))
+			else:
+				local.append((num, round(lx), round(ly), pad_angle - angle, w, h, bits))
+		offsets[ref] = local
+	return offsets, nets
+
+def pad_nets(board):
+	# {reference: {pad number: net}} of the board as it is in memory
+	nets = {}
+	for pad in board.GetPads():
+		num = pad.GetNumber()
+		if num != '':
+			nets.setdefault(pad.GetParentAsString(), {})[num] = pad.GetNetname()
+	return nets
+
+class PadCache:
+	# Pad offsets of every library footprint, in footprint coordinates on the front side at orientation 0,
+	# and the pad nets of the board, so pad positions follow from the placement of each footprint
+	# footprints are keyed by library ID and the hash of their .kicad_mod when the library of
+	# fp-lib-table is on disk, else by the board file, nets are keyed by the board file
+	# live: the board in memory may differ from its file (KiCad's board with unsaved changes), its nets are
+	# read from the board on every load and only the offsets of library footprints come from the cache
+	def __init__(self, board_file, filename='autogen_pads.pickle', lib_table='fp-lib-table', live=False):
+		self.filename = filename
+		self.live = live
+		# a board that was never saved, or a live one, is walked once per load and nothing is written
+		self.board_key = None
+		if board_file and path.exists(board_file) and not live:
+			self.board_key = (path.abspath(board_file), path.getmtime(board_file), path.getsize(board_file))
+		self.libs = read_lib_table(lib_table)
+		self.fp_keys = {} # library ID -> key, file hashes are computed once
+		self.entries = {} # key -> [(number, x, y, angle, width, height, layer bits)]
+		self.nets = {} # board key -> {reference: {pad number: net}}
+		if self.filename and path.exists(self.filename):
+			try:
+				with open(self.filename, 'rb') as f:
+					self.entries, self.nets = pickle.load(f)
+			except (pickle.UnpicklingError, EOFError, ValueError):
+				self.entries, self.nets = {}, {} # corrupted cache, walk the pads again
+		self.board_nets = self.nets.get(self.board_key)
+		self.changed = False
+
+	def fp_key(self, fpid):
+		key = self.fp_keys.get(fpid)
+		if key is None:
+			nick, _, name = fpid.partition(':')
+			lib_file = path.join(self.libs.get(nick, ''), name + '.kicad_mod')
+			key = (fpid, file_hash(lib_file)) if nick in self.libs and path.exists(lib_file) else (fpid, self.board_key)
+			self.fp_keys[fpid] = key
+		return key
+
+	def entry(self, fp):
+		# pad offsets of a Footprint record, a footprint that differs from its library has its own entry
+		key = self.fp_key(fp.fpid)
+		own = self.entries.get(key + (fp.ref,))
+		return own if own is not None else self.entries.get(key)
+
+	def update(self, board, fps):
+		# Walk the board pads when a footprint of fps or the nets are unknown, only for the nets when
+		# a live board's footprints are all cached
+		missing = any(self.entry(fp) is None for fp in fps)
+		if self.live and not missing:
+			if self.board_nets is None:
+				self.board_nets = pad_nets(board)
+		elif missing or self.board_nets is None:
+			self.learn(board)
+			self.save()
+
+	def learn(self, board):
+		fpids = {fp.GetReference(): fp.GetFPIDAsString() for fp in board.GetFootprints()}
+		offsets, nets = board_pads(board)
+		for ref, local in offsets.items():
+			key = self.fp_key(fpids[ref])
+			if key not in self.entries:
+				self.entries[key] = local
+			elif not same_pads(self.entries[key], local):
+				self.entries[key + (ref,)] = local
+			else: # back in line with its library
+				self.entries.pop(key + (ref,), None)
+		self.board_nets = self.nets[self.board_key] = nets
+		self.changed = True
+
+	def place(self, fps):
+		# [(number, net, x, y, angle, width, height, layer bits)] of each Footprint record in fps,
+		# from its position, orientation (fp.angle) and side
+		placed = []
+		board_nets = self.board_nets
+		for fp in fps:
+			nets = board_nets.get(fp.ref, {})
+			x0, y0 = fp.x, fp.y
+			a = radians(fp.angle)
+			c, s = cos(a), sin(a)
+			if fp.flipped:
+				placed.append([(num, nets.get(num, ''), x0 + round(x*c - y*s), y0 + round(-x*s - y*c),
+					fp.angle - angle, w, h, swap_sides(bits)) for num, x, y, angle, w, h, bits in self.entry(fp)])
+			else:
+				placed.append([(num, nets.get(num, ''), x0 + round(x*c + y*s), y0 + round(-x*s + y*c),
+					fp.angle + angle, w, h, bits) for num, x, y, angle, w, h, bits in self.entry(fp)])
+		return placed
+
+	def save(self):
+		if not self.changed or self.board_key is None:
+			return
+		# only the nets of the current board are kept
+		with open(self.filename, 'wb') as f:
+			pickle.dump((self.entries, {self.board_key: self.board_nets}), f)
+		self.changed = False
+
+def same_pads(a, b, tolerance=1):
+	# pad lists equal but for the rounding of rotated footprints
+	if len(a) != len(b):
+		return False
+	for p, q in zip(a, b):
+		if p[0] != q[0] or p[4:] != q[4:] or abs(p[1]-q[1]) > tolerance or abs(p[2]-q[2]) > tolerance \
+			or abs((p[3]-q[3] + 180) % 360 - 180) > 1e-6:
+			return False
+	return True
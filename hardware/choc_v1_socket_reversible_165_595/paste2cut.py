@@ -1,49 +1,132 @@
 #!/usr/bin/env python3
-from os import listdir
-from enum import Enum, auto
+# Convert KiCad F/B_Paste.svg exports to stroke-only vinyl cut files
+# usage: python3 paste2cut.py [file or directory ...] (default: current directory)
+import sys
+from os import listdir, path, cpu_count, replace, remove
+from xml.sax import make_parser, SAXException
+from xml.sax.handler import ContentHandler
+from xml.sax.saxutils import XMLGenerator
+from concurrent.futures import ProcessPoolExecutor
 
-class State(Enum):
-	COPY = auto()
-	SKIP = auto()
+SHAPES = ('path', 'circle', 'ellipse', 'rect', 'polygon', 'polyline')
+# gray stroke for easier look in dark mode :)
+CUT_STYLE = {'fill': 'none', 'stroke': '#999999', 'stroke-width': '0.0500', 'stroke-opacity': '1'}
+
+class CutHandler(ContentHandler):
+	# Streams the svg through: groups get a thin gray stroke, pads lose their fill,
+	# existing outline paths (fill:none, ie edge cuts) are dropped
+	def __init__(self, output):
+		ContentHandler.__init__(self)
+		self.out = XMLGenerator(output, 'utf-8', short_empty_elements=True)
+		self.skip_depth = 0
+		self.stroke_style = CUT_STYLE
+
+	def restyle(self, style):
+		decls = [d.split(':', 1) for d in style.split(';') if ':' in d]
+		keep = [(k.strip(), v.strip()) for k, v in decls if not k.strip().startswith(('fill', 'stroke-width', 'stroke-opacity')) and k.strip() != 'stroke']
+		return '; '.join(f'{k}:{v}' for k, v in list(self.stroke_style.items()) + keep) + ';'
+
+	def startDocument(self):
+		self.out.startDocument()
+
+	def endDocument(self):
+		self.out.ignorableWhitespace('\n')
+		self.out.endDocument()
+
+	def startElement(self, name, attrs):
+		if self.skip_depth:
+			self.skip_depth += 1
+			return
+		attrs = dict(attrs)
+		style = attrs.get('style', '')
+		if name == 'g' and style:
+			attrs['style'] = self.restyle(style)
+		elif name in SHAPES and style:
+			if 'fill:none' in style.replace(' ', ''): # existing edge cut paths
+				self.skip_depth = 1
+				return
+			del attrs['style'] # pads that need to be converted to stroke
+		self.out.startElement(name, attrs)
+
+	def endElement(self, name):
+		if self.skip_depth:
+			self.skip_depth -= 1
+			return
+		self.out.endElement(name)
+
+	def characters(self, content):
+		if not self.skip_depth:
+			self.out.characters(content)
+
+	def ignorableWhitespace(self, content):
+		self.characters(content)
+
+	def processingInstruction(self, target, data):
+		self.out.processingInstruction(target, data)
+
+def cut_file(paste_file):
+	# kbd-F_Paste.svg -> autogen_kbd-F_Paste_cut.svg next to it, one output per input so batch runs don't collide
+	stem = path.splitext(path.basename(paste_file))[0]
+	return path.join(path.dirname(paste_file), f'autogen_{stem}_cut.svg')
+
+def unique_files(files):
+	# the same file given twice (ie '. ./') would be written by two workers at once
+	found = {}
+	for f in files:
+		found.setdefault(path.realpath(f), f)
+	return list(found.values())
 
 class GenVinylCut:
-	def __init__(self):
-		# Select F/B_Paste svg file
-		try:
-			self.paste_svg = next(file for file in listdir('.') if file.endswith('F_Paste.svg'))
-		except StopIteration:
-			raise FileNotFoundError("No F_Paste.svg file found in the current directory.")
-		
-		self.state = State.COPY
-		# gray stroke for easier look in dark mode :)
-		self.style_template ='''<g style="fill:none; stroke:#999999; stroke-width:0.0500; stroke-opacity:1; '''
-		self.path_style = '<path '
+	def __init__(self, paste_svg, cut_svg=None):
+		self.paste_svg = paste_svg
+		self.cut_svg = cut_svg or cut_file(paste_svg)
 
 	def process_svg(self):
+		# One pass, parsed in chunks so memory stays flat on big panelized layers
+		# written aside and renamed, a failed conversion leaves no partial cut file, returns None then
+		tmp = self.cut_svg + '.tmp'
 		try:
-			with open(self.paste_svg, 'r') as paste_file, open('autogen_cut.svg', 'w') as output:
-				for line in paste_file:
-					if self.state == State.COPY:
-						if line.startswith('<g'):  # Replace group style
-							output.write(self.style_template)
-						elif line.startswith('<path style'):
-							if 'fill:none;' in line:  # Existing edge cut paths
-								self.state = State.SKIP
-							else:  # Pads that need to be converted to stroke
-								output.write(self.path_style)
-						else:
-							output.write(line)
-					elif self.state == State.SKIP:
-						if '/>' in line:  # Skip <path fill:none .../> block
-							self.state = State.COPY
+			with open(self.paste_svg, 'rb') as paste_file, open(tmp, 'w', encoding='utf-8') as output:
+				parser = make_parser()
+				parser.setContentHandler(CutHandler(output))
+				parser.parse(paste_file)
+			replace(tmp, self.cut_svg)
+			return self.cut_svg
 		except FileNotFoundError as e:
 			print(f"Error: {e}")
-		except IOError as e:
-			print(f"Error: {e}")
+		except (IOError, SAXException) as e:
+			print(f"Error: {self.paste_svg}: {e}")
+		if path.exists(tmp):
+			remove(tmp)
+		return None
+
+def find_paste_svgs(paths):
+	# F and B paste exports in the given files/directories
+	found = []
+	for p in paths:
+		if path.isdir(p):
+			found += [path.join(p, f) for f in sorted(listdir(p)) if f.endswith(('F_Paste.svg', 'B_Paste.svg'))]
+		elif p.endswith('_Paste.svg'):
+			found.append(p)
+	return found
+
+def convert(paste_svg):
+	return GenVinylCut(paste_svg).process_svg()
 
 def main():
-	m = GenVinylCut()
-	m.process_svg()
+	paste_svgs = unique_files(find_paste_svgs(sys.argv[1:] or ['.']))
+	if not paste_svgs:
+		raise FileNotFoundError("No F_Paste.svg or B_Paste.svg file found.")
+	failed = 0
+	with ProcessPoolExecutor(max_workers=min(len(paste_svgs), cpu_count())) as pool:
+		for paste_svg, cut_svg in zip(paste_svgs, pool.map(convert, paste_svgs)):
+			if cut_svg is None:
+				failed += 1
+			else:
+				print(f'{paste_svg} -> {cut_svg}')
+	if failed:
+		print(f"Error: {failed} of {len(paste_svgs)} files not converted")
+		sys.exit(1)
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
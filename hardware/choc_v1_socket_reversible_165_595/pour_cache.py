@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+import json, hashlib
+from os import path
+from kbd_backend import *
+from drc_lite import point_seg, seg_seg
+
+# tile fills are kept with their islands, older caches had them removed per tile
+POUR_CACHE_VERSION = 2
+
+def in_ring(x, y, ring):
+	# even-odd rule, ring is the [(x, y)] of a closed outline
+	found = False
+	xj, yj = ring[-1]
+	for xi, yi in ring:
+		if (yi > y) != (yj > y) and x < xi + (y - yi) * (xj - xi) / (yj - yi):
+			found = not found
+		xj, yj = xi, yi
+	return found
+
+def find(parent, i):
+	while parent[i] != i:
+		parent[i] = parent[parent[i]]
+		i = parent[i]
+	return i
+
+class FillPiece:
+	# One outline of a tile fill and its holes as plain point lists, so islands are found without pcbnew
+	__slots__ = ('tile', 'rings', 'box')
+
+	def __init__(self, tile, rings):
+		self.tile = tile
+		self.rings = [[tuple(p) for p in ring] for ring in rings]
+		xs, ys = [p[0] for p in self.rings[0]], [p[1] for p in self.rings[0]]
+		self.box = (min(xs), min(ys), max(xs), max(ys))
+
+	def contains(self, x, y):
+		return in_ring(x, y, self.rings[0]) and not any(in_ring(x, y, hole) for hole in self.rings[1:])
+
+	def edges_in(self, left, top, right, bottom):
+		for ring in self.rings:
+			for i in range(len(ring)):
+				a, b = ring[i-1], ring[i]
+				if max(a[0], b[0]) >= left and min(a[0], b[0]) <= right and max(a[1], b[1]) >= top and min(a[1], b[1]) <= bottom:
+					yield a, b
+
+	def near(self, x, y, r):
+		# copper of the piece within r of (x, y)
+		box = self.box
+		if x < box[0] - r or x > box[2] + r or y < box[1] - r or y > box[3] + r:
+			return False
+		if self.contains(x, y):
+			return True
+		return any(point_seg((x, y), a, b)[0] <= r for a, b in self.edges_in(x - r, y - r, x + r, y + r))
+
+	def crosses(self, a, b):
+		# segment ab crosses the outline or a hole
+		edges = self.edges_in(min(a[0], b[0]), min(a[1], b[1]), max(a[0], b[0]), max(a[1], b[1]))
+		return any(seg_seg(a, b, c, d)[0] == 0 for c, d in edges)
+
+	def overlaps(self, other):
+		# two pieces of neighbour tiles share copper in the overlap at the seam
+		left, top = max(self.box[0], other.box[0]), max(self.box[1], other.box[1])
+		right, bottom = min(self.box[2], other.box[2]), min(self.box[3], other.box[3])
+		if left > right or top > bottom:
+			return False
+		for piece, that in ((self, other), (other, self)):
+			for ring in piece.rings:
+				for x, y in ring:
+					if left <= x <= right and top <= y <= bottom and that.contains(x, y):
+						return True
+		return any(other.crosses(a, b) for a, b in self.edges_in(left, top, right, bottom))
+
+class PourCache:
+	# Cache of copper pour fill polygons, one entry per zone tile
+	# A tile is refilled only if the tracks, vias, pads or edge cuts around it changed
+	def __init__(self, filename='autogen_pour.json', margin=1.0):
+		self.filename = filename
+		self.margin = FromMM(margin) # items this close to a tile affect its fill
+		self.tiles = {}
+		if path.exists(self.filename):
+			try:
+				with open(self.filename, 'r') as f:
+					data = json.load(f)
+				if data.get('version') == POUR_CACHE_VERSION:
+					self.tiles = data['tiles']
+			except (ValueError, KeyError, AttributeError):
+				self.tiles = {} # corrupted cache, refill everything
+
+	def save(self):
+		with open(self.filename, 'w') as f:
+			json.dump({'version': POUR_CACHE_VERSION, 'tiles': self.tiles}, f)
+
+	def collect_items(self, board):
+		# (bounding box, hash key) of everything the zone filler looks at
+		items = []
+		for t in board.GetTracks():
+			bbox = t.GetBoundingBox()
+			if t.GetClass() == 'PCB_VIA':
+				key = ('via', t.GetPosition().x, t.GetPosition().y, t.GetWidth(), t.GetNetCode())
+			else:
+				key = ('track', t.GetStart().x, t.GetStart().y, t.GetEnd().x, t.GetEnd().y, t.GetWidth(), t.GetLayer(), t.GetNetCode())
+			items.append((bbox.GetLeft(), bbox.GetTop(), bbox.GetRight(), bbox.GetBottom(), key))
+		for pad in board.GetPads():
+			bbox = pad.GetBoundingBox()
+			key = ('pad', pad.GetPosition().x, pad.GetPosition().y, bbox.GetWidth(), bbox.GetHeight(),
+				pad.GetNetCode(), pad.IsOnLayer(F_Cu), pad.IsOnLayer(B_Cu))
+			items.append((bbox.GetLeft(), bbox.GetTop(), bbox.GetRight(), bbox.GetBottom(), key))
+		return items
+
+	def edge_hash(self, board):
+		# board outline clips every tile
+		keys = []
+		for d in board.GetDrawings():
+			if d.GetLayer() == Edge_Cuts:
+				bbox = d.GetBoundingBox()
+				keys.append((bbox.GetLeft(), bbox.GetTop(), bbox.GetRight(), bbox.GetBottom()))
+		return repr(sorted(keys))
+
+	def tile_hashes(self, board, tiles):
+		# tiles is a dict of name: (left, top, right, bottom)
+		items = self.collect_items(board)
+		edges = self.edge_hash(board)
+		hashes = {}
+		for name, (left, top, right, bottom) in tiles.items():
+			l, t, r, b = left-self.margin, top-self.margin, right+self.margin, bottom+self.margin
+			keys = sorted(item[4] for item in items if item[0] <= r and item[2] >= l and item[1] <= b and item[3] >= t)
+			h = hashlib.sha1(repr((left, top, right, bottom)).encode())
+			h.update(edges.encode())
+			h.update(repr(keys).encode())
+			hashes[name] = h.hexdigest()
+		return hashes
+
+	def lookup(self, name, tile_hash):
+		# Return cached fill of the tile or None if it has to be refilled
+		entry = self.tiles.get(name)
+		if entry is not None and entry['hash'] == tile_hash:
+			return entry['fill']
+		return None
+
+	def store(self, name, tile_hash, zone, layers):
+		fill = {}
+		for layer in layers:
+			polys = zone.GetFilledPolysList(layer)
+			outlines = []
+			for i in range(polys.OutlineCount()):
+				chains = [polys.COutline(i)] + [polys.CHole(i, h) for h in range(polys.HoleCount(i))]
+				outlines.append([[(c.CPoint(j).x, c.CPoint(j).y) for j in range(c.PointCount())] for c in chains])
+			fill[str(layer)] = outlines
+		self.tiles[name] = {'hash': tile_hash, 'fill': fill}
+
+	def anchors(self, board, net_code):
+		# Pads, vias and tracks of the zone net that keep a fill island, per layer as in store():
+		# layer -> ([(x, y, radius)], [(x0, y0, x1, y1, half width)])
+		found = {str(F_Cu): ([], []), str(B_Cu): ([], [])}
+		for pad in board.GetPads():
+			if pad.GetNetCode() != net_code:
+				continue
+			pos, size = pad.GetPosition(), pad.GetSize()
+			for layer in (F_Cu, B_Cu):
+				if pad.IsOnLayer(layer):
+					found[str(layer)][0].append((pos.x, pos.y, max(size.x, size.y)/2))
+		for t in board.GetTracks():
+			if t.GetNetCode() != net_code:
+				continue
+			if t.GetClass() == 'PCB_VIA':
+				pos = t.GetPosition()
+				for points, segs in found.values():
+					points.append((pos.x, pos.y, t.GetWidth()/2))
+			elif str(t.GetLayer()) in found:
+				start, end = t.GetStart(), t.GetEnd()
+				found[str(t.GetLayer())][1].append((start.x, start.y, end.x, end.y, t.GetWidth()/2))
+		return found
+
+	def remove_islands(self, fills, anchors):
+		# fills: tile name -> fill of store(), pieces of neighbour tiles that overlap at the seam are one island,
+		# islands no anchor touches are dropped like ZONE_FILLER does for a single zone
+		# returns the fill of the merged zone
+		merged = {}
+		for layer in sorted(set(l for fill in fills.values() for l in fill)):
+			pieces = [FillPiece(name, rings) for name, fill in sorted(fills.items()) for rings in fill.get(layer, [])]
+			parent = list(range(len(pieces)))
+			for i in range(len(pieces)):
+				for j in range(i):
+					if pieces[i].tile != pieces[j].tile and pieces[i].overlaps(pieces[j]):
+						parent[find(parent, j)] = find(parent, i)
+			points, segs = anchors.get(layer, ([], []))
+			kept = set()
+			for i, piece in enumerate(pieces):
+				root = find(parent, i)
+				if root in kept:
+					continue
+				if any(piece.near(x, y, r) for x, y, r in points) or \
+					any(piece.near(x0, y0, r) or piece.near(x1, y1, r) or piece.crosses((x0, y0), (x1, y1)) for x0, y0, x1, y1, r in segs):
+					kept.add(root)
+			merged[layer] = [piece.rings for i, piece in enumerate(pieces) if find(parent, i) in kept]
+		return merged
+
+	def restore(self, zone, fill):
+		# Put cached fill polygons back into the zone without running ZONE_FILLER
+		for layer, outlines in fill.items():
+			polys = SHAPE_POLY_SET()
+			for chains in outlines:
+				polys.NewOutline()
+				for x, y in chains[0]:
+					polys.Append(x, y)
+				for h, hole in enumerate(chains[1:]):
+					polys.NewHole()
+					for x, y in hole:
+						polys.Append(x, y, -1, h)
+			# pieces of neighbour tiles overlap at the seams
+			polys.Simplify(SHAPE_POLY_SET.PM_FAST)
+			polys.Fracture(SHAPE_POLY_SET.PM_FAST)
+			zone.SetFilledPolysList(int(layer), polys)
+		zone.SetIsFilled(True)
+		zone.SetNeedRefill(False)
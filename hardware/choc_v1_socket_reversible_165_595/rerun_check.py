@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Check that kbd_place_n_route run again on its own output writes the same board, ie nothing it
+# generated (tracks, vias, edge cut, pour) is left behind and placed a second time
+# usage: python3 rerun_check.py [switch_placement.py flags, ie -q]
+#   runs in a temporary copy of this directory, exits with 1 when the boards differ
+import sys, re, shutil, subprocess, tempfile, difflib
+from os import listdir, path, replace
+
+SRC_DIR = path.dirname(path.abspath(__file__))
+UUID = re.compile(rb'"?[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"?')
+
+def run(work_dir, flags):
+	result = subprocess.run([sys.executable, 'switch_placement.py'] + flags, cwd=work_dir,
+		stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	if result.returncode != 0:
+		print(result.stdout.decode(errors='replace'))
+		print(f"Error: switch_placement.py {' '.join(flags)} failed")
+		sys.exit(1)
+	# every run makes new uuids, they don't count
+	with open(path.join(work_dir, 'autogen.kicad_pcb'), 'rb') as f:
+		return UUID.sub(b'uuid', f.read()).decode().splitlines()
+
+def main():
+	flags = sys.argv[1:]
+	with tempfile.TemporaryDirectory() as work_dir:
+		for file in listdir(SRC_DIR):
+			if path.isfile(path.join(SRC_DIR, file)) and not file.startswith('autogen'):
+				shutil.copy2(path.join(SRC_DIR, file), work_dir)
+		board = [file for file in listdir(work_dir) if file.endswith('.kicad_pcb') and 'auto' not in file][0]
+		first = run(work_dir, flags)
+		# the generated board becomes the input of the second run
+		replace(path.join(work_dir, 'autogen.kicad_pcb'), path.join(work_dir, board))
+		second = run(work_dir, flags)
+	if first != second:
+		for line in list(difflib.unified_diff(first, second, 'first run', 'second run', lineterm=''))[:40]:
+			print(line)
+		print(f"Error: a second run on the generated board doesn't write the same board")
+		sys.exit(1)
+	print(f"second run writes the same board ({len(first)} lines)")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Cycle level model of the matrix scan: the MCU drives one row at a time, loads the 74HC165 column
+# chain and clocks it in over SPI0, reports scan time, scan period and worst key to report latency
+# usage: python3 scan_sim.py [-s] [-v]
+#   -s: sweep SPI clock dividers and matrix sizes, -v: print the edges of one scan
+import sys, re
+from math import ceil
+from os import listdir, path
+from kbd_backend import *
+
+# 74HC165 pins
+PIN_SH_LD, PIN_CLK, PIN_Q7, PIN_DS = '1', '2', '9', '10'
+PIN_D = ['11', '12', '13', '14', '3', '4', '5', '6'] # D0..D7, D7 comes out first
+# 74HC165 timing (ns), approximate max values at VCC 3.3 V, between the 2 V and 4.5 V datasheet columns
+HC165 = {
+	'tpd_clk_q7': 65, # CLK to Q7
+	'tw_sh_ld': 40, # SH/LD low pulse width
+	'trec_sh_ld': 40, # SH/LD high to first CLK
+	'tsu_ds': 50, # DS setup before CLK
+	'fmax': 15e6,
+}
+
+USB_DESCR = path.join(path.dirname(path.abspath(__file__)), '..', '..', 'firmware', 'User', 'usb_descr.h')
+
+def usb_interval(filename=USB_DESCR, endpoint=0x81, default=1e-3):
+	# bInterval of endpoint in MyCfgDescr (s), full speed counts it in 1 ms frames
+	# commented out bytes don't count, default when the file or the endpoint isn't there
+	if not path.exists(filename):
+		return default
+	with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+		text = f.read()
+	text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+	text = re.sub(r'//[^\n]*', '', text)
+	m = re.search(r'MyCfgDescr\[\]\s*=\s*\{(.*?)\}', text, re.S)
+	if not m:
+		return default
+	data = [int(b, 16) for b in re.findall(r'0x([0-9a-fA-F]{1,2})\b', m.group(1))]
+	i = 0
+	while i + 1 < len(data) and data[i] > 0:
+		if data[i+1] == 0x05 and i + 6 < len(data) and data[i+2] == endpoint: # endpoint descriptor
+			return data[i+6] * 1e-3
+		i += data[i]
+	return default
+
+# firmware/User/usbkbd.c: 60 MHz PLL, R8_SPI0_CLOCK_DIV = 4, TMR0_TimerInit(FREQ_SYS / 10)
+# firmware/User/usb_descr.h: EP1 bInterval 1 ms
+FIRMWARE = {
+	'fsys': 60e6,
+	'spi_div': 4,
+	'timer_cycles': 6000000,
+	'usb_interval_s': usb_interval(),
+	'gpio_cycles': 4, # one GPIOx_SetBits/ResetBits
+	'isr_cycles': 60, # interrupt entry and exit
+	'byte_gap_cycles': 2, # between SPI FIFO bytes
+	'tsu_miso': 10, # MCU MISO setup (ns)
+	'debounce_scans': 0, # scans a change has to be stable for, none in key_scan()
+}
+
+def parse_ohm(value, default=10e3):
+	# '10kOhm' -> 10000.0, anything else (ie 'R_US') -> default
+	m = re.match(r'([\d.]+)\s*([kKM]?)', value)
+	if not m:
+		return default
+	return float(m.group(1)) * {'': 1, 'k': 1e3, 'K': 1e3, 'M': 1e6}[m.group(2)]
+
+class ScanChain:
+	# Rows and 74HC165 chain of a board, chain[0] is the register whose Q7 goes to the MCU
+	def __init__(self, rows, chain, cable_links, pullup_ohm, column_pf=20, cable_ns=5, timing=HC165, firmware=FIRMWARE):
+		self.rows = rows # row nets, driven by the MCU
+		self.chain = chain # [(reference, [column net of D7..D0])]
+		self.cable_links = cable_links # links between registers that go through a connector
+		self.pullup_ohm = pullup_ohm
+		self.column_pf = column_pf # column line: 74HC165 input, diodes and track
+		self.cable_ns = cable_ns # FPC propagation and load
+		self.timing = dict(timing)
+		self.firmware = dict(firmware)
+
+	@classmethod
+	def from_board(cls, board):
+		# Follow the DS/Q7 nets from the register that drives an MCU pin
+		fps = {fp.GetReference(): fp for fp in board.GetFootprints()}
+		nets = {} # ref -> {pad number: net}
+		for pad in board.GetPads():
+			nets.setdefault(pad.GetParentAsString(), {})[pad.GetNumber()] = pad.GetNetname()
+		regs = [ref for ref, fp in fps.items() if fp.GetValue() == '74HC165']
+		mcu = next(ref for ref, fp in fps.items() if fp.GetValue().startswith('CH58'))
+		mcu_nets = set(nets[mcu].values())
+		sw_nets = set(n for ref in fps if ref.startswith('SW') for n in nets.get(ref, {}).values())
+		connector_nets = set(n for ref in fps if ref.startswith('J') for n in nets.get(ref, {}).values())
+		rows = sorted(n for n in mcu_nets if n in sw_nets)
+		if not regs:
+			raise ValueError("no 74HC165 on the board")
+		chain = []
+		cable_links = []
+		link = next((nets[r][PIN_Q7] for r in regs if nets[r][PIN_Q7] in mcu_nets), None)
+		if link is None:
+			raise ValueError("no 74HC165 Q7 is connected to the MCU")
+		while True:
+			ref = next((r for r in regs if nets[r][PIN_Q7] == link and r not in [c[0] for c in chain]), None)
+			if ref is None:
+				break
+			if link in connector_nets and chain:
+				cable_links.append(len(chain))
+			chain.append((ref, [nets[ref][p] for p in reversed(PIN_D)]))
+			link = nets[ref][PIN_DS]
+		# column pull-ups: resistors between a column net and the supply
+		pullup = 10e3
+		cols = set(n for ref, c in chain for n in c)
+		for ref, fp in fps.items():
+			if ref.startswith('R') and set(nets.get(ref, {}).values()) & cols:
+				pullup = parse_ohm(fp.GetValue())
+				break
+		return cls(rows, chain, cable_links, pullup)
+
+	def cycles(self, ns):
+		return ceil(ns * self.firmware['fsys'] / 1e9)
+
+	def spi_limit(self, regs=None):
+		# Highest SCK the chain can follow: Q7 must settle at the next register or the MCU within a period
+		t = self.timing
+		period = t['tpd_clk_q7'] + self.firmware['tsu_miso']
+		if (regs or len(self.chain)) > 1:
+			cable = self.cable_ns if self.cable_links else 0
+			period = max(period, t['tpd_clk_q7'] + cable + t['tsu_ds'])
+		return min(t['fmax'], 1e9 / period)
+
+	def settle_ns(self):
+		# a column pulled low by the last row rises through the pull-up to VIH (0.7 VCC)
+		return 1.2 * self.pullup_ohm * self.column_pf * 1e-3
+
+	def timeline(self, rows=None, regs=None, spi_div=None):
+		# Edges of one scan as [(Fsys cycle, signal, level)] and the cycle the scan ends at
+		fw = self.firmware
+		rows = len(self.rows) if rows is None else rows
+		bits = 8 * (len(self.chain) if regs is None else regs)
+		spi_div = fw['spi_div'] if spi_div is None else spi_div
+		gpio = fw['gpio_cycles']
+		settle = self.cycles(self.settle_ns())
+		pulse = max(gpio, self.cycles(self.timing['tw_sh_ld']))
+		recover = max(gpio, self.cycles(self.timing['trec_sh_ld']))
+		events = []
+		t = fw['isr_cycles']
+		for r in range(rows):
+			row = self.rows[r] if r < len(self.rows) else f'ROW{r}'
+			events.append((t, row, 0))
+			t += gpio + settle
+			events.append((t, 'SH/LD', 0))
+			t += pulse
+			events.append((t, 'SH/LD', 1))
+			t += recover
+			for b in range(bits):
+				if b and b % 8 == 0:
+					t += fw['byte_gap_cycles']
+				events.append((t, 'SCK', 1))
+				events.append((t + spi_div//2, 'SCK', 0))
+				t += spi_div
+			events.append((t, row, 1))
+			t += gpio
+		return events, t
+
+	def budget(self, rows=None, regs=None, spi_div=None, timer_cycles=None):
+		# scan time, scan period and worst case latency in seconds, SCK and the chain's SCK limit in Hz
+		fw = self.firmware
+		fsys = fw['fsys']
+		spi_div = fw['spi_div'] if spi_div is None else spi_div
+		timer_cycles = fw['timer_cycles'] if timer_cycles is None else timer_cycles
+		busy = self.timeline(rows, regs, spi_div)[1]
+		period = max(busy, timer_cycles) # timer interrupts during a scan are lost
+		# a key pressed right after its row was read waits a whole period, then the scan to its row
+		# (the last one at worst), the debounce scans and the next USB poll
+		latency = (period + busy + fw['debounce_scans'] * period) / fsys + fw['usb_interval_s']
+		return {
+			'scan_s': busy / fsys,
+			'period_s': period / fsys,
+			'latency_s': latency,
+			'sck_hz': fsys / spi_div,
+			'sck_limit_hz': self.spi_limit(regs),
+		}
+
+	def describe(self):
+		links = []
+		for i, (ref, cols) in enumerate(self.chain):
+			links.append(('(FPC) ' if i in self.cable_links else '') + ref)
+		return f"MCU <- {' <- '.join(links)}, {8*len(self.chain)} bits, {len(self.rows)} rows ({', '.join(self.rows)})"
+
+def print_budget(chain):
+	b = chain.budget()
+	fw = chain.firmware
+	print(f"chain: {chain.describe()}")
+	print(f"SCK {b['sck_hz']/1e6:.3f} MHz (Fsys {fw['fsys']/1e6:.0f} MHz / {fw['spi_div']}), chain limit {b['sck_limit_hz']/1e6:.3f} MHz")
+	if b['sck_hz'] > b['sck_limit_hz']:
+		print(f"Warning: SCK is above what the chain can follow, use a divider of {ceil(fw['fsys'] / b['sck_limit_hz'])} or more")
+	print(f"column settle {chain.settle_ns():.0f} ns ({chain.pullup_ohm/1e3:g} kOhm pull-up, {chain.column_pf} pF)")
+	print(f"scan {b['scan_s']*1e6:.2f} us, period {b['period_s']*1e3:.3f} ms, worst key to report latency {b['latency_s']*1e3:.3f} ms")
+	back = chain.budget(timer_cycles=0)
+	print(f"back to back scanning: {1/back['period_s']/1e3:.1f} kHz, worst latency {back['latency_s']*1e3:.3f} ms")
+
+def print_sweep(chain):
+	# scan time (us) when the matrix grows, per SPI divider, '!' where SCK is above the chain limit
+	divs = [2, 4, 8, 16, 32]
+	print(f"{'rows':>5}{'cols':>6}" + ''.join(f"{'/'+str(d):>10}" for d in divs) + "   scan us per SPI divider")
+	for rows in (4, 5, 6, 8):
+		for regs in (1, 2, 3, 4):
+			line = f"{rows:>5}{8*regs:>6}"
+			for d in divs:
+				b = chain.budget(rows, regs, d, timer_cycles=0)
+				mark = '!' if b['sck_hz'] > b['sck_limit_hz'] else ' '
+				line += f"{b['scan_s']*1e6:>9.2f}{mark}"
+			print(line)
+
+def main():
+	filename = [file for file in listdir('.') if file.endswith('.kicad_pcb') and 'auto' not in file][0]
+	try:
+		chain = ScanChain.from_board(LoadBoard(filename))
+	except ValueError as e:
+		print(f"Error: {filename}: {e}")
+		sys.exit(1)
+	print_budget(chain)
+	if '-s' in sys.argv:
+		print_sweep(chain)
+	if '-v' in sys.argv:
+		events = chain.timeline()[0]
+		for cycle, signal, level in events:
+			print(f"{cycle/chain.firmware['fsys']*1e9:>12.1f} ns  {signal:<6} {level}")
+
+if __name__ == "__main__":
+	main()
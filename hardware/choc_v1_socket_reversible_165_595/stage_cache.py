@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import pickle, hashlib
+from os import path, getpid, replace
+
+class StageCache:
+	# Content addressed cache of the tracks and vias added by each routing stage
+	# key: hash of the stage name and everything it reads, value: (segment array, via array)
+	def __init__(self, filename='autogen_stages.pickle', sources=()):
+		self.filename = filename
+		self.entries = {}
+		self.used = set()
+		# any change to the generator code invalidates every stage
+		h = hashlib.sha1()
+		for src in sources:
+			with open(src, 'rb') as f:
+				h.update(f.read())
+		self.code_hash = h.hexdigest()
+		if path.exists(self.filename):
+			try:
+				with open(self.filename, 'rb') as f:
+					self.entries = pickle.load(f)
+			except (pickle.UnpicklingError, EOFError):
+				self.entries = {} # corrupted cache, rerun everything
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, stage, inputs):
+		h = hashlib.sha1(self.code_hash.encode())
+		h.update(stage.encode())
+		h.update(repr(inputs).encode())
+		return h.hexdigest()
+
+	def get(self, key):
+		entry = self.entries.get(key)
+		if entry is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.used.add(key)
+		return entry
+
+	def put(self, key, seg, via):
+		self.entries[key] = (seg, via)
+		self.used.add(key)
+
+	def save(self):
+		# only keep the entries of the last run so the file doesn't grow forever
+		# written aside and renamed, parallel runs (sweep.py) share the file
+		tmp = f'{self.filename}.{getpid()}.tmp'
+		with open(tmp, 'wb') as f:
+			pickle.dump({k: v for k, v in self.entries.items() if k in self.used}, f)
+		replace(tmp, self.filename)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Layout parameter sweep: run kbd_place_n_route for every point of a parameter grid on all cores
+# usage: python3 sweep.py sweep.json [-j jobs] [-p] [-k]
+# sweep.json maps parameter names to lists of values, ie
+# {"sw_x_spc": [18, 19], "sw_y_spc": [17], "col_offsets": [[0, 0, -9, -11.5, -9, -6.5]],
+#  "thumb_offsets": [{"2": [2.9, 14.8, -23], "3": [23.8, 19.8, -30]}]}
+import sys, json, csv, hashlib, itertools
+from os import cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from kbd_backend import *
+from switch_placement import kbd_place_n_route
+from drc_lite import ClearanceError
+
+def point_hash(params):
+	return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:10]
+
+def gen_grid(spec):
+	names = sorted(spec)
+	return [dict(zip(names, values)) for values in itertools.product(*[spec[n] for n in names])]
+
+def run_point(params, with_pour=False, check=False):
+	# each worker loads its own board and writes its own autogen_<hash>.kicad_pcb
+	h = point_hash(params)
+	plugin = kbd_place_n_route(is_fast_mode=not with_pour, is_clearance_check=check)
+	plugin.set_params(params)
+	plugin.output_filename = f'autogen_{h}.kicad_pcb'
+	try:
+		plugin.Run()
+	except ClearanceError as e: # rejected right after routing, nothing written
+		return {'hash': h, 'area_mm2': '', 'track_length_mm': '', 'via_count': '',
+			'violations': len(e.violations), 'params': json.dumps(params, sort_keys=True)}
+	return {
+		'hash': h,
+		'area_mm2': round(plugin.board_area(), 1),
+		'track_length_mm': round(ToMM(plugin.track_length), 1),
+		'via_count': plugin.via_count,
+		'violations': 0,
+		'params': json.dumps(params, sort_keys=True),
+	}
+
+def write_summary(results, filename='sweep_summary.csv'):
+	# rejected points last
+	results = sorted(results, key=lambda r: (r['violations'] > 0, r['area_mm2'] or 0, r['track_length_mm'] or 0))
+	with open(filename, 'w', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames=['hash', 'area_mm2', 'track_length_mm', 'via_count', 'violations', 'params'])
+		writer.writeheader()
+		writer.writerows(results)
+	print(f"{'hash':<12}{'area mm2':>10}{'track mm':>10}{'vias':>6}{'drc':>5}  params")
+	for r in results:
+		print(f"{r['hash']:<12}{r['area_mm2']:>10}{r['track_length_mm']:>10}{r['via_count']:>6}{r['violations']:>5}  {r['params']}")
+
+def main():
+	if len(sys.argv) < 2:
+		print('usage: python3 sweep.py sweep.json [-j jobs] [-p] [-k]')
+		sys.exit(1)
+	with open(sys.argv[1], 'r') as f:
+		grid = gen_grid(json.load(f))
+	jobs = int(sys.argv[sys.argv.index('-j')+1]) if '-j' in sys.argv else cpu_count()
+	with_pour = '-p' in sys.argv # include copper pour, slow
+	check = '-k' in sys.argv # reject points with clearance violations
+	with ProcessPoolExecutor(max_workers=jobs) as pool:
+		results = list(pool.map(run_point, grid, [with_pour]*len(grid), [check]*len(grid)))
+	write_summary(results)
+	if check and all(r['violations'] > 0 for r in results): # the check itself is off, not the layouts
+		print(f"Error: clearance check rejected all {len(results)} points")
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
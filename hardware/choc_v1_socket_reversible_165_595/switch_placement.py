@@ -1,55 +1,342 @@
 #!/usr/bin/env python3
 from os import listdir
-from math import sin, cos, radians
-from pcbnew import *
-import sys
+from math import sin, cos, radians, hypot
+from kbd_backend import *
+from pour_cache import PourCache
+from geometry import WaypointTemplate, RouteTemplate, TemplateLibrary
+from track_buffer import TrackBuffer
+from stage_cache import StageCache
+from pad_cache import PadCache, LAYER_F, LAYER_B
+from kbd_model import Footprint, Pad
+from drc_lite import ClearanceChecker, ClearanceError, edges
+from maze_router import MazeRouter, RouteScheduler
+from connectivity import NetVerifier
+from os import path, environ, replace, cpu_count
+import sys, re, json, time
+
+# Run() stages in order, see update_pad_pos() in between
+PLACE_STAGES = [
+	'gen_fp_placement',
+	'place_sw',
+	'place_led',
+	'place_diode',
+	'place_mcu',
+	'place_misc',
+	'place_shift_register_and_resistor',
+	'place_connector',
+]
+# routing stages only add tracks/vias, value is the reference prefixes of the footprints they read
+ROUTE_STAGES = {
+	'place_via_for_led': ('LED',),
+	'place_via_for_diode': ('D',),
+	'place_via_for_connector': ('J_',),
+	'connect_rows': ('SW', 'U1'),
+	'connect_pad1': ('SW',),
+	'connect_pad2': ('SW',),
+	'connect_diode_and_sw': ('D', 'SW'),
+	'connect_sw_col': ('SR_', 'D'),
+	'connect_leds_by_col': ('SW',),
+	'connect_led_5v': ('LED', 'R1'),
+	'connect_shift_register_and_resistor': ('SR_', 'R_'),
+	'connect_connector_and_mcu': ('J_', 'U1', 'JP1'),
+	# maze routed last, around everything above
+	'connect_maze': ('',),
+}
+# generated tracks and vias are kept in a group per routing stage, tracks in no such group are hand routed
+GENERATED_GROUP = 'kbd_place_n_route:'
+# stages that also read the tracks and vias routed before them
+MAZE_STAGES = ('connect_maze',)
+# maze routed pads: (ref, layer, pad number, footprints the route stays around), in routing order
+MAZE_ROUTES = [
+	# pinky columns, from the end of connect_sw_col to the diode
+	('D1', B_Cu, '3', ['D1', 'D2']),
+	('D0', B_Cu, '3', ['D0', 'D2']),
+	# thumb keys are rotated, so their diode, column and row tracks are maze routed
+	('D6', B_Cu, '3', ['D6', 'SR_LEFT1']), # COL6
+	('D6', F_Cu, '5', ['D6', 'SW26']), # between pad 4 and 6 so it goes first
+	('D6', F_Cu, '4', ['D6', 'SW36']),
+	('SW26', F_Cu, '2', ['SW26', 'SW25', 'U1']), # ROW2
+	('SW36', F_Cu, '2', ['SW36', 'SW35']), # ROW3
+]
+
+# key matrix footprints, ie SW23 is row 2 column 3
+MATRIX_REF = re.compile(r'(SW|LED)(\d)(\d)$')
+
+# switch local waypoints, rotated with the switch
+LED_ANCHOR = WaypointTemplate([(0, -4.7, F_Cu)])
+PAD1_ROUTE = WaypointTemplate([
+	( 3.3, 6.0, B_Cu),
+	( 1.5, 4.0, B_Cu),
+	(-2.7, 4.0,   -1), # via
+	(-2.7, 5.4, F_Cu)
+])
+PAD2_ROUTE = WaypointTemplate([
+	(-8.2, 3.6, B_Cu),
+	(-6.5, 2.0, B_Cu),
+	( 7.5, 2.0,   -1), # via
+	( 8.2, 3.6, F_Cu)
+])
+# LED local via positions of pad 1, 3 and 4, GND is connected by copper pour
+LED_VIAS = WaypointTemplate([(3.3, 0, -1), (-3, 0, -1), (-3.6, 0, -1)])
+# LED chain from a switch to the one above it, switch local, overridden by route_templates.json
+# entries of the same name (see gen_led_track())
+LED_ROUTES = {
+	# power rail - left
+	'led_rail': RouteTemplate.from_points([
+		(-3.3, -5.5, F_Cu),
+		(-3.3, -6.9, F_Cu),
+		(-1.7, -8.5, F_Cu),
+		(-1.7,-14.7, F_Cu),
+		(-4.4,-17.4, F_Cu),
+		(-4.4,-21.9, F_Cu),
+		(-3.3,-22.5, F_Cu),
+	]),
+	# led dout -> led din, even column
+	'led_dout_even': RouteTemplate.from_points([
+		( 3.3, -5.5, F_Cu),
+		( 3.3,-10.2, F_Cu),
+		(-3.3,-16.8, F_Cu),
+		(-3.3,-20.9, F_Cu),
+	]),
+	# led dout -> led din, odd column
+	'led_dout_odd': RouteTemplate.from_points([
+		(-3.3, -3.9, F_Cu),
+		(-2.1, -4.4, F_Cu),
+		(-2.1, -6.2, F_Cu),
+		( 2.1,-10.5, F_Cu), # clear of the switch hole above
+		( 2.1,-21.9, F_Cu),
+		( 3.3,-22.5, F_Cu),
+	]),
+}
 
 class kbd_place_n_route(ActionPlugin):
-	def __init__(self, is_fast_mode=False):
+	def __init__(self, is_fast_mode=False, is_incremental_pour=False, is_direct_write=False, use_stage_cache=False, is_clearance_check=False, is_net_check=False):
 		# Initialize column offsets and switch positions
 		self.col_offsets = [0, 0, -9, -11.5, -9, -6.5]
 		self.sw0_pos = VECTOR2I_MM(60,60)
 		self.sw_x_spc = 19 # 17.5 #19.05
 		self.sw_y_spc = 17 #19.05
+		# thumb cluster switches by row: x/y offset (mm) from index bottom switch, orientation
+		self.thumb_offsets = {2: (2.9, 14.8, -23), 3: (23.8, 19.8, -30)}
+		self.connector_offset = (116, 35) # mm from sw0_pos
+		self.output_filename = 'autogen.kicad_pcb'
 		self.fp_dict = {} # footpint dictionary
+		self.fp_by_val = {} # value -> footprints in board order
+		self.fp_matrix = {} # (ref prefix, row, col) -> footprint
+		self.fp_queries = {} # get_fp() results
 		self.is_fast_mode = is_fast_mode
+		self.is_incremental_pour = is_incremental_pour
+		self.is_direct_write = is_direct_write # write tracks straight into the saved file
+		self.track_buf = TrackBuffer()
+		self.use_stage_cache = use_stage_cache # replay unchanged routing stages from autogen_stages.pickle
+		self.use_maze_cache = True # without the stage cache, replay an unchanged connect_maze from autogen_maze.pickle
+		self.stage_cache = None # StageCache of the current Run()
+		self.is_clearance_check = is_clearance_check # fail the run on DRC-lite violations
+		self.is_net_check = is_net_check # report unrouted nets, dangling tracks and shorts
+		self.clearance = 0.1 # mm, Default net class of the .kicad_pro
+		self.pour_tiles = (6, 4) # copper pour tiles in x and y for incremental fill
+		self.net_index = {} # net name -> pads, built by update_pad_pos
+		self.pad_grid = {} # spatial pad lookup, built by update_pad_pos
+		self.pad_grid_size = FromMM(2.54)
+		self.route_workers = 1 # maze routing processes, main() uses every core
+		self.route_templates = TemplateLibrary() # captured routes, replace LED_ROUTES of the same name
+		self.use_cell_stamp = True # route one key per orientation and copy it to the others, see stamp_cells()
+		self.ripup = {} # only rip up and route again these stages, nets and region, see set_ripup()
+		self.route_stages = list(ROUTE_STAGES) # stages routed by Run(), see remove_old_tracks()
+		self.pad_cache = None # library pad offsets and board nets, see update_pad_pos()
+		self.board_from_file = False # board read by load_board(), not handed over by KiCad
 
 	def load_board(self):
-		# Load the board file
+		# Load the board file, a board that is already loaded is reused (watch mode)
 		if not hasattr(self, 'board'):
 			self.filename = [file for file in listdir('.') if file.endswith('.kicad_pcb') and 'auto' not in file][0]
 			self.board = LoadBoard(self.filename)
+			self.board_from_file = True
+		self.pad_cache = self.new_pad_cache()
+		self.fp_dict = {}
+		self.index_footprints()
 		for fp in self.board.GetFootprints():
-			ref = fp.GetReference()
-			self.fp_dict[ref]= {
-				'fp': fp,
-				'ref': ref,
-				'val': fp.GetValue(),
-				'pos': VECTOR2I_MM(0,0),  # can't get shallow copy from fp.GetPosition()
-				'ori': 0, # orientation is not updated after placement
-				'ref_inst': fp.Reference(),
-				'padF': {},
-				'padB': {}
-			}
+			self.add_fp(Footprint(fp))
+
+	def add_fp(self, footprint):
+		# Add or replace a footprint record and keep the lookup indexes in sync
+		replaced = footprint.ref in self.fp_dict
+		self.fp_dict[footprint.ref] = footprint
+		if replaced:
+			self.index_footprints()
+			return
+		self.fp_by_val.setdefault(footprint.val, []).append(footprint)
+		m = MATRIX_REF.match(footprint.ref)
+		if m:
+			self.fp_matrix[(m.group(1), int(m.group(2)), int(m.group(3)))] = footprint
+		self.fp_queries = {}
+
+	def index_footprints(self):
+		# Rebuild the value and matrix indexes from fp_dict
+		self.fp_by_val = {}
+		self.fp_matrix = {}
+		self.fp_queries = {}
+		for footprint in list(self.fp_dict.values()):
+			del self.fp_dict[footprint.ref]
+			self.add_fp(footprint)
+
+	def new_pad_cache(self):
+		# nets of KiCad's board are read from memory unless it says it matches its file, the netlist may
+		# have been updated without saving, the nets of a board loaded here are the ones of its file
+		filename = self.board.GetFileName()
+		is_modified = getattr(self.board, 'IsModified', None)
+		live = not self.board_from_file and (not filename or is_modified is None or is_modified())
+		return PadCache(filename, live=live)
 
 	def update_pad_pos(self):
-		for pad in self.board.GetPads():
-			if pad.GetNumber() != '': # skip mounting pad
-				if pad.IsOnLayer(F_Cu):
-					self.fp_dict[pad.GetParentAsString()]['padF'][pad.GetNumber()] = {
-						'pos': pad.GetCenter(),
-						'net': pad.GetNetname()
-					}
-				elif pad.IsOnLayer(B_Cu):	
-					self.fp_dict[pad.GetParentAsString()]['padB'][pad.GetNumber()] = {
-						'pos': pad.GetCenter(),
-						'net': pad.GetNetname()
-					}
+		# Pad positions from the placement of each footprint and its library pad offsets,
+		# the board pads are only walked when autogen_pads.pickle doesn't know a footprint yet
+		if self.pad_cache is None:
+			self.pad_cache = self.new_pad_cache()
+		fps = list(self.fp_dict.values())
+		self.pad_cache.update(self.board, fps)
+		for fp, pads in zip(fps, self.pad_cache.place(fps)):
+			for num, net, x, y, angle, w, h, bits in pads:
+				if bits & LAYER_F:
+					fp.padF[num] = Pad(num, net, x, y, w, h, angle, bits & LAYER_B != 0)
+				elif bits & LAYER_B:
+					fp.padB[num] = Pad(num, net, x, y, w, h, angle)
+		self.build_pad_index()
+
+	def build_pad_index(self):
+		# net -> [(ref, layer, pad number)] and grid cell -> [(ref, layer, pad number)]
+		self.net_index = {}
+		self.pad_grid = {}
+		for ref, fp in self.fp_dict.items():
+			for layer, pads in ((F_Cu, fp.padF), (B_Cu, fp.padB)):
+				for num, pad in pads.items():
+					key = (ref, layer, num)
+					self.net_index.setdefault(pad.net, []).append(key)
+					cell = (pad.x // self.pad_grid_size, pad.y // self.pad_grid_size)
+					self.pad_grid.setdefault(cell, []).append(key)
+
+	def get_pad(self, key):
+		ref, layer, num = key
+		return self.fp_dict[ref].pads(layer)[num]
+
+	def find_pads(self, net, ref=None, layer=None):
+		# All pads on net as [(ref, pad number, pad)], optionally only of one footprint/layer
+		return [(k[0], k[2], self.get_pad(k)) for k in self.net_index.get(net, [])
+			if (ref is None or k[0] == ref) and (layer is None or k[1] == layer)]
+
+	def find_pad(self, net, ref=None, layer=None):
+		pads = self.find_pads(net, ref, layer)
+		return pads[0][2] if pads else None
+
+	def pads_near(self, pos, radius):
+		# Pads whose center is within radius of pos as [(ref, layer, pad number)]
+		r = int(radius) // self.pad_grid_size + 1
+		cx, cy = pos.x // self.pad_grid_size, pos.y // self.pad_grid_size
+		found = []
+		for gx in range(cx-r, cx+r+1):
+			for gy in range(cy-r, cy+r+1):
+				for key in self.pad_grid.get((gx, gy), []):
+					p = self.get_pad(key)
+					if (p.x-pos.x)**2 + (p.y-pos.y)**2 <= radius**2:
+						found.append(key)
+		return found
 
 	def remove_old_tracks(self):
-		# Remove all existing tracks from the board
-		for t in self.board.GetTracks():
-			self.board.Delete(t)
+		# Remove the tracks and vias generated by the routing stages, only the ones in self.ripup if set,
+		# hand routed tracks are kept, the generated edge cut and pour always go, Run() places them again
+		# self.route_stages is set to the stages Run() routes again
+		stages = self.ripup.get('stages')
+		generated = {} # uuid -> (item, stage that made it)
+		outlines = [] # edge cut and zones
+		for group in self.board.Groups():
+			name = group.GetName()
+			if name.startswith(GENERATED_GROUP):
+				for item in group.GetItems():
+					if item.GetClass() in ('PCB_TRACK', 'PCB_ARC', 'PCB_VIA'):
+						generated[item.m_Uuid.AsString()] = (item, name[len(GENERATED_GROUP):])
+					elif item.GetClass() in ('PCB_SHAPE', 'ZONE'):
+						outlines.append(item)
+		on_board = set(stage for item, stage in generated.values())
+		items = [entry for entry in generated.values() if stages is None or entry[1] in stages]
+		if 'nets' in self.ripup or 'region' in self.ripup:
+			if 'nets' in self.ripup:
+				self.update_pad_pos() # pads where the old tracks were
+			seg_items = [entry for entry in items if entry[0].GetClass() != 'PCB_VIA']
+			via_items = [entry for entry in items if entry[0].GetClass() == 'PCB_VIA']
+			segs, vias = self.board_copper([item for item, stage in seg_items + via_items])
+			picked = set(item.m_Uuid.AsString() for item, stage in items)
+			context = self.board_copper([t for t in self.board.GetTracks() if t.m_Uuid.AsString() not in picked])
+			seg_ids, via_ids = self.in_scope(segs, vias, context)
+			items = [seg_items[i] for i in seg_ids] + [via_items[i] for i in via_ids]
+			if stages is None: # the stages that lost items and the ones that never ran
+				stages = set(stage for item, stage in items) | (set(ROUTE_STAGES) - on_board)
+		self.route_stages = [stage for stage in ROUTE_STAGES if stages is None or stage in stages]
+		for item, stage in items:
+			self.board.Delete(item)
+		for item in outlines:
+			self.board.Delete(item)
+
+	def add_generated(self, item, stage):
+		# Add an item to the board and to the group of stage, like TrackBuffer.commit() does for tracks
+		self.board.Add(item)
+		name = GENERATED_GROUP + stage
+		group = next((g for g in self.board.Groups() if g.GetName() == name), None)
+		if group is None:
+			group = PCB_GROUP(self.board)
+			group.SetName(name)
+			self.board.Add(group)
+		group.AddItem(item)
+
+	def set_ripup(self, stages=None, nets=None, region=None):
+		# Limit Run() to routing stages (names of ROUTE_STAGES), nets (names) and region ((x0, y0, x1, y1) mm),
+		# generated items outside of them stay on the board, no arguments is everything
+		self.ripup = {}
+		if stages is not None:
+			for stage in stages:
+				if stage not in ROUTE_STAGES:
+					raise ValueError(f"Unknown routing stage: {stage}")
+			self.ripup['stages'] = set(stages)
+		if nets is not None:
+			self.ripup['nets'] = set(nets)
+		if region is not None:
+			if len(region) != 4:
+				raise ValueError(f"Region needs x0, y0, x1, y1: {region}")
+			x0, y0, x1, y1 = region
+			self.ripup['region'] = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+	def board_copper(self, tracks):
+		# Board tracks and vias as TrackBuffer segment and via tuples, arcs become straight segments
+		segs, vias = [], []
+		for t in tracks:
+			if t.GetClass() == 'PCB_VIA':
+				pos = t.GetPosition()
+				vias.append((pos.x, pos.y, t.GetDrillValue(), t.GetWidth()))
+			else:
+				start, end = t.GetStart(), t.GetEnd()
+				segs.append((start.x, start.y, end.x, end.y, t.GetWidth(), t.GetLayer()))
+		return segs, vias
+
+	def in_scope(self, segs, vias, context=((), ())):
+		# Indexes of the segments and vias inside the rip-up region and on the rip-up nets, a net reaches
+		# copper from its pads through segs, vias and the context copper (segments, vias)
+		seg_ids, via_ids = list(range(len(segs))), list(range(len(vias)))
+		if 'region' in self.ripup:
+			x0, y0, x1, y1 = [FromMM(v) for v in self.ripup['region']]
+			seg_ids = [i for i in seg_ids if max(segs[i][0], segs[i][2]) >= x0 and min(segs[i][0], segs[i][2]) <= x1
+				and max(segs[i][1], segs[i][3]) >= y0 and min(segs[i][1], segs[i][3]) <= y1]
+			via_ids = [i for i in via_ids if x0 <= vias[i][0] <= x1 and y0 <= vias[i][1] <= y1]
+		if 'nets' in self.ripup:
+			verifier = self.net_verifier(segs, vias)
+			for seg in context[0]:
+				verifier.add_segment(*seg)
+			for x, y, drill, width in context[1]:
+				verifier.add_via(x, y, width)
+			verifier.connect()
+			label = verifier.labels()
+			# segments come first, then vias, see net_verifier()
+			seg_ids = [i for i in seg_ids if label[i] in self.ripup['nets']]
+			via_ids = [i for i in via_ids if label[len(segs) + i] in self.ripup['nets']]
+		return seg_ids, via_ids
 
 	def defaults(self):
 		# Set default values for the plugin
@@ -59,15 +346,8 @@ class kbd_place_n_route(ActionPlugin):
 		self.board = GetBoard()
 
 	def add_track(self, start, end, layer=F_Cu, width=0.2):
-		# Add a track to the board
-		track = PCB_TRACK(self.board)
-		track.SetStart(start)
-		track.SetEnd(end)
-		if (width != 0.2):
-			track.SetWidth(FromMM(width)) # default 0.2mm
-		if (layer != F_Cu):
-			track.SetLayer(layer)
-		self.board.Add(track)
+		# Add a track to the board, buffered until commit_tracks()
+		self.track_buf.add_track(start, end, layer, FromMM(width))
 
 	def add_tracks(self, points): 
 		# Add multiple tracks to the board
@@ -81,13 +361,21 @@ class kbd_place_n_route(ActionPlugin):
 				self.add_track(points[i][0], points[i+1][0], points[i+1][1])
 	
 	def add_via(self, pos, drill, width):
-		# Add a via to the board
-		via = PCB_VIA(self.board)
-		via.SetPosition(pos)
-		via.SetDrill(FromMM(drill)) # defaults 0.4mm, 0.8mm
-		via.SetWidth(FromMM(width))
-		self.board.Add(via)
+		# Add a via to the board, buffered until commit_tracks()
+		self.track_buf.add_via(pos, FromMM(drill), FromMM(width)) # defaults 0.4mm, 0.8mm
+
+	def commit_tracks(self):
+		# Send all buffered tracks and vias to the board in one bulk add
+		self.track_buf.commit(self.board)
 	
+	def flip_fp(self, fp):
+		# Move a footprint to the bottom side, nothing to do if it's there already so Run() can be repeated
+		if not fp.IsFlipped():
+			fp.Flip(fp.GetPosition(), False)
+			record = self.fp_dict[fp.GetReference()]
+			record.angle = -record.angle # KiCad mirrors the orientation too
+			record.flipped = True
+
 	def is_thumb_cluster(self, ref):
 		return (ref[-1] == '6' or ref[-1] == '7')
 
@@ -96,8 +384,9 @@ class kbd_place_n_route(ActionPlugin):
 		fp.SetPosition(pos) 
 		fp.SetOrientationDegrees(orientation)
 		# update fp_dict
-		self.fp_dict[fp.GetReference()]['pos'] = pos
-		self.fp_dict[fp.GetReference()]['ori'] = orientation
+		self.fp_dict[fp.GetReference()].pos = pos
+		self.fp_dict[fp.GetReference()].ori = orientation
+		self.fp_dict[fp.GetReference()].angle = orientation
 	
 	def rotate(self, origin, point, angle): 
 		# Rotate a point counterclockwise by a given angle around a given origin
@@ -110,141 +399,168 @@ class kbd_place_n_route(ActionPlugin):
 		return VECTOR2I(int(origin.x + rotated_x), int(origin.y + rotated_y))
 	
 	def get_fp(self, fp_val):
-		# Get a list of footprint references with a specific value
-			results = [value for value in self.fp_dict.values() if fp_val in value['val']]
-			if not results:
-				raise ValueError(f"No matching footprints found for value: {fp_val}")
-			return results
-
-	def gen_led_track(self, netname, s_offset = VECTOR2I_MM(0,0)): #TODO put the start point track at top
-		# Generate LED track code
-		# TODO if no start point is the same, then generate code using add_tracks
-		s_list = []
+		# Get a list of footprints whose value contains fp_val, in board order
+		# the result is shared between calls, don't modify it
+		results = self.fp_queries.get(fp_val)
+		if results is None:
+			vals = [val for val in self.fp_by_val if fp_val in val]
+			if len(vals) == 1:
+				results = self.fp_by_val[vals[0]]
+			else:
+				results = [fp for fp in self.fp_dict.values() if fp.val in vals]
+			self.fp_queries[fp_val] = results
+		if not results:
+			raise ValueError(f"No matching footprints found for value: {fp_val}")
+		return results
+
+	def matrix_fp(self, prefix, row, col):
+		# SW/LED footprint at a key matrix position, None if there isn't one
+		return self.fp_matrix.get((prefix, row, col))
+
+	def gen_led_track(self, netname, s_offset = VECTOR2I_MM(0,0), name=None):
+		# Capture the board tracks of netname as a template relative to s_offset (a switch position),
+		# saved into route_templates.json as name, connect_leds_by_col() picks it up on the next run
+		segs = []
 		for t in self.board.GetTracks():
-			if t.GetNetname() == netname:
-				sx = round(ToMM((t.GetStart()-s_offset).x), 1)
-				sy = round(ToMM((t.GetStart()-s_offset).y), 1)
-				ex = round(ToMM((t.GetEnd()  -s_offset).x), 1)
-				ey = round(ToMM((t.GetEnd()  -s_offset).y), 1)
-				if (sx != ex): # remove led via connection
-					s_list.append((sx, sy, ex, ey))
-		s_list_sorted = sorted(s_list, key=lambda x: x[0])	
-		for s in s_list_sorted:
-			format_code = f"self.add_track(offset + VECTOR2I_MM({s[0]:>5.1f}, {s[1]:>5.1f}), offset + VECTOR2I_MM({s[2]:>5.1f}, {s[3]:>5.1f}), B_Cu)"
-			print(format_code)
-		
+			if t.GetNetname() == netname and t.GetStart().x != t.GetEnd().x: # remove led via connection
+				segs.append((t.GetStart().x, t.GetStart().y, t.GetEnd().x, t.GetEnd().y, t.GetWidth(), t.GetLayer()))
+		template = RouteTemplate.capture(segs, [], s_offset)
+		if name is not None:
+			self.route_templates.load().add(name, 'SW_Push', template)
+			self.route_templates.save()
+		return template
+
 	def gen_fp_placement(self):
 		# Place switches on the board
-		for sw in self.get_fp('SW_Push'): 
-			sw_row = int(sw['ref'][2])
-			sw_col = int(sw['ref'][3])
+		sws = self.get_fp('SW_Push')
+		for sw in sws: 
+			sw_row = int(sw.ref[2])
+			sw_col = int(sw.ref[3])
 			sw_orienation = 0
 			if(sw_col < 6): # 4 fingers
 				sw_offset = VECTOR2I_MM(self.sw_x_spc*sw_col, self.sw_y_spc*sw_row + self.col_offsets[sw_col])
 				sw_orienation = 0
 			# thumb, respective to index bottom switch
 			elif (sw_col == 6): 
-				if sw_row == 2: # thumb cluster
-					sw_offset = VECTOR2I_MM(self.sw_x_spc*5+2.9, self.sw_y_spc*3+14.8)
-					sw_orienation = -23
-				elif sw_row == 3: # thumb cluster
-					sw_offset = VECTOR2I_MM(self.sw_x_spc*5+23.8, self.sw_y_spc*3+19.8)
-					sw_orienation = -30
-			sw['pos'] = self.sw0_pos+sw_offset
-			sw['ori'] = sw_orienation
-			led_ref = 'LED'+sw['ref'][-2:]
-			self.fp_dict[led_ref]['pos'] = self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM(0,-4.7), sw['ori'])
-			self.fp_dict[led_ref]['ori'] = sw_orienation
+				if sw_row in self.thumb_offsets: # thumb cluster
+					dx, dy, sw_orienation = self.thumb_offsets[sw_row]
+					sw_offset = VECTOR2I_MM(self.sw_x_spc*5+dx, self.sw_y_spc*3+dy)
+			sw.pos = self.sw0_pos+sw_offset
+			sw.ori = sw_orienation
+		# LEDs follow their switch
+		for sw, led_anchor in zip(sws, LED_ANCHOR.place(sws)):
+			led = self.matrix_fp('LED', int(sw.ref[2]), int(sw.ref[3]))
+			led.pos = led_anchor[0][0]
+			led.ori = sw.ori
 
 	def place_sw(self):
 		# Place switches on the board
 		for sw in self.get_fp('SW_Push'): 
 			# place switches
-			self.place_fp(sw['pos'], sw['fp'], sw['ori'])
+			self.place_fp(sw.pos, sw.fp, sw.ori)
 			# Move text
-			sw['ref_inst'].SetTextPos(sw['pos'] + VECTOR2I_MM(4.4, 7.1))
-			for item in sw['fp'].GraphicalItems(): #TODO store graphical items in dict
+			sw.ref_inst.SetTextPos(sw.pos + VECTOR2I_MM(4.4, 7.1))
+			for item in sw.fp.GraphicalItems(): #TODO store graphical items in dict
 				if type(item) == PCB_TEXT:
-					item.SetPosition(sw['pos']+VECTOR2I_MM(-4.4,7.1))
+					item.SetPosition(sw.pos+VECTOR2I_MM(-4.4,7.1))
 
 	def place_led(self):
 		# Place LEDs on the board
 		for led in self.get_fp('SK6812MINI'):
-			self.place_fp(led['pos'], led['fp'], led['ori'])
+			self.place_fp(led.pos, led.fp, led.ori)
 
 	def place_diode(self):
 		# Place diodes on the board
 		for diode in self.get_fp('BAW56DW'):
 			# get top switch position
-			sw_ref_t = 'SW3'+diode['ref'][1:3]
-			sw_pos_t = self.fp_dict[sw_ref_t]['pos']
-			if not self.is_thumb_cluster(diode['ref']):
+			sw_ref_t = 'SW3'+diode.ref[1:3]
+			sw_pos_t = self.fp_dict[sw_ref_t].pos
+			if not self.is_thumb_cluster(diode.ref):
 				# place diode in between switches
 				d_pos = sw_pos_t + VECTOR2I_MM(-7.5, 8.2)
 			else :
 				d_pos = sw_pos_t + VECTOR2I_MM(-10, 5)
-			diode['pos'] = d_pos
-			self.place_fp(diode['pos'], diode['fp'], 180)
-			diode['fp'].Flip(d_pos, False)
-			diode['ref_inst'].SetTextPos(d_pos + VECTOR2I_MM(0, 2.4))
-			diode['ref_inst'].SetTextAngleDegrees(180)
+			diode.pos = d_pos
+			self.place_fp(diode.pos, diode.fp, 180)
+			self.flip_fp(diode.fp)
+			diode.ref_inst.SetTextPos(d_pos + VECTOR2I_MM(0, 2.4))
+			diode.ref_inst.SetTextAngleDegrees(180)
 				
 
+	def stamp_cells(self, fps, route):
+		# route(fp) adds the tracks and vias local to one footprint, with use_cell_stamp it runs once per
+		# orientation, side, library footprint and pad layout, the result is copied to the other footprints
+		# that have all of them in common
+		if not self.use_cell_stamp:
+			for fp in fps:
+				route(fp)
+			return
+		groups = {}
+		for fp in fps:
+			pads = tuple(sorted((side, num, pad.x - fp.x, pad.y - fp.y)
+				for side, pads in (('F', fp.padF), ('B', fp.padB)) for num, pad in pads.items()))
+			groups.setdefault((fp.ori, fp.fp.IsFlipped(), fp.fp.GetFPIDAsString(), pads), []).append(fp)
+		for group in groups.values():
+			track_buf = self.track_buf
+			self.track_buf = TrackBuffer()
+			try:
+				route(group[0])
+				cell = RouteTemplate.capture(self.track_buf.segments(), self.track_buf.vias(), group[0].pos, grid=None)
+			finally:
+				self.track_buf = track_buf
+			cell.stamp(self.track_buf, group, rotate=False)
+
 	def place_via_for_led(self): 
 		# Place vias on the board
-		for led in self.get_fp('SK6812MINI'):
-			#skip GND net since it will be connected by copper pour
-			via_offset = {'1': 3.3, '3': -3, '4': -3.6}
-			for i in ['1', '3', '4']:
-				via_pos = self.rotate(led['pos'], led['pos'] + VECTOR2I_MM(via_offset[i],0), led['ori'])
-				start_pos = self.rotate(led['pos'], VECTOR2I(led['pos'].x+FromMM(via_offset[i]), led['padF'][i]['pos'].y), led['ori'])
-				end_pos   = self.rotate(led['pos'], VECTOR2I(led['pos'].x+FromMM(via_offset[i]), led['padB'][i]['pos'].y), led['ori'])
-				#self.add_track(start_pos, via_pos, F_Cu)
-				#self.add_track(end_pos, via_pos, B_Cu)
-				self.add_track(led['padF'][i]['pos'], via_pos, F_Cu)
-				self.add_track(led['padB'][i]['pos'], via_pos, B_Cu)
-				self.add_via(via_pos, 0.3, 0.4)
+		self.stamp_cells(self.get_fp('SK6812MINI'), self.route_led_vias)
+
+	def route_led_vias(self, led):
+		#skip GND net since it will be connected by copper pour
+		for i, (via_pos, _) in zip(['1', '3', '4'], LED_VIAS.place([led])[0]):
+			self.add_track(led.padF[i].pos, via_pos, F_Cu)
+			self.add_track(led.padB[i].pos, via_pos, B_Cu)
+			self.add_via(via_pos, 0.3, 0.4)
 
 	def place_via_for_diode(self):
-		for diode in self.get_fp('BAW56DW'):
-			# place via
-			for i in range(-2, 3):
-				self.add_via(diode['pos']+VECTOR2I_MM(0,i*0.65), 0.3, 0.4)
-			# connect 
-			for i in ['1', '2', '3']:
-				self.add_track(diode['padF'][i]['pos'], diode['padF'][i]['pos']+VECTOR2I_MM( 0.95,-0.65), F_Cu)	
-				self.add_track(diode['padF'][i]['pos'], diode['padF'][i]['pos']+VECTOR2I_MM( 0.95, 0.65), B_Cu)	
-			for i in ['4', '5', '6']:
-				self.add_track(diode['padF'][i]['pos'], diode['padF'][i]['pos']+VECTOR2I_MM(-0.95, 0.65), F_Cu)	
-				self.add_track(diode['padF'][i]['pos'], diode['padF'][i]['pos']+VECTOR2I_MM(-0.95,-0.65), B_Cu)	
-
-	#TODO def connect_thumb_cluster(self):
-	#rotate thumb keys and connect
+		self.stamp_cells(self.get_fp('BAW56DW'), self.route_diode_vias)
+
+	def route_diode_vias(self, diode):
+		# place via
+		for i in range(-2, 3):
+			self.add_via(diode.pos+VECTOR2I_MM(0,i*0.65), 0.3, 0.4)
+		# connect 
+		for i in ['1', '2', '3']:
+			self.add_track(diode.padF[i].pos, diode.padF[i].pos+VECTOR2I_MM( 0.95,-0.65), F_Cu)	
+			self.add_track(diode.padF[i].pos, diode.padF[i].pos+VECTOR2I_MM( 0.95, 0.65), B_Cu)	
+		for i in ['4', '5', '6']:
+			self.add_track(diode.padF[i].pos, diode.padF[i].pos+VECTOR2I_MM(-0.95, 0.65), F_Cu)	
+			self.add_track(diode.padF[i].pos, diode.padF[i].pos+VECTOR2I_MM(-0.95,-0.65), B_Cu)	
+
 	def place_mcu(self):
 		for mcu in self.get_fp('CH582'):
-			self.place_fp(VECTOR2I_MM(168, 48), mcu['fp'], 0)
+			self.place_fp(VECTOR2I_MM(168, 48), mcu.fp, 0)
 			
 	def place_misc(self):
 		# Place misc components on the board
-		self.place_fp(VECTOR2I_MM(175.6, 50), self.fp_dict['R1']['fp'], 180)
-		self.fp_dict['R1']['fp'].Flip(self.fp_dict['R1']['fp'].GetPosition(), False)
-		self.place_fp(VECTOR2I_MM(175.6, 58), self.fp_dict['R2']['fp'], 0)
-		self.fp_dict['R2']['fp'].Flip(self.fp_dict['R2']['fp'].GetPosition(), False)
-		self.place_fp(VECTOR2I_MM(175.6, 54), self.fp_dict['JP1']['fp'], 0)
-		self.fp_dict['JP1']['fp'].Flip(self.fp_dict['JP1']['fp'].GetPosition(), False)
-		# self.place_fp(VECTOR2I_MM(183.7, 131.6), self.fp_dict['JP2']['fp'], 180) JP2 is removed
+		self.place_fp(VECTOR2I_MM(175.6, 50), self.fp_dict['R1'].fp, 180)
+		self.flip_fp(self.fp_dict['R1'].fp)
+		self.place_fp(VECTOR2I_MM(175.6, 58), self.fp_dict['R2'].fp, 0)
+		self.flip_fp(self.fp_dict['R2'].fp)
+		self.place_fp(VECTOR2I_MM(175.6, 54), self.fp_dict['JP1'].fp, 0)
+		self.flip_fp(self.fp_dict['JP1'].fp)
+		# self.place_fp(VECTOR2I_MM(183.7, 131.6), self.fp_dict['JP2'].fp, 180) JP2 is removed
 
 	def place_connector(self):
 		# Place connectors on the board
-		self.fp_dict['J_LEFT1']['fp'].Flip(self.fp_dict['J_LEFT1']['fp'].GetPosition(), False)
-		self.place_fp(self.sw0_pos + VECTOR2I_MM(116, 35), self.fp_dict['J_LEFT1']['fp'], 135)
-		self.place_fp(self.sw0_pos + VECTOR2I_MM(116, 35), self.fp_dict['J_RIGHT1']['fp'], -45)
+		self.flip_fp(self.fp_dict['J_LEFT1'].fp)
+		self.place_fp(self.sw0_pos + VECTOR2I_MM(*self.connector_offset), self.fp_dict['J_LEFT1'].fp, 135)
+		self.place_fp(self.sw0_pos + VECTOR2I_MM(*self.connector_offset), self.fp_dict['J_RIGHT1'].fp, -45)
 
 	def place_via_for_connector(self):
 		# Place vias on the board
 		for conn in self.get_fp('FPC'):
-			if 'RIGHT' in conn['ref']: # doesn't metter left or right, just pick one to get the pad position
-				for pad in conn['fp'].Pads():
+			if 'RIGHT' in conn.ref: # doesn't metter left or right, just pick one to get the pad position
+				for pad in conn.fp.Pads():
 					# skip mounting pad, GND and unconnected pad
 					if pad.GetNumber().isdigit(): # and int(pad.GetNumber()) %2:
 						if pad.GetNetname() == 'GND': # handled by copper pour
@@ -258,112 +574,98 @@ class kbd_place_n_route(ActionPlugin):
 
 	def place_shift_register_and_resistor(self):
 		# shift register
-		self.fp_dict['SR_LEFT1']['fp'].Flip(self.fp_dict['SR_LEFT1']['fp'].GetPosition(), False)
-		self.place_fp(self.sw0_pos + VECTOR2I_MM(119, 52), self.fp_dict['SR_LEFT1']['fp'], 0)
-		self.place_fp(self.sw0_pos + VECTOR2I_MM(114, 52), self.fp_dict['SR_RIGHT1']['fp'], 180)
+		self.flip_fp(self.fp_dict['SR_LEFT1'].fp)
+		self.place_fp(self.sw0_pos + VECTOR2I_MM(119, 52), self.fp_dict['SR_LEFT1'].fp, 0)
+		self.place_fp(self.sw0_pos + VECTOR2I_MM(114, 52), self.fp_dict['SR_RIGHT1'].fp, 180)
 		# resistor network
 		for k, v in enumerate(['5', '4', '3', '2', '1', '0', '6', '7']):
 			rl_ref = 'R_L' + v
-			self.fp_dict[rl_ref]['fp'].Flip(self.fp_dict[rl_ref]['fp'].GetPosition(), False)
+			self.flip_fp(self.fp_dict[rl_ref].fp)
 			rr_ref = 'R_R' + v
-			self.place_fp(self.fp_dict['SR_LEFT1']['pos'] + VECTOR2I_MM(11, (k-3.5)*3), self.fp_dict[rl_ref]['fp'], 180)
-			self.place_fp(self.fp_dict['SR_LEFT1']['pos'] + VECTOR2I_MM( 9, (k-3.5)*3), self.fp_dict[rr_ref]['fp'], 0)
+			self.place_fp(self.fp_dict['SR_LEFT1'].pos + VECTOR2I_MM(11, (k-3.5)*3), self.fp_dict[rl_ref].fp, 180)
+			self.place_fp(self.fp_dict['SR_LEFT1'].pos + VECTOR2I_MM( 9, (k-3.5)*3), self.fp_dict[rr_ref].fp, 0)
 			''' TODO move silkscreen text
-			for item in self.fp_dict[rl_ref]['fp'].GraphicalItems():
+			for item in self.fp_dict[rl_ref].fp.GraphicalItems():
 				if type(item) == PCB_TEXT:
-					item.SetPosition(self.fp_dict[rl_ref]['pos']+VECTOR2I_MM(-3.9, 0))
-			for item in self.fp_dict[rr_ref]['fp'].GraphicalItems():
+					item.SetPosition(self.fp_dict[rl_ref].pos+VECTOR2I_MM(-3.9, 0))
+			for item in self.fp_dict[rr_ref].fp.GraphicalItems():
 				print(item)
 				if type(item) == PCB_TEXT:
-					item.SetPosition(self.fp_dict[rr_ref]['pos']+VECTOR2I_MM( 3.9, 0))
+					item.SetPosition(self.fp_dict[rr_ref].pos+VECTOR2I_MM( 3.9, 0))
 			'''
 
 	def connect_pad1(self):
 		# Connect switch pad1 on both F_Cu and B_Cu layer
-		for sw in self.get_fp('SW_Push'):
-			self.add_tracks([
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM( 3.3, 6.0), sw['ori']), B_Cu),
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM( 1.5, 4.0), sw['ori']), B_Cu),
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM(-2.7, 4.0), sw['ori']), -1),
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM(-2.7, 5.4), sw['ori']), F_Cu)
-			])
+		self.stamp_cells(self.get_fp('SW_Push'), lambda sw: self.add_tracks(PAD1_ROUTE.place([sw])[0]))
 
 	def connect_pad2(self):
 		# Connect switch pad2 on both F_Cu and B_Cu layer
-		for sw in self.get_fp('SW_Push'):
-			self.add_tracks([
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM(-8.2, 3.6), sw['ori']), B_Cu),
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM(-6.5, 2.0), sw['ori']), B_Cu),
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM( 7.5, 2.0), sw['ori']),   -1), # via
-				(self.rotate(sw['pos'], sw['pos'] + VECTOR2I_MM( 8.2, 3.6), sw['ori']), F_Cu)
-			])
+		sws = self.get_fp('SW_Push')
+		self.stamp_cells(sws, lambda sw: self.add_tracks(PAD2_ROUTE.place([sw])[0]))
+		for sw in sws:
 			# connect via to sw on the right
-			if sw['ref'][-1] != '5' and sw['ref'][-1] != '6':
-				sw_r = sw['ref'][:-1]+str(int(sw['ref'][-1])+1)
+			if sw.ref[-1] != '5' and sw.ref[-1] != '6':
+				sw_r = self.matrix_fp('SW', int(sw.ref[-2]), int(sw.ref[-1])+1)
 				self.add_tracks([
-					(sw['pos']+VECTOR2I_MM( 7.5, 2.0),   B_Cu), # via
-					(self.fp_dict[sw_r]['padB']['2']['pos'], B_Cu)
+					(sw.pos+VECTOR2I_MM( 7.5, 2.0),   B_Cu), # via
+					(sw_r.padB['2'].pos, B_Cu)
 				])
 				
 	def connect_diode_and_sw(self):
 		# Connect diode and switches pad1 on both F_cu and B_Cu layer
 		for diode in self.get_fp('BAW56DW'):
-			if not self.is_thumb_cluster(diode['ref']): # skip thumb cluster
+			if not self.is_thumb_cluster(diode.ref): # skip thumb cluster
 				# ROW0
-				sw_r0_ref = 'SW0'+diode['ref'][-1]
+				sw_r0 = self.matrix_fp('SW', 0, int(diode.ref[-1]))
 				self.add_tracks([
-					(diode['padF']['1']['pos']+VECTOR2I_MM(0.95,-0.65), F_Cu),
-					(diode['padF']['1']['pos']+VECTOR2I_MM(0.95,-48.4), F_Cu),
-					(self.fp_dict[sw_r0_ref]['padF']['1']['pos'], F_Cu)
+					(diode.padF['1'].pos+VECTOR2I_MM(0.95,-0.65), F_Cu),
+					(diode.padF['1'].pos+VECTOR2I_MM(0.95,-48.4), F_Cu),
+					(sw_r0.padF['1'].pos, F_Cu)
 				])
 				# ROW1
-				sw_r1_ref = 'SW1'+diode['ref'][-1]
+				sw_r1 = self.matrix_fp('SW', 1, int(diode.ref[-1]))
 				self.add_tracks([
-					(diode['padF']['1']['pos']+VECTOR2I_MM(0.95, 0), F_Cu),
-					(diode['padF']['1']['pos']+VECTOR2I_MM(1.35,-0.4), F_Cu),
-					(diode['padF']['1']['pos']+VECTOR2I_MM(1.35,-31.8), F_Cu),
-					(self.fp_dict[sw_r1_ref]['padF']['1']['pos'], F_Cu)
+					(diode.padF['1'].pos+VECTOR2I_MM(0.95, 0), F_Cu),
+					(diode.padF['1'].pos+VECTOR2I_MM(1.35,-0.4), F_Cu),
+					(diode.padF['1'].pos+VECTOR2I_MM(1.35,-31.8), F_Cu),
+					(sw_r1.padF['1'].pos, F_Cu)
 				])
 				# ROW2
-				sw_r2_ref = 'SW2'+diode['ref'][-1]
+				sw_r2 = self.matrix_fp('SW', 2, int(diode.ref[-1]))
 				self.add_tracks([
-					(diode['padF']['5']['pos'], F_Cu),
-					(diode['padF']['5']['pos']+VECTOR2I_MM( 0.6,-0.2), F_Cu),
-					(diode['padF']['5']['pos']+VECTOR2I_MM( 0.6,-0.9), F_Cu),
-					(diode['padF']['5']['pos']+VECTOR2I_MM(-0.2,-1.6), F_Cu),
-					(diode['padF']['5']['pos']+VECTOR2I_MM(-0.2,-15.7), F_Cu),
-					(self.fp_dict[sw_r2_ref]['padF']['1']['pos'], F_Cu)
+					(diode.padF['5'].pos, F_Cu),
+					(diode.padF['5'].pos+VECTOR2I_MM( 0.6,-0.2), F_Cu),
+					(diode.padF['5'].pos+VECTOR2I_MM( 0.6,-0.9), F_Cu),
+					(diode.padF['5'].pos+VECTOR2I_MM(-0.2,-1.6), F_Cu),
+					(diode.padF['5'].pos+VECTOR2I_MM(-0.2,-15.7), F_Cu),
+					(sw_r2.padF['1'].pos, F_Cu)
 				])
 				# ROW3
-				sw_r3_ref = 'SW3'+diode['ref'][-1]
+				sw_r3 = self.matrix_fp('SW', 3, int(diode.ref[-1]))
 				self.add_tracks([
-					(diode['padF']['4']['pos']+VECTOR2I_MM(0.2,0), F_Cu),
-					(self.fp_dict[sw_r3_ref]['padF']['1']['pos'], F_Cu)
+					(diode.padF['4'].pos+VECTOR2I_MM(0.2,0), F_Cu),
+					(sw_r3.padF['1'].pos, F_Cu)
 				])
 
 	def connect_sw_col(self):
 		# Connect column pads (anode of diode) to shift register
 		p1_offset = VECTOR2I_MM(165.6, 114.1)
 		for i in range(5,-1,-1): # index finger to ring finger
-			p0 = self.fp_dict['SR_RIGHT1']['padF']['11']['pos'] + VECTOR2I_MM(-1.9, 0.635*(5-i))
+			p0 = self.fp_dict['SR_RIGHT1'].padF['11'].pos + VECTOR2I_MM(-1.9, 0.635*(5-i))
 			p1 = p1_offset + VECTOR2I_MM((5-i)*0.3, (5-i)*0.3)
 			d_ref = 'D' + str(i) # diode connected to SR
 			p2 = VECTOR2I(0,0)
 			p2.y = p1.y
-			if i <= 1: # pinky finger
+			if i <= 1: # pinky finger, p2 to the diode is maze routed by connect_maze
 				p2.x = FromMM(92-0.2*i)
-				# FIXME p3
-				# TODO p4 p5
-				# TODO p6 = 	self.fp_dict[d_ref]['padB']['3']['pos']
 				self.add_tracks([
 					(p0, B_Cu),
 					(p1, B_Cu),
 					(p2, B_Cu),
-					# FIXME (p3, B_Cu),
 				])
 			else:
-				p2.x = self.fp_dict[d_ref]['pos'].x + FromMM(5)
-				p3 = 	self.fp_dict[d_ref]['padB']['3']['pos']
+				p2.x = self.fp_dict[d_ref].pos.x + FromMM(5)
+				p3 = 	self.fp_dict[d_ref].padB['3'].pos
 				self.add_tracks([
 					(p0, B_Cu),
 					(p1, B_Cu),
@@ -371,16 +673,94 @@ class kbd_place_n_route(ActionPlugin):
 					(p3, B_Cu),
 				])
 
+	def connect_maze(self):
+		# Maze route MAZE_ROUTES, pads far enough apart are routed in parallel, the ones that
+		# clash with another group or found no way are routed again around everything else
+		# a pad routed again stays in its own box, so the routes only depend on the copper in the boxes
+		outline = [(p.x, p.y) for p in self.edge_cut_points()[:-1]]
+		jobs = self.maze_jobs()
+		scheduler = RouteScheduler(FromMM(self.clearance), outline, self.route_workers)
+		routed = scheduler.run(self.copper_checker(), jobs)
+		for points in routed:
+			if points is not None:
+				self.add_tracks(points)
+		for (pad, box), points in zip(jobs, routed):
+			if points is None:
+				self.route_pads(box, [pad])
+
+	def maze_jobs(self):
+		# [((ref, layer, pad number), box)] of MAZE_ROUTES
+		return [((ref, layer, num), self.fp_box(refs, 5)) for ref, layer, num, refs in MAZE_ROUTES]
+
+	def maze_inputs(self):
+		# What connect_maze reads: its pads and boxes, the board outline and the copper inside the boxes
+		# the scheduler routes in, with its net and which of it is joined already, copper elsewhere doesn't count
+		jobs = self.maze_jobs()
+		boxes = [box for box, members in RouteScheduler(FromMM(self.clearance)).groups(jobs)]
+		checker = self.copper_checker()
+		find, nets = checker.connect()[:2]
+		margin = FromMM(1) # copper this close to a box keeps routes away from its inside
+		inside = []
+		for i, (pts, r, layers, *_) in enumerate(checker.items):
+			x0, y0 = min(p[0] for p in pts) - r - margin, min(p[1] for p in pts) - r - margin
+			x1, y1 = max(p[0] for p in pts) + r + margin, max(p[1] for p in pts) + r + margin
+			if any(x0 <= b[2] and b[0] <= x1 and y0 <= b[3] and b[1] <= y1 for b in boxes):
+				key = (checker.items[i][:3], checker.owners[i])
+				inside.append((repr(key), key, i))
+		# joined copper gets the same label, numbered in the order of the copper so it doesn't depend on the rest
+		labels = {}
+		copper = []
+		for text, key, i in sorted(inside):
+			group = find(i)
+			net = next(iter(nets[group])) if len(nets[group]) == 1 else None
+			copper.append((key, net, labels.setdefault(group, len(labels))))
+		# lines of the outline edges that cut into a box, the others keep nothing out of them
+		outline = [(p.x, p.y) for p in self.edge_cut_points()[:-1]]
+		cx = sum(p[0] for p in outline) / len(outline)
+		cy = sum(p[1] for p in outline) / len(outline)
+		cut = []
+		for (x0, y0), (x1, y1) in edges(outline):
+			a, b = y1 - y0, x0 - x1
+			c = a*x0 + b*y0
+			if a*cx + b*cy > c:
+				a, b, c = -a, -b, -c
+			n = hypot(a, b)
+			if any(a*x + b*y > c - margin*n for bx0, by0, bx1, by1 in boxes for x in (bx0, bx1) for y in (by0, by1)):
+				cut.append((round(a/n, 9), round(b/n, 9), round(c/n)))
+		return [jobs, cut, copper]
+
+	def route_pads(self, box, pads):
+		# Maze route each (ref, layer, pad number) to the rest of its net, inside box, the pads
+		# that found no way get another try on a grid shifted by half a cell
+		outline = [(p.x, p.y) for p in self.edge_cut_points()[:-1]]
+		for shift in (False, True):
+			router = MazeRouter(self.copper_checker(), box, FromMM(self.clearance), outline, shift=shift)
+			failed = []
+			for ref, layer, num in pads:
+				points = router.route(ref, layer, num)
+				if points is None:
+					failed.append((ref, layer, num))
+				else:
+					self.add_tracks(points)
+			pads = failed
+			if not pads:
+				return
+		for ref, layer, num in pads:
+			print(f"Warning: no route for {ref}.{num}")
+
+	def fp_box(self, refs, margin):
+		# Bounding box (x0, y0, x1, y1) of the footprint positions, grown by margin (mm)
+		xs = [self.fp_dict[ref].x for ref in refs]
+		ys = [self.fp_dict[ref].y for ref in refs]
+		return (min(xs) - FromMM(margin), min(ys) - FromMM(margin), max(xs) + FromMM(margin), max(ys) + FromMM(margin))
+
 	def connect_rows(self):
 		# Connect rows
 		for i in range(4):
 			t = []
 			sw_ref = 'SW'+str(i)+'5'
-			for padname,pad in self.fp_dict['U1']['padF'].items():
-				if pad['net'] == 'ROW'+str(i):
-					mcu_pad_pos = pad['pos']
-					break
-			switch_pad_pos = self.fp_dict[sw_ref]['padF']['2']['pos']
+			mcu_pad_pos = self.find_pad('ROW'+str(i), 'U1', F_Cu).pos
+			switch_pad_pos = self.fp_dict[sw_ref].padF['2'].pos
 			t.append((switch_pad_pos, F_Cu))
 			if i > 0: # row1-3
 				p1 = switch_pad_pos+VECTOR2I_MM(2.8+i*0.3, -2.8-i*0.3)
@@ -393,102 +773,73 @@ class kbd_place_n_route(ActionPlugin):
 			self.add_tracks(t)
 
 	def connect_leds_by_col(self):
-		# Connect LEDs by column
-		for sw in self.get_fp('SW_Push'):
-			if not self.is_thumb_cluster(sw['ref']): # skip thumb cluster
-				sw_col = int(sw['ref'][-1])
-				sw_row = int(sw['ref'][-2])
-				offset = sw['pos']
-				if sw_row != 0: # route from bottom up. ie row1 -> row0, row2 -> row1...
-					# power rail - left
-					self.add_tracks([
-						(offset+VECTOR2I_MM(-3.3, -5.5), F_Cu),
-						(offset+VECTOR2I_MM(-3.3, -6.9), F_Cu),
-						(offset+VECTOR2I_MM(-1.7, -8.5), F_Cu),
-						(offset+VECTOR2I_MM(-1.7,-14.7), F_Cu),
-						(offset+VECTOR2I_MM(-4.4,-17.4), F_Cu),
-						(offset+VECTOR2I_MM(-4.4,-21.9), F_Cu),
-						(offset+VECTOR2I_MM(-3.3,-22.5), F_Cu),
-					])
-					# led dout -> led din
-					if sw_col %2 == 0: # even column
-						self.add_tracks([
-							(offset+VECTOR2I_MM( 3.3, -5.5), F_Cu),
-							(offset+VECTOR2I_MM( 3.3,-10.2), F_Cu),
-							(offset+VECTOR2I_MM( 3.3,-10.2), F_Cu),
-							(offset+VECTOR2I_MM(-3.3,-16.8), F_Cu),
-							(offset+VECTOR2I_MM(-3.3,-20.9), F_Cu),
-						])
-					else: # odd column
-						self.add_tracks([
-							(offset+VECTOR2I_MM(-3.3, -3.9), F_Cu),
-							(offset+VECTOR2I_MM(-2.1, -4.4), F_Cu),
-							(offset+VECTOR2I_MM(-2.1, -6.5), F_Cu),
-							(offset+VECTOR2I_MM( 2.1,-10.8), F_Cu),
-							(offset+VECTOR2I_MM( 2.1,-21.9), F_Cu),
-							(offset+VECTOR2I_MM( 3.3,-22.5), F_Cu),
-						])
+		# Connect LEDs by column, route from bottom up. ie row1 -> row0, row2 -> row1...
+		# each route is stamped onto all of its switches at once, thumb cluster skipped
+		sws = [sw for sw in self.get_fp('SW_Push') if not self.is_thumb_cluster(sw.ref) and int(sw.ref[-2]) != 0]
+		even = [sw for sw in sws if int(sw.ref[-1]) % 2 == 0]
+		odd = [sw for sw in sws if int(sw.ref[-1]) % 2 != 0]
+		for name, fps in (('led_rail', sws), ('led_dout_even', even), ('led_dout_odd', odd)):
+			self.route_templates.get(name, LED_ROUTES[name], 'SW_Push').stamp(self.track_buf, fps)
 				
 	def connect_led_5v(self):
 		for i in range(6):
 			led_ref = 'LED0'+str(i) # first row
 			t = []
-			t.append((self.fp_dict[led_ref]['padB']['4']['pos'], B_Cu))
-			t.append((self.fp_dict[led_ref]['padB']['4']['pos']+VECTOR2I_MM(-1.2, -1.2), B_Cu))
-			t.append((self.fp_dict[led_ref]['padB']['4']['pos']+VECTOR2I_MM(-1.2, -2.7), B_Cu))
-			t.append((self.fp_dict[led_ref]['padB']['4']['pos']+VECTOR2I_MM(10.0, -2.7), B_Cu))
+			t.append((self.fp_dict[led_ref].padB['4'].pos, B_Cu))
+			t.append((self.fp_dict[led_ref].padB['4'].pos+VECTOR2I_MM(-1.2, -1.2), B_Cu))
+			t.append((self.fp_dict[led_ref].padB['4'].pos+VECTOR2I_MM(-1.2, -2.7), B_Cu))
+			t.append((self.fp_dict[led_ref].padB['4'].pos+VECTOR2I_MM(10.0, -2.7), B_Cu))
 			if i < 5:
 				next_led_ref = 'LED0'+str(i+1)
-				t.append((self.fp_dict[next_led_ref]['padB']['4']['pos']+VECTOR2I_MM(-1.2, -2.7), B_Cu))
+				t.append((self.fp_dict[next_led_ref].padB['4'].pos+VECTOR2I_MM(-1.2, -2.7), B_Cu))
 			else:
-				t.append((self.fp_dict[led_ref]['padB']['4']['pos']+VECTOR2I_MM(21.6, -2.7), B_Cu))
-				t.append((self.fp_dict['R1']['padB']['1']['pos'], B_Cu))
+				t.append((self.fp_dict[led_ref].padB['4'].pos+VECTOR2I_MM(21.6, -2.7), B_Cu))
+				t.append((self.fp_dict['R1'].padB['1'].pos, B_Cu))
 			self.add_tracks(t)
 				
 			
 	def connect_shift_register_and_resistor(self):
 		# connect resistor array 3V3 net
-		self.add_track(self.fp_dict['R_R5']['padF']['1']['pos'], self.fp_dict['R_R7']['padF']['1']['pos'], F_Cu)
-		self.add_track(self.fp_dict['R_L5']['padB']['1']['pos'], self.fp_dict['R_L7']['padB']['1']['pos'], B_Cu)
+		self.add_track(self.fp_dict['R_R5'].padF['1'].pos, self.fp_dict['R_R7'].padF['1'].pos, F_Cu)
+		self.add_track(self.fp_dict['R_L5'].padB['1'].pos, self.fp_dict['R_L7'].padB['1'].pos, B_Cu)
 		# connect resistor array col pad
 		for i in range(8):
-			rl_pv = self.fp_dict['R_L' + str(i)]['padB']['2']['pos']
+			rl_pv = self.fp_dict['R_L' + str(i)].padB['2'].pos
 			self.add_via(rl_pv + VECTOR2I_MM(1,0), 0.3, 0.4)
 			self.add_track(rl_pv, rl_pv + VECTOR2I_MM(1,0), B_Cu)
 			self.add_track(rl_pv, rl_pv + VECTOR2I_MM(1,0), F_Cu)
 		# connect shift register left and right
 		for i in [str(n) for n in range(9,17)]: #pad 9-16
 			if (i != '10'): # skip pad 10
-				pad_pos = self.fp_dict['SR_RIGHT1']['padF'][i]['pos']
+				pad_pos = self.fp_dict['SR_RIGHT1'].padF[i].pos
 				via_pos = pad_pos +VECTOR2I_MM(-1.9,0)
 				self.add_via(via_pos, 0.3, 0.4)
 				self.add_track(pad_pos, via_pos, F_Cu)
 		for i in [str(n) for n in range(1,9)]: # pad 1-6
 			if (i != '7'): # skip pad 7
-				pad_pos = self.fp_dict['SR_RIGHT1']['padF'][i]['pos']
+				pad_pos = self.fp_dict['SR_RIGHT1'].padF[i].pos
 				via_pos = pad_pos +VECTOR2I_MM(1.5,0)
 				self.add_via(via_pos, 0.3, 0.4)
 				self.add_track(pad_pos, via_pos, F_Cu)
 				self.add_track(pad_pos, via_pos, B_Cu)
 		# R - SR: COL net
-		r_pack_track_step = (self.fp_dict['SR_LEFT1']['padB']['15']['pos'] - self.fp_dict['SR_LEFT1']['padB']['14']['pos'])/2
+		r_pack_track_step = (self.fp_dict['SR_LEFT1'].padB['15'].pos - self.fp_dict['SR_LEFT1'].padB['14'].pos)/2
 		for i in range(8):
 			net_name = 'COL'+str(i)
-			for rl in self.get_fp('R_US'):
-				if '2' in rl['padB'] and rl['padB']['2']['net'] == net_name:
-					p0 = rl['padB']['2']['pos']
-					break
-			for v in self.fp_dict['SR_LEFT1']['padB'].values(): # shift register pads
-				if v['net']	== net_name:
-					if v['pos'].x < self.fp_dict['SR_LEFT1']['pos'].x: # left side pads
-						p1 = v['pos'] + VECTOR2I_MM(6, 0) + r_pack_track_step
-					else: # right side pads
-						p1 = v['pos'] + VECTOR2I_MM(1, 0)
-					p2 = p1 + VECTOR2I_MM(-2, 0)
-					p3 = p2 + VECTOR2I(FromMM(-2.5), -r_pack_track_step.y)
-					p4 = VECTOR2I(self.fp_dict['SR_RIGHT1']['padF']['9']['pos'].x - FromMM(1.2), p3.y)
-					p5 = VECTOR2I(p4.x - FromMM(0.7), p2.y)
+			for ref, padname, pad in self.find_pads(net_name, layer=B_Cu):
+				if padname == '2' and 'R_US' in self.fp_dict[ref].val:
+					p0 = pad.pos
 					break
+			for _, _, v in self.find_pads(net_name, 'SR_LEFT1', B_Cu): # shift register pads
+				if v.pos.x < self.fp_dict['SR_LEFT1'].pos.x: # left side pads
+					p1 = v.pos + VECTOR2I_MM(6, 0) + r_pack_track_step
+				else: # right side pads
+					p1 = v.pos + VECTOR2I_MM(1, 0)
+				p2 = p1 + VECTOR2I_MM(-2, 0)
+				p3 = p2 + VECTOR2I(FromMM(-2.5), -r_pack_track_step.y)
+				p4 = VECTOR2I(self.fp_dict['SR_RIGHT1'].padF['9'].pos.x - FromMM(1.2), p3.y)
+				p5 = VECTOR2I(p4.x - FromMM(0.7), p2.y)
+				break
 			if i == 7: 
 				self.add_tracks([
 					(p0, B_Cu),
@@ -506,10 +857,10 @@ class kbd_place_n_route(ActionPlugin):
 					(p5, B_Cu),
 				])
 		for i in ['9', '10', '15', '16']:
-			p0 = self.fp_dict['SR_LEFT1']['padB'][i]['pos']
+			p0 = self.fp_dict['SR_LEFT1'].padB[i].pos
 			p1 = p0 + VECTOR2I_MM(-1, 0)
 			p2 = p1 + VECTOR2I_MM(-2.5, 0) - r_pack_track_step
-			p3 = VECTOR2I(self.fp_dict['SR_RIGHT1']['padF'][i]['pos'].x - FromMM(1.2), p2.y)
+			p3 = VECTOR2I(self.fp_dict['SR_RIGHT1'].padF[i].pos.x - FromMM(1.2), p2.y)
 			if i in ['9', '10']:
 				#p4 = VECTOR2I(p3.x - FromMM(0.7), p3.y-r_pack_track_step.y)
 				p4 = p3 + VECTOR2I_MM(-0.7, 0) - r_pack_track_step
@@ -529,58 +880,56 @@ class kbd_place_n_route(ActionPlugin):
 		nets_to_connect = ['ROW3', 'ROW2', 'SCK0', 'SCS', 'ROW1', 'ROW0', '+3V3', 'LED_R', '+5V']
 		c0 = VECTOR2I_MM(184.6,79)
 		for i, net in enumerate(nets_to_connect):
-			for padname,pad in self.fp_dict['J_RIGHT1']['padF'].items():
-				if pad['net'] == net: # and int(padname) %2 == 1:
-					p1 = c0 + VECTOR2I_MM(0.3*i, 0.3*i)
-					self.add_tracks([
-						(pad['pos']+VECTOR2I_MM(1.6, -1.6), F_Cu),
-						(p1, F_Cu),
-					])
+			for _, padname, pad in self.find_pads(net, 'J_RIGHT1', F_Cu):
+				p1 = c0 + VECTOR2I_MM(0.3*i, 0.3*i)
+				self.add_tracks([
+					(pad.pos+VECTOR2I_MM(1.6, -1.6), F_Cu),
+					(p1, F_Cu),
+				])
 			if net == 'LED_R': # 1 extra track for LED_R
 				self.add_tracks([	
 					(p1, F_Cu),
 					(p1+VECTOR2I_MM(0,-24.3), F_Cu),
 					(p1+VECTOR2I_MM(-2.4,-26.7), F_Cu),
-					(self.fp_dict['JP1']['padB']['3']['pos']+VECTOR2I_MM(2.5,0), -1),
-					(self.fp_dict['JP1']['padB']['3']['pos'], B_Cu),
+					(self.fp_dict['JP1'].padB['3'].pos+VECTOR2I_MM(2.5,0), -1),
+					(self.fp_dict['JP1'].padB['3'].pos, B_Cu),
 				])
 			else: 
-				for padname,pad in self.fp_dict['U1']['padF'].items():
-					if pad['net'] == net:
-						p2 = VECTOR2I(0,0)
-						p3 = VECTOR2I(0,0)
-						if int(padname) > 12: # right cloumn of MCU pin
-							p3.x = p1.x
-							p3.y = pad['pos'].y + (p1.x-pad['pos'].x) # 45deg
-							self.add_tracks([
-								(p1, F_Cu),
-								(p3, F_Cu),
-								(pad['pos'], F_Cu)
-							])
-						else :
-							p3.x = pad['pos'].x + FromMM(16)
-							p3.y = pad['pos'].y - FromMM(1.27)# in between two pads
-							p2.x = p1.x
-							p2.y = p3.y + (p1.x-p3.x) # 45deg
-							self.add_tracks([
-								(p1, F_Cu),
-								(p2, F_Cu),
-								(p3, F_Cu),
-								(pad['pos'], F_Cu)
-							])
+				for _, padname, pad in self.find_pads(net, 'U1', F_Cu):
+					p2 = VECTOR2I(0,0)
+					p3 = VECTOR2I(0,0)
+					if int(padname) > 12: # right cloumn of MCU pin
+						p3.x = p1.x
+						p3.y = pad.pos.y + (p1.x-pad.pos.x) # 45deg
+						self.add_tracks([
+							(p1, F_Cu),
+							(p3, F_Cu),
+							(pad.pos, F_Cu)
+						])
+					else :
+						p3.x = pad.pos.x + FromMM(16)
+						p3.y = pad.pos.y - FromMM(1.27)# in between two pads
+						p2.x = p1.x
+						p2.y = p3.y + (p1.x-p3.x) # 45deg
+						self.add_tracks([
+							(p1, F_Cu),
+							(p2, F_Cu),
+							(p3, F_Cu),
+							(pad.pos, F_Cu)
+						])
 
-	def place_edge_cut(self): 
-		# Place edge cuts on the board
+	def edge_cut_points(self):
+		# Board outline, closed polygon
 		# get highest y coordinate (column 3)
-		upper_edge_y = self.fp_dict['SW03']['fp'].GetPosition().y - FromMM(10)
+		upper_edge_y = self.fp_dict['SW03'].fp.GetPosition().y - FromMM(10)
 		# get top right corner
-		right_edge_x = self.fp_dict['SW36']['fp'].GetPosition().x + FromMM(15)
+		right_edge_x = self.fp_dict['SW36'].fp.GetPosition().x + FromMM(15)
 		# get bottom left corner x coordinate (column 0)
 		left_edge_x = self.sw0_pos.x - FromMM(10)
 		# get bottom left corner x coordinate (column 0)
-		lower_left_y = self.fp_dict['SW30']['fp'].GetPosition().y + FromMM(15)
+		lower_left_y = self.fp_dict['SW30'].fp.GetPosition().y + FromMM(15)
 		# get lower right y coordinate (column 7)
-		lower_right_y = self.fp_dict['SW36']['fp'].GetPosition().y + FromMM(15)
+		lower_right_y = self.fp_dict['SW36'].fp.GetPosition().y + FromMM(15)
 		edge_cut_tracks = [
 			VECTOR2I(right_edge_x, upper_edge_y ),
 			VECTOR2I( left_edge_x, upper_edge_y ),
@@ -588,6 +937,11 @@ class kbd_place_n_route(ActionPlugin):
 			VECTOR2I(right_edge_x, lower_right_y),
 			VECTOR2I(right_edge_x, upper_edge_y )
 		]
+		return edge_cut_tracks
+
+	def place_edge_cut(self): 
+		# Place edge cuts on the board
+		edge_cut_tracks = self.edge_cut_points()
 		track = PCB_SHAPE(self.board)
 		track.SetShape(SHAPE_T_POLY)
 		track.SetFilled(False)
@@ -595,7 +949,8 @@ class kbd_place_n_route(ActionPlugin):
 		track.SetWidth(FromMM(0.1))
 		track.SetStart(edge_cut_tracks[0])
 		track.SetPolyPoints(edge_cut_tracks)
-		self.board.Add(track)
+		self.add_generated(track, 'place_edge_cut')
+		self.edge_cut_pts = edge_cut_tracks
 		''' 
 		#TODO fillet corner
 		chain = SHAPE_POLY_SET()
@@ -619,10 +974,8 @@ class kbd_place_n_route(ActionPlugin):
 		self.board.Add(mounting_hole)
 	'''	
 		
-	def place_copper_pour(self):
-		# Place copper pour on the board
-		top_left = VECTOR2I_MM( 30, 30)
-		bottom_right = VECTOR2I_MM(210,160)
+	def new_gnd_zone(self, top_left, bottom_right):
+		# Create a GND zone on both F_Cu and B_Cu covering the rectangle
 		points = [
 			top_left,
 			VECTOR2I(top_left.x, bottom_right.y),
@@ -643,46 +996,210 @@ class kbd_place_n_route(ActionPlugin):
 		net_code = self.board.GetNetcodeFromNetname('GND') 
 		zone.SetNetCode(net_code)
 		zone.SetLayerSet(layers)  # Set the layer
+		return zone
+
+	def place_copper_pour(self):
+		# Place copper pour on the board
+		zone = self.new_gnd_zone(VECTOR2I_MM( 30, 30), VECTOR2I_MM(210,160))
 		# fill it
 		zones = ZONES()
 		zones.append(zone)
 		filler = ZONE_FILLER(self.board)
 		filler.Fill(zones)
-		self.board.Add(zone)
+		self.add_generated(zone, 'place_copper_pour')
+
+	def place_copper_pour_incremental(self):
+		# Same pour as place_copper_pour, filled in tiles so only tiles touched by changed
+		# tracks/vias/pads are refilled, the rest comes from PourCache
+		# tiles are filled with their islands and merged into one zone, islands are removed once on the
+		# merged fill so copper that reaches GND through a neighbour tile stays
+		top_left = VECTOR2I_MM( 30, 30)
+		bottom_right = VECTOR2I_MM(210,160)
+		n_x, n_y = self.pour_tiles
+		tile_w = (bottom_right.x - top_left.x) // n_x
+		tile_h = (bottom_right.y - top_left.y) // n_y
+		overlap = FromMM(0.5) # neighbour tiles overlap so the fills merge
+		tiles = {}
+		for i in range(n_x):
+			for j in range(n_y):
+				tiles[f'{i},{j}'] = (
+					top_left.x + i*tile_w - (overlap if i > 0 else 0),
+					top_left.y + j*tile_h - (overlap if j > 0 else 0),
+					bottom_right.x if i == n_x-1 else top_left.x + (i+1)*tile_w,
+					bottom_right.y if j == n_y-1 else top_left.y + (j+1)*tile_h
+				)
+		cache = PourCache()
+		hashes = cache.tile_hashes(self.board, tiles)
+		zones = ZONES()
+		stale = []
+		for name, (left, top, right, bottom) in tiles.items():
+			if cache.lookup(name, hashes[name]) is None:
+				zone = self.new_gnd_zone(VECTOR2I(left, top), VECTOR2I(right, bottom))
+				zone.SetIslandRemovalMode(ISLAND_REMOVAL_MODE_NEVER)
+				zones.append(zone)
+				stale.append((name, zone))
+		if stale:
+			filler = ZONE_FILLER(self.board)
+			filler.Fill(zones)
+			for name, zone in stale:
+				cache.store(name, hashes[name], zone, [F_Cu, B_Cu])
+			cache.save()
+		zone = self.new_gnd_zone(top_left, bottom_right)
+		fills = {name: cache.lookup(name, hashes[name]) for name in tiles}
+		cache.restore(zone, cache.remove_islands(fills, cache.anchors(self.board, zone.GetNetCode())))
+		self.add_generated(zone, 'place_copper_pour')
+
+	def set_params(self, params):
+		# Set layout parameters from plain values, ie a JSON parameter file
+		# sw0_pos is [x, y] in mm, thumb_offsets is {row: [dx, dy, orientation]}
+		for name, value in params.items():
+			if name == 'sw0_pos':
+				value = VECTOR2I_MM(*value)
+			elif name == 'thumb_offsets':
+				value = {int(row): tuple(v) for row, v in value.items()}
+			elif name == 'connector_offset':
+				value = tuple(value)
+			elif name not in ('sw_x_spc', 'sw_y_spc', 'col_offsets'):
+				raise ValueError(f"Unknown layout parameter: {name}")
+			setattr(self, name, value)
+
+	def get_params(self):
+		# Layout parameters as plain values, the inverse of set_params()
+		return {
+			'sw0_pos': [ToMM(self.sw0_pos.x), ToMM(self.sw0_pos.y)],
+			'sw_x_spc': self.sw_x_spc,
+			'sw_y_spc': self.sw_y_spc,
+			'col_offsets': list(self.col_offsets),
+			'thumb_offsets': {row: list(v) for row, v in self.thumb_offsets.items()},
+			'connector_offset': list(self.connector_offset),
+		}
+
+	def board_area(self):
+		# Area (mm^2) inside the edge cut polygon
+		pts = self.edge_cut_pts
+		area = sum(pts[i].x*pts[i+1].y - pts[i+1].x*pts[i].y for i in range(len(pts)-1))
+		return abs(area)/2/1e12
+
+	def stage_inputs(self, stage):
+		# Everything a routing stage reads: footprints with its reference prefixes,
+		# their placement and their pads (number, layer, net, position), see maze_inputs() for the maze
+		if stage in MAZE_STAGES:
+			return self.maze_inputs()
+		inputs = []
+		for ref, fp in self.fp_dict.items():
+			if ref.startswith(ROUTE_STAGES[stage]):
+				pads = [(num, layer, pad.net, pad.x, pad.y)
+					for layer, pads in (('F', fp.padF), ('B', fp.padB)) for num, pad in pads.items()]
+				inputs.append((ref, fp.val, fp.x, fp.y, fp.ori, pads))
+		return inputs
+
+	def run_route_stage(self, stage):
+		# Run a routing stage, or replay its tracks/vias if its inputs didn't change
+		self.track_buf.set_tag(GENERATED_GROUP + stage) # added items go into the stage's group
+		if self.stage_cache is None or not (self.use_stage_cache or stage in MAZE_STAGES):
+			getattr(self, stage)()
+			return
+		key = self.stage_cache.key(stage, self.stage_inputs(stage))
+		cached = self.stage_cache.get(key)
+		if cached is not None:
+			self.track_buf.extend(*cached)
+			return
+		n_seg, n_via = len(self.track_buf.seg), len(self.track_buf.via)
+		getattr(self, stage)()
+		self.stage_cache.put(key, self.track_buf.seg[n_seg:], self.track_buf.via[n_via:])
+
+	def copper_checker(self):
+		# DRC-lite of the buffered tracks and vias and every pad
+		checker = ClearanceChecker(FromMM(self.clearance))
+		segs, vias = self.board_copper(self.board.GetTracks()) # hand routed and kept by set_ripup()
+		for seg in self.track_buf.segments() + segs:
+			checker.add_segment(*seg)
+		for x, y, drill, width in self.track_buf.vias() + vias:
+			checker.add_via(x, y, width)
+		for pad in self.board.GetPads():
+			checker.add_pad(pad)
+		return checker
+
+	def check_clearance(self):
+		# DRC-lite of the buffered tracks and vias against each other and every pad
+		checker = self.copper_checker()
+		violations = checker.check()
+		if violations:
+			checker.report(violations)
+			raise ClearanceError(violations)
+
+	def net_verifier(self, segs, vias):
+		# NetVerifier of segs, vias and the pads in fp_dict, nodes are numbered in that order
+		verifier = NetVerifier()
+		for seg in segs:
+			verifier.add_segment(*seg)
+		for x, y, drill, width in vias:
+			verifier.add_via(x, y, width)
+		for ref, fp in self.fp_dict.items():
+			for layer in (F_Cu, B_Cu):
+				for pad in fp.pads(layer).values():
+					verifier.add_pad(ref, pad, layer)
+		return verifier
+
+	def check_nets(self):
+		# union-find connectivity of the buffered tracks and vias, the ones on the board and the pads, report only
+		segs, vias = self.board_copper(self.board.GetTracks())
+		verifier = self.net_verifier(self.track_buf.segments() + segs, self.track_buf.vias() + vias)
+		self.net_report = verifier.verify()
+		verifier.report(self.net_report)
 
 	# Do all the things
 	def Run(self):
 		# Execute the plugin
 		self.load_board()
 		self.remove_old_tracks()
-		self.gen_fp_placement()
-		self.place_sw()
-		self.place_led()
-		self.place_diode()
-		self.place_mcu()
-		self.place_misc()
-		self.place_shift_register_and_resistor()
-		self.place_connector()
+		for stage in PLACE_STAGES:
+			getattr(self, stage)()
 		self.update_pad_pos()
-		self.place_via_for_led()
-		self.place_via_for_diode()
-		self.place_via_for_connector()
-		#self.connect_thumb_cluster()
-		self.connect_rows()
-		self.connect_pad1()
-		self.connect_pad2()
-		self.connect_diode_and_sw()
-		self.connect_sw_col()
-		self.connect_leds_by_col()
-		self.connect_led_5v()
-		self.connect_shift_register_and_resistor()
-		self.connect_connector_and_mcu()
+		self.route_templates.load() # picks up routes captured since the last run
+		src_dir = path.dirname(path.abspath(__file__))
+		sources = [path.join(src_dir, f) for f in ['switch_placement.py', 'geometry.py', 'maze_router.py', 'drc_lite.py', 'pad_cache.py']]
+		if path.exists(self.route_templates.filename):
+			sources.append(self.route_templates.filename)
+		self.stage_cache = None
+		if self.use_stage_cache:
+			self.stage_cache = StageCache(sources=sources)
+		elif self.use_maze_cache and set(MAZE_STAGES) & set(self.route_stages): # the maze is most of an uncached run
+			self.stage_cache = StageCache('autogen_maze.pickle', sources)
+		for stage in self.route_stages:
+			self.run_route_stage(stage)
+		self.track_buf.set_tag('')
+		if self.stage_cache is not None:
+			self.stage_cache.save()
+		# zero length, duplicate and collinear pieces, after the cache so it keeps raw stage output
+		self.track_buf.optimize()
+		if 'nets' in self.ripup or 'region' in self.ripup: # stages are routed whole, keep what was ripped up
+			self.track_buf.select(*self.in_scope(self.track_buf.segments(), self.track_buf.vias(),
+				self.board_copper(self.board.GetTracks())))
+		if self.is_net_check:
+			self.check_nets()
+		if self.is_clearance_check: # before anything is written
+			self.check_clearance()
+		# copper pour needs the tracks on the board, direct write only works without it
+		is_direct_write = self.is_direct_write and self.is_fast_mode
+		self.track_length = self.track_buf.total_length()
+		self.via_count = self.track_buf.via_count()
+		if not is_direct_write:
+			self.commit_tracks()
 		self.place_edge_cut()
 		if (self.is_fast_mode == False): # copper pour is slow
-			self.place_copper_pour()
+			if self.is_incremental_pour and BACKEND == 'pcbnew': # cached fills need pcbnew's ZONE_FILLER
+				self.place_copper_pour_incremental()
+			else:
+				self.place_copper_pour()
 		Refresh()
 		#SaveBoard(self.filename, self.board)
-		SaveBoard('autogen.kicad_pcb', self.board)
+		# written next to the output and renamed, KiCad never sees a half written board
+		tmp_filename = self.output_filename + '.tmp'
+		SaveBoard(tmp_filename, self.board)
+		if is_direct_write:
+			self.track_buf.write_into(tmp_filename)
+		replace(tmp_filename, self.output_filename)
 		
 	def unit_test(self):
 		self.place_copper_pour()
@@ -690,24 +1207,93 @@ class kbd_place_n_route(ActionPlugin):
 
 #kbd_place_n_route().register()
 
+def watch(plugin, params_file, interval=0.2):
+	# Keep the board loaded and run again whenever params_file changes, parameters missing
+	# from the file keep their default, routing stages with unchanged inputs come from the stage cache
+	defaults = plugin.get_params()
+	mtime = None
+	print(f"Watching {params_file}, Ctrl-C to stop")
+	try:
+		while True:
+			try:
+				cur = path.getmtime(params_file)
+			except OSError:
+				cur = None
+			if cur is None or cur == mtime:
+				time.sleep(interval)
+				continue
+			mtime = cur
+			try:
+				with open(params_file, 'r') as f:
+					params = json.load(f)
+				plugin.set_params({**defaults, **params})
+			except (ValueError, TypeError) as e: # half saved or invalid file, wait for the next save
+				print(f"Error: {params_file}: {e}")
+				continue
+			start = time.perf_counter()
+			try:
+				plugin.Run()
+			except ClearanceError as e:
+				print(f"Error: {e}")
+				continue
+			print(f"{plugin.output_filename} updated in {time.perf_counter() - start:.2f} s")
+	except KeyboardInterrupt:
+		pass
+
 def main():
-	if len(sys.argv) > 1:
-		if sys.argv[1] == '-q':
-			# run in fast mode, ie no copper pour
-			is_fast_mode = True
-	else:
-		is_fast_mode = False
-	plugin = kbd_place_n_route(is_fast_mode)
-	'''
-	print('# POWER RAIL TOP PAD')
-	plugin.gen_led_track('+5V')
-	print('# POWER RAIL BOTTOM PAD')
-	plugin.gen_led_track('GND')
-	for i in range(5):
-		print(f'# LEDx{i}')
-		plugin.gen_led_track(f'Net-(LED0{i}-DIN)')
-	'''
-	plugin.Run()
+	# run in fast mode, ie no copper pour
+	is_fast_mode = '-q' in sys.argv
+	# refill only the copper pour tiles that changed since the last run
+	is_incremental_pour = '-i' in sys.argv
+	# with -q, write tracks and vias directly into autogen.kicad_pcb instead of adding them to the board
+	is_direct_write = '-d' in sys.argv
+	# replay routing stages whose inputs didn't change since the last run
+	use_stage_cache = '-c' in sys.argv
+	# route the maze again even when autogen_maze.pickle has a route for the same inputs
+	no_maze_cache = '-m' in sys.argv
+	# check clearance of the generated tracks and vias, no board is written if it fails
+	is_clearance_check = '-k' in sys.argv
+	# report nets the generated tracks leave unconnected, dangling track ends and shorts
+	is_net_check = '-n' in sys.argv
+	# count and time backend calls per stage, writes autogen_trace.folded
+	is_trace = '-t' in sys.argv or environ.get('KBD_TRACE', '0') != '0'
+	# -w params.json: keep running and redo the layout every time params.json is saved
+	params_file = sys.argv[sys.argv.index('-w') + 1] if '-w' in sys.argv[:-1] else None
+	# -r stage=a,b -r net=a,b -r region=x0,y0,x1,y1 (mm): only rip up and route that part again
+	ripup = {}
+	for i, arg in enumerate(sys.argv[:-1]):
+		if arg == '-r':
+			key, _, value = sys.argv[i+1].partition('=')
+			ripup[key] = value.split(',')
+	if is_trace:
+		from kbd_trace import Tracer
+		import track_buffer, geometry, pour_cache
+		tracer = Tracer()
+		tracer.install(kbd_place_n_route, [sys.modules[__name__], track_buffer, geometry, pour_cache])
+	plugin = kbd_place_n_route(is_fast_mode, is_incremental_pour, is_direct_write, use_stage_cache or params_file is not None, is_clearance_check, is_net_check)
+	if is_incremental_pour and not is_fast_mode and BACKEND != 'pcbnew':
+		print("Warning: -i needs pcbnew's zone filler, the copper pour is written unfilled, KiCad fills it on the next fill (B)")
+	plugin.route_workers = cpu_count() or 1 # worker processes are fine outside of KiCad
+	plugin.use_maze_cache = not no_maze_cache
+	try:
+		if set(ripup) - {'stage', 'net', 'region'}:
+			raise ValueError(f"Unknown rip-up scope: {', '.join(set(ripup) - {'stage', 'net', 'region'})}")
+		region = [float(v) for v in ripup['region']] if 'region' in ripup else None
+		plugin.set_ripup(ripup.get('stage'), ripup.get('net'), region)
+	except ValueError as e:
+		print(f"Error: {e}")
+		sys.exit(1)
+	if params_file:
+		watch(plugin, params_file)
+		return
+	try:
+		plugin.Run()
+	except ClearanceError as e:
+		print(f"Error: {e}")
+		sys.exit(1)
+	if is_trace:
+		tracer.report()
+		tracer.write_folded()
 	#plugin.load_board()
 	#plugin.remove_old_tracks()
 	#plugin.place_via_for_led()
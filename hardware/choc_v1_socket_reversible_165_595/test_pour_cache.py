@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Island removal of the incremental copper pour on synthetic tile fills, runs without pcbnew
+# usage: python3 -m pytest test_pour_cache.py (or python3 test_pour_cache.py)
+from kbd_backend import *
+from pour_cache import PourCache
+
+F, B = str(F_Cu), str(B_Cu)
+
+def rect(x0, y0, x1, y1):
+	# outline ring of a rectangle in mm, as store() keeps it
+	return [(FromMM(x0), FromMM(y0)), (FromMM(x1), FromMM(y0)), (FromMM(x1), FromMM(y1)), (FromMM(x0), FromMM(y1))]
+
+def pad(x, y, r=0.5):
+	return (FromMM(x), FromMM(y), FromMM(r))
+
+def track(x0, y0, x1, y1, half_width=0.1):
+	return (FromMM(x0), FromMM(y0), FromMM(x1), FromMM(y1), FromMM(half_width))
+
+def kept(merged, layer):
+	return sorted(rings[0][0] for rings in merged.get(layer, []))
+
+def test_island_joined_through_neighbour_tile():
+	# the piece of tile 1,0 has no anchor of its own, it reaches the pad of tile 0,0 over the seam
+	fills = {
+		'0,0': {F: [[rect(0, 0, 10.5, 10)]]},
+		'1,0': {F: [[rect(10, 2, 20, 8)]]},
+	}
+	merged = PourCache('').remove_islands(fills, {F: ([pad(2, 5)], [])})
+	assert kept(merged, F) == [rect(0, 0, 10.5, 10)[0], rect(10, 2, 20, 8)[0]]
+
+def test_lone_island_removed():
+	fills = {
+		'0,0': {F: [[rect(0, 0, 10.5, 10)]]},
+		'1,0': {F: [[rect(12, 2, 20, 8)]]}, # clear of the seam
+	}
+	merged = PourCache('').remove_islands(fills, {F: ([pad(2, 5)], [])})
+	assert kept(merged, F) == [rect(0, 0, 10.5, 10)[0]]
+
+def test_chain_of_tiles():
+	# anchored in the first tile only, joined piece by piece across two seams
+	fills = {
+		'0,0': {F: [[rect(0, 0, 10.5, 10)]]},
+		'1,0': {F: [[rect(10, 4, 20.5, 6)]]},
+		'2,0': {F: [[rect(20, 0, 30, 10)]]},
+	}
+	merged = PourCache('').remove_islands(fills, {F: ([pad(2, 5)], [])})
+	assert len(kept(merged, F)) == 3
+
+def test_track_crossing_island_keeps_it():
+	# no end of the track lies on the island, it runs across it
+	fills = {'0,0': {F: [[rect(0, 0, 10, 10)], [rect(20, 0, 30, 10)]]}}
+	merged = PourCache('').remove_islands(fills, {F: ([], [track(-5, 5, 15, 5)])})
+	assert kept(merged, F) == [rect(0, 0, 10, 10)[0]]
+
+def test_anchor_in_hole_does_not_count():
+	# the pad sits in a hole of the fill (its clearance), away from the copper
+	fills = {'0,0': {F: [[rect(0, 0, 10, 10), rect(3, 3, 7, 7)]]}}
+	merged = PourCache('').remove_islands(fills, {F: ([pad(5, 5, 0.5)], [])})
+	assert kept(merged, F) == []
+
+def test_layers_are_separate():
+	# an anchor on F.Cu doesn't keep the B.Cu copper at the same place
+	fills = {'0,0': {F: [[rect(0, 0, 10, 10)]], B: [[rect(0, 0, 10, 10)]]}}
+	merged = PourCache('').remove_islands(fills, {F: ([pad(5, 5)], []), B: ([], [])})
+	assert kept(merged, F) == [rect(0, 0, 10, 10)[0]]
+	assert kept(merged, B) == []
+
+if __name__ == "__main__":
+	for name, test in sorted(globals().items()):
+		if name.startswith('test_'):
+			test()
+			print(f"{name}: ok")
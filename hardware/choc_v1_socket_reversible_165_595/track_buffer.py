@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+from array import array
+from uuid import uuid4
+from kbd_backend import *
+from kicad_sexpr import new_node, xy_node, uuid_node, emit, fmt_mm, quote
+
+SEG_FIELDS = 6 # x0, y0, x1, y1, width, layer
+VIA_FIELDS = 4 # x, y, drill, width
+
+class TrackBuffer:
+	# Segments and vias waiting to be added to the board, kept in flat int arrays
+	# so routing never crosses SWIG until everything is committed at once
+	def __init__(self):
+		self.seg = array('q')
+		self.via = array('q')
+		self.seg_tag = array('H') # generator of each segment and via, index into tags
+		self.via_tag = array('H')
+		self.tags = [''] # 0: no generator
+		self.tag = 0 # tag of the items added from now on
+
+	def set_tag(self, name):
+		# Items added from now on belong to name, '' for none
+		if name not in self.tags:
+			self.tags.append(name)
+		self.tag = self.tags.index(name)
+
+	def add_track(self, start, end, layer, width):
+		self.seg.extend((start.x, start.y, end.x, end.y, width, layer))
+		self.seg_tag.append(self.tag)
+
+	def add_via(self, pos, drill, width):
+		self.via.extend((pos.x, pos.y, drill, width))
+		self.via_tag.append(self.tag)
+
+	def extend(self, seg, via):
+		# append items recorded from another buffer, they get the current tag
+		self.seg.extend(seg)
+		self.via.extend(via)
+		self.seg_tag.extend([self.tag] * (len(seg) // SEG_FIELDS))
+		self.via_tag.extend([self.tag] * (len(via) // VIA_FIELDS))
+
+	def select(self, seg_ids, via_ids):
+		# Keep only the segments and vias with the given indexes
+		seg, via = array('q'), array('q')
+		for i in seg_ids:
+			seg.extend(self.seg[i*SEG_FIELDS:(i+1)*SEG_FIELDS])
+		for i in via_ids:
+			via.extend(self.via[i*VIA_FIELDS:(i+1)*VIA_FIELDS])
+		self.seg_tag = array('H', [self.seg_tag[i] for i in seg_ids])
+		self.via_tag = array('H', [self.via_tag[i] for i in via_ids])
+		self.seg, self.via = seg, via
+
+	def segments(self):
+		s = self.seg
+		return [tuple(s[i:i+SEG_FIELDS]) for i in range(0, len(s), SEG_FIELDS)]
+
+	def vias(self):
+		v = self.via
+		return [tuple(v[i:i+VIA_FIELDS]) for i in range(0, len(v), VIA_FIELDS)]
+
+	def track_count(self):
+		return len(self.seg) // SEG_FIELDS
+
+	def via_count(self):
+		return len(self.via) // VIA_FIELDS
+
+	def total_length(self):
+		# total segment length in internal units
+		s = self.seg
+		return sum(((s[i+2]-s[i])**2 + (s[i+3]-s[i+1])**2)**0.5 for i in range(0, len(s), SEG_FIELDS))
+
+	def optimize(self):
+		# Drop zero length and duplicate segments, merge collinear runs and coincident vias
+		# generated tracks have no net, but segments sharing an end point are the same copper,
+		# so the graph is per layer: a point joining exactly two collinear segments of the
+		# same width, the same tag and no via is removed
+		segs = {}
+		for (x0, y0, x1, y1, width, layer), tag in zip(self.segments(), self.seg_tag):
+			if (x0, y0) == (x1, y1):
+				continue
+			a, b = sorted(((x0, y0), (x1, y1)))
+			segs.setdefault((a, b, width, layer), tag)
+		vias = {}
+		for (x, y, drill, width), tag in zip(self.vias(), self.via_tag):
+			if (x, y) not in vias or width > vias[(x, y)][1]:
+				vias[(x, y)] = (drill, width, vias[(x, y)][2] if (x, y) in vias else tag)
+		segs = [list(key) + [tag] for key, tag in segs.items()]
+		ends = {} # (point, layer) -> segment indexes
+		for i, (a, b, width, layer, tag) in enumerate(segs):
+			ends.setdefault((a, layer), set()).add(i)
+			ends.setdefault((b, layer), set()).add(i)
+		for (p, layer), ids in list(ends.items()):
+			if len(ids) != 2 or p in vias:
+				continue
+			i, j = ids
+			if segs[i][2] != segs[j][2] or segs[i][4] != segs[j][4]:
+				continue
+			q = segs[i][1] if segs[i][0] == p else segs[i][0] # far ends
+			r = segs[j][1] if segs[j][0] == p else segs[j][0]
+			# p between q and r on one line
+			if (q[0]-p[0])*(r[1]-p[1]) != (q[1]-p[1])*(r[0]-p[0]) or (q[0]-p[0])*(r[0]-p[0]) + (q[1]-p[1])*(r[1]-p[1]) >= 0:
+				continue
+			# segment j is absorbed into i
+			segs[i][0], segs[i][1] = q, r
+			ends[(r, layer)].discard(j)
+			ends[(r, layer)].add(i)
+			ends[(p, layer)] = set()
+			segs[j] = None
+		seg, seg_tag = array('q'), array('H')
+		for s in segs:
+			if s is not None:
+				(x0, y0), (x1, y1), width, layer, tag = s
+				seg.extend((x0, y0, x1, y1, width, layer))
+				seg_tag.append(tag)
+		via, via_tag = array('q'), array('H')
+		for (x, y), (drill, width, tag) in vias.items():
+			via.extend((x, y, drill, width))
+			via_tag.append(tag)
+		self.seg, self.seg_tag = seg, seg_tag
+		self.via, self.via_tag = via, via_tag
+
+	def clear(self):
+		self.seg = array('q')
+		self.via = array('q')
+		self.seg_tag = array('H')
+		self.via_tag = array('H')
+
+	def commit(self, board):
+		# Add everything to the board in bulk mode and rebuild connectivity once
+		# tagged items go into a PCB_GROUP named after the tag, returns tag -> added items
+		added = {}
+		default_width = FromMM(0.2)
+		for (x0, y0, x1, y1, width, layer), tag in zip(self.segments(), self.seg_tag):
+			track = PCB_TRACK(board)
+			track.SetStart(VECTOR2I(x0, y0))
+			track.SetEnd(VECTOR2I(x1, y1))
+			if (width != default_width):
+				track.SetWidth(width)
+			if (layer != F_Cu):
+				track.SetLayer(layer)
+			board.Add(track, ADD_MODE_BULK_APPEND, True)
+			added.setdefault(self.tags[tag], []).append(track)
+		for (x, y, drill, width), tag in zip(self.vias(), self.via_tag):
+			via = PCB_VIA(board)
+			via.SetPosition(VECTOR2I(x, y))
+			via.SetDrill(drill)
+			via.SetWidth(width)
+			board.Add(via, ADD_MODE_BULK_APPEND, True)
+			added.setdefault(self.tags[tag], []).append(via)
+		groups = {group.GetName(): group for group in board.Groups()}
+		for name, items in added.items():
+			if name == '':
+				continue
+			if name not in groups:
+				groups[name] = PCB_GROUP(board)
+				groups[name].SetName(name)
+				board.Add(groups[name])
+			for item in items:
+				groups[name].AddItem(item)
+		board.BuildConnectivity()
+		self.clear()
+		return added
+
+	def to_sexpr(self):
+		# segment/via nodes in .kicad_pcb format, one top level item per line block
+		layer_names = {F_Cu: 'F.Cu', B_Cu: 'B.Cu'}
+		out = []
+		members = {} # tag -> uuids, written as groups like commit() does
+		for (x0, y0, x1, y1, width, layer), tag in zip(self.segments(), self.seg_tag):
+			uuid = str(uuid4())
+			members.setdefault(tag, []).append(quote(uuid))
+			node = new_node('segment',
+				xy_node('start', VECTOR2I(x0, y0)),
+				xy_node('end', VECTOR2I(x1, y1)),
+				new_node('width', fmt_mm(width)),
+				new_node('layer', quote(layer_names[layer])),
+				new_node('net', b'0'),
+				new_node('uuid', quote(uuid)))
+			out.append(b'\n\t')
+			emit(node, None, out, 1)
+		for (x, y, drill, width), tag in zip(self.vias(), self.via_tag):
+			uuid = str(uuid4())
+			members.setdefault(tag, []).append(quote(uuid))
+			node = new_node('via',
+				xy_node('at', VECTOR2I(x, y)),
+				new_node('size', fmt_mm(width)),
+				new_node('drill', fmt_mm(drill)),
+				new_node('layers', b'"F.Cu"', b'"B.Cu"'),
+				new_node('net', b'0'),
+				new_node('uuid', quote(uuid)))
+			out.append(b'\n\t')
+			emit(node, None, out, 1)
+		for tag, uuids in sorted(members.items()):
+			if self.tags[tag] == '':
+				continue
+			node = new_node('group', quote(self.tags[tag]), uuid_node(), new_node('members', *uuids))
+			out.append(b'\n\t')
+			emit(node, None, out, 1)
+		return b''.join(out)
+
+	def write_into(self, filename):
+		# Append the buffered items to a saved .kicad_pcb, skipping the board entirely
+		with open(filename, 'rb') as f:
+			data = f.read()
+		end = data.rstrip().rfind(b')')
+		with open(filename, 'wb') as f:
+			f.write(data[:end].rstrip() + self.to_sexpr() + b'\n' + data[end:])
+		self.clear()